@@ -0,0 +1,360 @@
+"""异步流式客户端：在一个事件循环中处理多个对话的流式请求
+
+标准库 asyncio 实现的 HTTP/1.1 客户端（支持 TLS、chunked 传输和长连接复用），
+请求和响应的处理方式与 ChatEngine.send_request 相同：SSE 由 SSEParser 增量解析，
+文本和结束事件通过引擎的 post 投递回引擎所属的线程，超时、取消和 401/403/429 等错误的提示也一致。
+
+事件循环运行在一个后台线程中（第一次使用时启动），任意数量的流式请求共用这一个线程。
+与 Tk 界面配合时，引擎的 post 即界面的 post_ui，结果经界面队列回到主线程，由 flush_ui_queue 按帧处理。
+不支持代理（需要代理时使用默认的 requests 客户端）。
+"""
+import asyncio
+import json
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit
+
+import certifi
+
+from chat_engine import (
+    SSEParser, ToolCallAccumulator, api_error_message, json_loads,
+    SESSION_POOL_MAXSIZE, SSE_READ_SIZE
+)
+
+# 响应头的最大长度
+MAX_HEADER_SIZE = 64 * 1024
+# 关闭客户端时等待连接关闭的秒数
+CLOSE_TIMEOUT = 2
+
+class HTTPError(Exception):
+    """连接或 HTTP 协议错误"""
+
+class _TaskCanceller:
+    """登记到 RequestHandle 的对象：从任意线程取消事件循环中的请求"""
+    def __init__(self, loop, task):
+        self._loop = loop
+        self._task = task
+
+    def close(self):
+        if self._task.done():
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        except RuntimeError:
+            # 客户端已关闭，事件循环中的请求都已取消
+            pass
+
+class _Connection:
+    """一条 HTTP/1.1 连接"""
+    def __init__(self, key, reader, writer, connect_time=None):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        # 建立连接（TCP + TLS 握手）的秒数，放回空闲连接后清除，复用时为 None
+        self.connect_time = connect_time
+
+    def close(self):
+        self.writer.close()
+
+class _Response:
+    """一个响应：状态码、响应头，以及按块读取的响应体"""
+    def __init__(self, connection, status, headers, read_timeout):
+        self.connection = connection
+        self.status = status
+        self.headers = headers
+        self._read_timeout = read_timeout
+        self._chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        length = headers.get('content-length')
+        self._remaining = int(length) if length is not None and not self._chunked else None
+        # chunked 传输中当前块剩余的字节数
+        self._chunk_left = 0
+        self._keep_alive = headers.get('connection', '').lower() != 'close'
+        self.done = self._remaining == 0
+
+    async def _read(self, n):
+        data = await asyncio.wait_for(self.connection.reader.read(n), self._read_timeout)
+        if not data:
+            raise HTTPError("连接意外关闭")
+        return data
+
+    async def _readline(self):
+        line = await asyncio.wait_for(self.connection.reader.readline(), self._read_timeout)
+        if not line.endswith(b"\n"):
+            raise HTTPError("连接意外关闭")
+        return line
+
+    async def read_chunk(self):
+        """读取下一块响应体，读完后返回 b''"""
+        if self.done:
+            return b""
+        if self._chunked:
+            if self._chunk_left == 0:
+                line = await self._readline()
+                try:
+                    size = int(line.split(b";", 1)[0].strip(), 16)
+                except ValueError:
+                    raise HTTPError("无效的 chunked 数据")
+                if size == 0:
+                    # 跳过 trailer，直到空行
+                    while (await self._readline()).strip():
+                        pass
+                    self.done = True
+                    return b""
+                self._chunk_left = size
+            data = await self._read(min(self._chunk_left, SSE_READ_SIZE))
+            self._chunk_left -= len(data)
+            if self._chunk_left == 0:
+                await self._readline()
+            return data
+        if self._remaining is not None:
+            data = await self._read(min(self._remaining, SSE_READ_SIZE))
+            self._remaining -= len(data)
+            self.done = self._remaining == 0
+            return data
+        # 没有长度信息：读到连接关闭为止，连接不能复用
+        self._keep_alive = False
+        data = await asyncio.wait_for(self.connection.reader.read(SSE_READ_SIZE), self._read_timeout)
+        if not data:
+            self.done = True
+        return data
+
+    async def read(self):
+        """读取剩余的全部响应体"""
+        chunks = []
+        while True:
+            chunk = await self.read_chunk()
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    @property
+    def reusable(self):
+        return self.done and self._keep_alive
+
+class AsyncStreamClient:
+    """在后台事件循环中发送流式请求，按 (协议, 主机, 端口) 复用长连接
+
+    start_request 可从任意线程调用；也可以在事件循环中直接 await send_request。
+    """
+    def __init__(self, maxsize=SESSION_POOL_MAXSIZE):
+        # 每个主机保留的最大空闲连接数
+        self._maxsize = maxsize
+        self._idle = {}
+        self._ssl_context = None
+        self._lock = threading.Lock()
+        self.loop = None
+        self._thread = None
+
+    def _ensure_loop(self):
+        """第一次使用时启动事件循环线程"""
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self.loop.run_forever, name="async-client", daemon=True)
+                self._thread.start()
+            return self.loop
+
+    def submit(self, coroutine):
+        """在事件循环中运行协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop())
+
+    def start_request(self, engine, handle, url, headers, data, timeouts, metrics):
+        """在事件循环中发送 engine 的一次流式请求（对应 ChatEngine.send_request）"""
+        self.submit(self.send_request(engine, handle, url, headers, data, timeouts, metrics))
+
+    async def send_request(self, engine, handle, url, headers, data, timeouts, metrics):
+        connect_timeout, first_byte_timeout, total_timeout = timeouts
+        loop = asyncio.get_running_loop()
+        # 总时限到达时取消请求
+        deadline = loop.call_later(total_timeout, handle.cancel, "timeout")
+        # 请求未正常结束时记录原因，已生成的部分内容仍会保存到历史
+        end_reason = None
+        tool_calls = ToolCallAccumulator()
+        response = None
+        try:
+            # 登记后 handle.cancel 会取消本协程（连接和读取都能被打断）
+            if not handle.attach(_TaskCanceller(loop, asyncio.current_task())):
+                return
+            body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            response = await self.post(url, headers, body, connect_timeout, first_byte_timeout)
+            metrics.connected(response.connection.connect_time)
+            metrics.response(response.status)
+
+            if response.status == 200:
+                parser = SSEParser()
+                while True:
+                    chunk = await response.read_chunk()
+                    if not chunk or handle.cancelled:
+                        break
+                    for event, payload in parser.feed(chunk):
+                        if event != "message" or payload == b"[DONE]":
+                            continue
+                        try:
+                            json_data = json_loads(payload)
+                        except ValueError:
+                            continue
+                        choices = json_data.get('choices')
+                        if not choices:
+                            continue
+                        delta = choices[0].get('delta') or {}
+                        content = delta.get('content')
+                        if content:
+                            metrics.token(content)
+                            engine.post(engine.feed_text, content)
+                        if delta.get('tool_calls'):
+                            tool_calls.feed(delta['tool_calls'])
+            else:
+                engine.post(engine.notice, api_error_message(response.status, await response.read()))
+                end_reason = "error"
+
+        except asyncio.CancelledError:
+            # 被 handle 取消（停止或超过总时限）；关闭客户端时也按停止处理
+            if not handle.cancelled:
+                end_reason = "stopped"
+        except asyncio.TimeoutError as e:
+            if not handle.cancelled:
+                end_reason = "error"
+                engine.post(engine.notice, f"请求超时: {str(e) or '等待响应数据超时'}")
+        except (OSError, ssl.SSLError, HTTPError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            if not handle.cancelled:
+                end_reason = "error"
+                engine.post(engine.notice, f"网络请求错误: {str(e) or type(e).__name__}")
+        except Exception as e:
+            if not handle.cancelled:
+                end_reason = "error"
+                engine.post(engine.feed_text, f"\n请求错误: {str(e)}\n")
+        finally:
+            deadline.cancel()
+            metrics.finish()
+            if response is not None:
+                self._release(response)
+            if handle.cancelled:
+                end_reason = handle.reason
+            # 在引擎所属线程中保存消息到历史（排在所有文本之后）；停止时已直接结束的请求不再投递
+            if not handle.detached:
+                engine.post(engine.finish_assistant_message, end_reason, tool_calls.calls())
+
+    async def post(self, url, headers, body, connect_timeout, read_timeout):
+        """发送 POST 请求并读取响应头，返回 _Response；响应体由调用方读取后交给 _release"""
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise HTTPError(f"不支持的地址: {url}")
+        default_port = 443 if parts.scheme == 'https' else 80
+        port = parts.port or default_port
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        host = f"[{parts.hostname}]" if ':' in parts.hostname else parts.hostname
+        if port != default_port:
+            host += f":{port}"
+        lines = [f"POST {path} HTTP/1.1", f"Host: {host}", "Accept-Encoding: identity",
+                 "Connection: keep-alive", f"Content-Length: {len(body)}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body
+
+        # 复用的空闲连接可能已被服务端关闭，这种情况下换一条新连接重试一次
+        while True:
+            connection, reused = self._idle_connection(key), True
+            if connection is None:
+                connection, reused = await self._connect(key, connect_timeout), False
+            try:
+                connection.writer.write(request)
+                await connection.writer.drain()
+                return await self._read_head(connection, read_timeout)
+            except asyncio.TimeoutError:
+                connection.close()
+                raise
+            except (OSError, HTTPError, asyncio.IncompleteReadError):
+                connection.close()
+                if not reused:
+                    raise
+            except BaseException:
+                connection.close()
+                raise
+
+    async def _connect(self, key, timeout):
+        scheme, hostname, port = key
+        ssl_context = None
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context(cafile=certifi.where())
+            ssl_context = self._ssl_context
+        started = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(hostname, port, ssl=ssl_context, limit=MAX_HEADER_SIZE),
+                timeout
+            )
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(f"连接 {hostname}:{port} 超时")
+        return _Connection(key, reader, writer, time.perf_counter() - started)
+
+    async def _read_head(self, connection, read_timeout):
+        """读取状态行和响应头（跳过 1xx 响应）"""
+        while True:
+            try:
+                head = await asyncio.wait_for(connection.reader.readuntil(b"\r\n\r\n"), read_timeout)
+            except asyncio.IncompleteReadError as e:
+                if not e.partial:
+                    raise HTTPError("服务端关闭了连接")
+                raise
+            lines = head.decode('latin-1').split("\r\n")
+            status_line = lines[0].split(" ", 2)
+            if len(status_line) < 2 or not status_line[0].startswith("HTTP/"):
+                raise HTTPError(f"无效的响应: {lines[0][:100]}")
+            status = int(status_line[1])
+            if 100 <= status < 200:
+                continue
+            headers = {}
+            for line in lines[1:]:
+                name, sep, value = line.partition(":")
+                if sep:
+                    headers[name.strip().lower()] = value.strip()
+            return _Response(connection, status, headers, read_timeout)
+
+    def _idle_connection(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            connection = idle.pop()
+            if not connection.reader.at_eof() and not connection.writer.is_closing():
+                return connection
+            connection.close()
+        return None
+
+    def _release(self, response):
+        """响应体已读完且服务端允许时放回空闲连接，否则关闭"""
+        connection = response.connection
+        idle = self._idle.setdefault(connection.key, [])
+        if response.reusable and len(idle) < self._maxsize:
+            connection.connect_time = None
+            idle.append(connection)
+        else:
+            connection.close()
+
+    async def _shutdown(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for idle in self._idle.values():
+            for connection in idle:
+                connection.close()
+        self._idle.clear()
+
+    def close(self):
+        """取消进行中的请求、关闭全部连接并停止事件循环"""
+        with self._lock:
+            loop, thread = self.loop, self._thread
+            self.loop = self._thread = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(CLOSE_TIMEOUT)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(CLOSE_TIMEOUT)
+        if not thread.is_alive():
+            loop.close()
@@ -0,0 +1,216 @@
+"""批量执行：无界面地把 JSONL 文件中的提示词交给 ChatEngine
+
+提示词文件每行一个 JSON 对象，格式与 custom_contents.json 的条目相同（{"name": ..., "content": ...}），
+也可以是单个字符串。文件按行流式读取，以有限的并发数执行，各条共享同一个连接池和工具解释器；
+每完成一条立即写出一行 JSONL 结果（包含延迟），结束时在标准错误输出汇总的延迟分布和吞吐量。
+"""
+import json
+import queue
+import sys
+import threading
+import time
+
+from async_client import AsyncStreamClient
+from chat_engine import ChatEngine, EngineListener, SessionPool, HTTP_CLIENT, TOOL_INTERPRETER
+from config_store import ConfigStore
+from metrics import MetricsRecorder, percentile
+from tool_host import ToolHost, ToolResultCache, INTERPRETERS
+from tool_registry import ToolRegistry
+
+# 默认并发数
+BATCH_CONCURRENCY = 4
+
+def read_prompts(path):
+    """逐行读取提示词文件，产生 (行号, 条目, 错误)；空行被跳过"""
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"无法解析: {str(e)}"
+                continue
+            if isinstance(item, str):
+                item = {"content": item}
+            if not isinstance(item, dict) or not item.get('content'):
+                yield line_number, None, "缺少 content"
+                continue
+            yield line_number, item, None
+
+class BatchListener(EngineListener):
+    """记录一条提示词执行过程中的首个输出时间、系统提示和工具调用数"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.chars = 0
+        self.tool_calls = 0
+        self.notices = []
+        self.end_reason = None
+
+    def on_notice(self, text):
+        self.notices.append(text)
+
+    def on_reply_text(self, text, tags=(), key=None):
+        if key is not None:
+            self.tool_calls += 1
+            return
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.started
+        self.chars += len(text)
+
+    def on_reply_finished(self, reply):
+        self.end_reason = reply.end_reason
+
+class BatchRunner:
+    """按有限并发执行提示词，结果逐条写入 output"""
+    def __init__(self, config, config_name, concurrency=BATCH_CONCURRENCY, config_store=None, metrics=None):
+        self.config = config
+        self.config_name = config_name
+        self.concurrency = max(1, concurrency)
+        self.config_store = config_store
+        # 各条提示词共享的资源：连接池的容量与并发数一致
+        self.session_pool = SessionPool(maxsize=self.concurrency)
+        # 配置使用异步客户端时，全部流式请求在同一个事件循环中处理
+        self.async_client = None
+        if config.get('http_client', HTTP_CLIENT) == 'asyncio':
+            self.async_client = AsyncStreamClient(maxsize=self.concurrency)
+        self.tool_registry = ToolRegistry('tools_config.json')
+        self.tool_host = ToolHost(INTERPRETERS[TOOL_INTERPRETER])
+        self.tool_host.set_definitions(self.tool_registry.definitions())
+        self.tool_host.prewarm()
+        self.tool_cache = ToolResultCache()
+        # 各条请求和工具调用的指标（metrics.MetricsRecorder），为 None 时不记录
+        self.metrics = metrics
+        self._write_lock = threading.Lock()
+
+    def run_one(self, line_number, item):
+        """在当前线程中执行一条提示词，返回结果记录"""
+        listener = BatchListener()
+        engine = ChatEngine(
+            dict(self.config), self.config_name, listener=listener,
+            session_pool=self.session_pool, tool_registry=self.tool_registry,
+            tool_host=self.tool_host, tool_cache=self.tool_cache, config_store=self.config_store,
+            async_client=self.async_client, metrics=self.metrics
+        )
+        try:
+            engine.send(item['content'])
+            engine.wait()
+        finally:
+            engine.close()
+        replies = [m['content'] for m in engine.messages if m['role'] == 'assistant']
+        return {
+            "line": line_number,
+            "name": item.get('name'),
+            "prompt": item['content'],
+            "ok": listener.end_reason is None,
+            "end_reason": listener.end_reason,
+            "response": replies[-1] if replies else "",
+            "steps": engine.agent_steps,
+            "tool_calls": listener.tool_calls,
+            "notices": listener.notices,
+            "chars": listener.chars,
+            "first_token_s": round(listener.first_token, 4) if listener.first_token is not None else None,
+            "latency_s": round(time.perf_counter() - listener.started, 4)
+        }
+
+    def run(self, prompts, output):
+        """执行 prompts（read_prompts 产生的条目）中的全部提示词，返回汇总统计"""
+        work = queue.Queue(maxsize=self.concurrency * 2)
+        results = []
+
+        def write(result):
+            with self._write_lock:
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                results.append(result)
+
+        def worker():
+            while True:
+                entry = work.get()
+                if entry is None:
+                    return
+                line_number, item, error = entry
+                if error is not None:
+                    result = {"line": line_number, "ok": False, "error": error}
+                else:
+                    try:
+                        result = self.run_one(line_number, item)
+                    except Exception as e:
+                        result = {"line": line_number, "name": item.get('name'), "ok": False, "error": str(e)}
+                write(result)
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(self.concurrency)]
+        for thread in workers:
+            thread.start()
+        # 文件按行读取，队列有上限，大文件不会一次载入内存
+        for entry in prompts:
+            work.put(entry)
+        for _ in workers:
+            work.put(None)
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies = [r['latency_s'] for r in results if 'latency_s' in r]
+        first_tokens = [r['first_token_s'] for r in results if r.get('first_token_s') is not None]
+        chars = sum(r.get('chars', 0) for r in results)
+        return {
+            "prompts": len(results),
+            "ok": sum(1 for r in results if r['ok']),
+            "failed": sum(1 for r in results if not r['ok']),
+            "concurrency": self.concurrency,
+            "elapsed_s": round(elapsed, 3),
+            "prompts_per_s": round(len(results) / elapsed, 3) if elapsed > 0 else None,
+            "chars_per_s": round(chars / elapsed, 1) if elapsed > 0 else None,
+            "latency_p50_s": percentile(latencies, 50),
+            "latency_p90_s": percentile(latencies, 90),
+            "latency_p99_s": percentile(latencies, 99),
+            "latency_max_s": max(latencies) if latencies else None,
+            "first_token_p50_s": percentile(first_tokens, 50),
+            "first_token_p90_s": percentile(first_tokens, 90)
+        }
+
+    def close(self):
+        self.session_pool.close()
+        if self.async_client is not None:
+            self.async_client.close()
+        self.tool_host.close()
+
+def run_batch(path, config_name=None, output_path='-', concurrency=BATCH_CONCURRENCY, metrics_port=0):
+    """命令行入口：返回退出码（全部成功为 0，有失败的条目为 1，无法开始为 2）"""
+    config_store = ConfigStore('configs.json')
+    names = config_store.names()
+    config_name = config_name or (names[0] if names else None)
+    config = config_store.get(config_name) if config_name else None
+    if config is None:
+        print(f"找不到配置: {config_name}", file=sys.stderr)
+        return 2
+    try:
+        output = sys.stdout if output_path == '-' else open(output_path, 'w', encoding='utf-8')
+    except OSError as e:
+        print(f"无法写入结果文件: {str(e)}", file=sys.stderr)
+        return 2
+
+    metrics = MetricsRecorder()
+    if metrics_port:
+        try:
+            metrics.serve(metrics_port)
+        except OSError as e:
+            print(f"无法开启指标端点: {str(e)}", file=sys.stderr)
+    runner = BatchRunner(config, config_name, concurrency, config_store, metrics)
+    try:
+        summary = runner.run(read_prompts(path), output)
+    except OSError as e:
+        print(f"无法读取提示词文件: {str(e)}", file=sys.stderr)
+        return 2
+    finally:
+        runner.close()
+        metrics.close()
+        if output is not sys.stdout:
+            output.close()
+
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+    return 0 if summary['failed'] == 0 else 1
@@ -0,0 +1,316 @@
+"""ChatEngine 基准测试套件：对本地模拟服务（mock_server.py）测量
+
+    ttft         发送消息到显示第一段回复文本的耗时（扣除模拟的首字节延迟后即客户端开销）
+    throughput   不限速的流式回复经 SSE 解析、投递和 feed_text 的令牌吞吐量；
+                 有图形界面时另测经 ChatView 写入 Text 控件的渲染吞吐量，没有时结果中的
+                 render 标为 skipped（其他各项都不含界面渲染开销）并在标准错误中提示
+    tool         工具调用从显示占位文本到结果替换的分发延迟（立即返回的解释器替身），
+                 以及常驻解释器一次管道往返的耗时（Python 替身进程）
+    memory       长对话中每轮之后的内存占用（tracemalloc）和每轮的增长量
+
+结果以 JSON 输出，便于保存后比较各版本的变化。
+
+用法：
+    python benchmarks/bench_engine.py [--output results.json] [--client requests|asyncio|both] [--quick]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from async_client import AsyncStreamClient
+from chat_engine import ChatEngine, EngineListener, json_loads
+from tool_host import ToolHost, INTERPRETERS
+from tool_registry import ToolRegistry
+from mock_server import MockServer
+
+# 基准测试使用的工具（只用于注册表解析函数名，执行由解释器替身完成）
+BENCH_TOOLS = [{
+    "name": "基准测试工具",
+    "example": "Get-BenchValue",
+    "code": "function Get-BenchValue {\n    return 'ok'\n}"
+}]
+
+class InstantToolHost:
+    """立即返回结果的工具解释器替身，只测量引擎自身的分发开销"""
+    def set_definitions(self, definitions):
+        pass
+
+    def call(self, code, timings=None):
+        return subprocess.CompletedProcess(code, 0, "ok", "")
+
+    def close(self):
+        pass
+
+class TimingListener(EngineListener):
+    """记录一轮中各事件的时间"""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.first_text = None
+        self.text_chars = 0
+        self.texts = 0
+        self.finished = None
+        self.dispatched = {}
+        self.tool_latencies = []
+        self.notices = []
+
+    def on_notice(self, text):
+        self.notices.append(text)
+
+    def on_reply_text(self, text, tags=(), key=None):
+        now = time.perf_counter()
+        if key is not None:
+            self.dispatched[key] = now
+            return
+        if self.first_text is None:
+            self.first_text = now
+        self.text_chars += len(text)
+        self.texts += 1
+
+    def on_tool_result(self, key, text):
+        if key in self.dispatched:
+            self.tool_latencies.append(time.perf_counter() - self.dispatched.pop(key))
+
+    def on_run_finished(self):
+        self.finished = time.perf_counter()
+
+class ViewListener(TimingListener):
+    """同时把回复文本写入 ChatView（测量渲染吞吐量）"""
+    def __init__(self, chat_view):
+        super().__init__()
+        self.chat_view = chat_view
+
+    def on_reply_started(self, reply):
+        self.chat_view.append_block("助手", "\n", message_id=reply.message_id)
+
+    def on_reply_text(self, text, tags=(), key=None):
+        super().on_reply_text(text, tags, key)
+        self.chat_view.append_text(text, tags, key=key)
+
+def summarize(samples, scale=1000.0):
+    """返回样本的统计值（默认换算为毫秒）"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * scale, 3)
+    return {
+        "count": len(samples),
+        "mean": round(statistics.mean(samples) * scale, 3),
+        "p50": pick(50),
+        "p95": pick(95),
+        "max": round(ordered[-1] * scale, 3),
+    }
+
+class Bench:
+    """基准测试环境：模拟服务、临时工具配置和共享资源"""
+    def __init__(self, client):
+        self.client = client
+        self.server = MockServer().start()
+        self.tools_dir = tempfile.TemporaryDirectory()
+        tools_path = os.path.join(self.tools_dir.name, 'tools_config.json')
+        with open(tools_path, 'w', encoding='utf-8') as f:
+            json.dump(BENCH_TOOLS, f, ensure_ascii=False)
+        self.tool_registry = ToolRegistry(tools_path)
+        self.async_client = AsyncStreamClient() if client == 'asyncio' else None
+
+    def engine(self, listener, query="", **config):
+        config = dict({
+            "api_key": "bench",
+            "base_url": self.server.url + ("?" + query if query else ""),
+            "model": "bench",
+            "temperature": 0,
+            "system_prompt": "基准测试 {tools}",
+            "http_client": self.client,
+            "tool_top_k": 0,
+        }, **config)
+        return ChatEngine(
+            config, "bench", listener=listener, tool_registry=self.tool_registry,
+            tool_host=InstantToolHost(), async_client=self.async_client
+        )
+
+    def close(self):
+        if self.async_client is not None:
+            self.async_client.close()
+        self.server.stop()
+        self.tools_dir.cleanup()
+
+def run_turn(engine, listener, text="你好"):
+    listener.reset()
+    engine.send(text)
+    engine.wait()
+
+def bench_ttft(bench, rounds, latency=0.05):
+    """首段文本的到达时间：同一个引擎连续多轮（复用长连接）"""
+    listener = TimingListener()
+    engine = bench.engine(listener, f"tokens=5&latency={latency}")
+    samples = []
+    for _ in range(rounds):
+        run_turn(engine, listener)
+        samples.append(listener.first_text - listener.started)
+    engine.close()
+    overhead = [sample - latency for sample in samples]
+    return {"latency_ms": latency * 1000, "ttft_ms": summarize(samples), "overhead_ms": summarize(overhead)}
+
+def bench_throughput(bench, tokens, chat_view=None):
+    """不限速的一次长回复：每秒经过 feed_text（或写入 ChatView）的令牌数"""
+    listener = TimingListener() if chat_view is None else ViewListener(chat_view)
+    engine = bench.engine(listener, f"tokens={tokens}&chunk_tokens=1")
+    run_turn(engine, listener)
+    elapsed = listener.finished - listener.first_text
+    engine.close()
+    return {
+        "tokens": tokens,
+        "chars": listener.text_chars,
+        "seconds": round(elapsed, 4),
+        "tokens_per_s": round(listener.texts / elapsed, 1) if elapsed > 0 else None,
+        "chars_per_s": round(listener.text_chars / elapsed, 1) if elapsed > 0 else None,
+    }
+
+def bench_tool(bench, rounds):
+    """工具调用的分发延迟（占位文本显示到结果替换）和解释器管道往返耗时"""
+    listener = TimingListener()
+    engine = bench.engine(listener, "tokens=10&tool_call=Get-BenchValue&tool_after=5", agent_max_steps=1)
+    dispatch = []
+    for _ in range(rounds):
+        run_turn(engine, listener)
+        dispatch.extend(listener.tool_latencies)
+    engine.close()
+
+    host = ToolHost(INTERPRETERS['python'])
+    host.set_definitions([])
+    try:
+        host.call("pass")
+        round_trips = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            host.call("print('ok')")
+            round_trips.append(time.perf_counter() - started)
+    finally:
+        host.close()
+    return {"dispatch_ms": summarize(dispatch), "interpreter_round_trip_ms": summarize(round_trips)}
+
+def bench_memory(bench, turns, tokens=100, samples=10):
+    """长对话的内存增长：每隔若干轮记录 tracemalloc 的当前占用"""
+    listener = TimingListener()
+    engine = bench.engine(listener, f"tokens={tokens}")
+    step = max(1, turns // samples)
+    points = []
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        for turn in range(1, turns + 1):
+            run_turn(engine, listener, f"第 {turn} 轮")
+            if turn % step == 0:
+                gc.collect()
+                points.append((turn, tracemalloc.get_traced_memory()[0] - baseline))
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    history_chars = sum(len(m.get('content') or "") for m in engine.messages)
+    engine.close()
+
+    # 后半段的平均每轮增长（前几轮包含缓存等一次性分配）
+    tail = points[len(points) // 2:]
+    growth = (tail[-1][1] - tail[0][1]) / (tail[-1][0] - tail[0][0]) if len(tail) > 1 else None
+    return {
+        "turns": turns,
+        "tokens_per_turn": tokens,
+        "samples": [{"turn": turn, "bytes": size} for turn, size in points],
+        "peak_bytes": peak,
+        "growth_bytes_per_turn": round(growth, 1) if growth is not None else None,
+        "history_chars": history_chars,
+    }
+
+def make_chat_view():
+    """有图形界面时创建隐藏窗口中的 ChatView，否则返回 (None, 原因)"""
+    try:
+        import tkinter as tk
+        from chat_view import ChatView
+        root = tk.Tk()
+    except Exception as e:
+        return None, None, str(e)
+    root.withdraw()
+    text = tk.Text(root)
+    text.pack()
+    return root, ChatView(text), None
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_client(client, args):
+    bench = Bench(client)
+    try:
+        result = {
+            "ttft": bench_ttft(bench, args.rounds),
+            "throughput": bench_throughput(bench, args.tokens),
+            "tool": bench_tool(bench, args.rounds),
+            "memory": bench_memory(bench, args.turns),
+        }
+        root, chat_view, reason = make_chat_view()
+        if chat_view is None:
+            # 没有图形界面时明确标出：上面的端到端结果都不含界面渲染的开销
+            result["render"] = {"skipped": "no display", "reason": reason, "note": "其他结果不含界面渲染开销"}
+            print(f"[{client}] render skipped (no display): {reason}", file=sys.stderr)
+        else:
+            try:
+                result["render"] = bench_throughput(bench, args.tokens, chat_view)
+            finally:
+                root.destroy()
+        return result
+    finally:
+        bench.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="ChatEngine 基准测试")
+    parser.add_argument('--output', default='-', help="结果 JSON 文件（默认输出到标准输出）")
+    parser.add_argument('--client', choices=('requests', 'asyncio', 'both'), default='both')
+    parser.add_argument('--rounds', type=int, default=50, help="TTFT 和工具调用的测量轮数")
+    parser.add_argument('--tokens', type=int, default=20000, help="吞吐量测试的回复令牌数")
+    parser.add_argument('--turns', type=int, default=200, help="内存测试的对话轮数")
+    parser.add_argument('--quick', action='store_true', help="缩小规模，快速检查")
+    args = parser.parse_args()
+    if args.quick:
+        args.rounds, args.tokens, args.turns = 10, 2000, 20
+
+    clients = ('requests', 'asyncio') if args.client == 'both' else (args.client,)
+    report = {
+        "benchmark": "chat_engine",
+        "version": 1,
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "json_backend": json_loads.__module__,
+        "parameters": {"rounds": args.rounds, "tokens": args.tokens, "turns": args.turns},
+        "clients": {client: run_client(client, args) for client in clients},
+    }
+    data = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == '-':
+        print(data)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(data + "\n")
+
+if __name__ == "__main__":
+    main()
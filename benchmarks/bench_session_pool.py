@@ -0,0 +1,78 @@
+"""对比每轮新建连接与会话池复用连接的首字节耗时
+
+在本地启动一个模拟的 /chat/completions 流式服务（HTTP/1.1 长连接），
+分别用 requests.post 和 SessionPool 发送若干轮请求并统计首个 SSE 事件的到达时间。
+
+用法：
+    python benchmarks/bench_session_pool.py [轮数]
+"""
+import http.server
+import os
+import socketserver
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from chat_engine import SessionPool
+
+class StreamHandler(http.server.BaseHTTPRequestHandler):
+    """返回一小段 SSE 流的模拟服务"""
+    protocol_version = "HTTP/1.1"
+    # 关闭 Nagle，避免长连接上分段写入被延迟确认拖慢
+    disable_nagle_algorithm = True
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = (
+            b'data: {"choices":[{"delta":{"content":"ok"}}]}\n\n'
+            b'data: [DONE]\n\n'
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+def first_event_latency(post, url):
+    """发送一次流式请求，返回读到首个事件的耗时（毫秒）"""
+    start = time.perf_counter()
+    response = post(url, json={"stream": True}, stream=True)
+    for line in response.iter_lines():
+        if line:
+            break
+    elapsed = (time.perf_counter() - start) * 1000
+    # 读完剩余内容，让连接回到池中
+    response.content
+    response.close()
+    return elapsed
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    server = Server(("127.0.0.1", 0), StreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/chat/completions"
+    
+    pool = SessionPool()
+    results = {
+        "requests.post": [first_event_latency(requests.post, url) for _ in range(rounds)],
+        "SessionPool": [first_event_latency(pool.get("bench").post, url) for _ in range(rounds)],
+    }
+    pool.close()
+    server.shutdown()
+    
+    for name, samples in results.items():
+        print(f"{name:>14}: 中位数 {statistics.median(samples):.3f} ms, "
+              f"平均 {statistics.mean(samples):.3f} ms ({rounds} 轮)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""SSE 解析微基准：对比 iter_lines 逐行解码与 SSEParser 增量解析
+
+构造一段模拟的 /chat/completions 流式响应，分别用原来的
+iter_lines + decode + json.loads 方式和 SSEParser + json_loads 方式
+提取全部 delta.content，统计每个事件的平均耗时。
+
+用法：
+    python benchmarks/bench_sse_parser.py [事件数]
+"""
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from chat_engine import SSEParser, SSE_READ_SIZE, json_loads
+
+def build_stream(count):
+    """生成 count 个内容事件组成的 SSE 字节流"""
+    parts = []
+    for i in range(count):
+        event = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "bench",
+            "choices": [{"index": 0, "delta": {"content": f"令牌{i} "}, "finish_reason": None}],
+        }
+        parts.append(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+    parts.append(b"data: [DONE]\n\n")
+    return b"".join(parts)
+
+def make_response(payload):
+    """用内存中的字节流构造一个 requests.Response"""
+    response = requests.models.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(payload)
+    return response
+
+def parse_iter_lines(payload):
+    """原来的解析方式"""
+    contents = []
+    for line in make_response(payload).iter_lines():
+        if line:
+            line = line.decode('utf-8')
+            if line.startswith('data: '):
+                data = line[6:]
+                if data != '[DONE]':
+                    json_data = json.loads(data)
+                    content = json_data['choices'][0]['delta'].get('content', '')
+                    if content:
+                        contents.append(content)
+    return contents
+
+def parse_sse_parser(payload):
+    """SSEParser 增量解析"""
+    contents = []
+    parser = SSEParser()
+    for chunk in make_response(payload).iter_content(chunk_size=SSE_READ_SIZE):
+        for event, data in parser.feed(chunk):
+            if event != "message" or data == b"[DONE]":
+                continue
+            choices = json_loads(data).get('choices')
+            if choices:
+                content = choices[0]['delta'].get('content')
+                if content:
+                    contents.append(content)
+    return contents
+
+def best_of(func, payload, repeat=5):
+    """取多次运行中的最短耗时（秒）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(payload)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    payload = build_stream(count)
+    assert parse_iter_lines(payload) == parse_sse_parser(payload)
+    
+    print(f"JSON 后端: {json_loads.__module__}.{json_loads.__name__}")
+    for name, func in (("iter_lines", parse_iter_lines), ("SSEParser", parse_sse_parser)):
+        elapsed = best_of(func, payload)
+        print(f"{name:>10}: {elapsed * 1000:.1f} ms, 每事件 {elapsed / count * 1e6:.2f} µs ({count} 事件)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""本地模拟的 OpenAI 兼容 /chat/completions 流式服务
+
+返回与 send_request 解析的格式相同的 SSE 流（HTTP/1.1 chunked，长连接），可配置：
+    tokens        每次回复的令牌数
+    token_rate    每秒发送的令牌数（0 表示不限速）
+    chunk_tokens  每个 SSE 事件包含的令牌数
+    latency       收到请求后等待多少秒才返回响应（模拟首字节延迟）
+    error_status  返回的错误状态码（如 401/403/429/500，0 表示不出错）
+    error_every   每隔几个请求返回一次错误（1 表示每个请求都出错）
+    tool_call     嵌入回复中的工具调用内容（如 "Get-SystemInfo"），为空时不调用工具
+    tool_after    在第几个令牌之后插入 <tool>...</tool>
+
+选项可在创建时指定，也可以在请求地址的查询参数中逐个覆盖，例如
+    http://127.0.0.1:8000/v1/chat/completions?tokens=50&latency=0.5
+自动继续（AGENT_CONTINUE_PROMPT）和原生工具结果之后的请求不再插入工具调用，避免无限循环。
+
+用法：
+    python benchmarks/mock_server.py [--port 8000] [--tokens 200] [--token-rate 50] [--tool-call Get-SystemInfo]
+"""
+import argparse
+import http.server
+import itertools
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from urllib.parse import urlsplit, parse_qsl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_engine import AGENT_CONTINUE_PROMPT
+
+DEFAULT_OPTIONS = {
+    "tokens": 200,
+    "token_rate": 0.0,
+    "chunk_tokens": 1,
+    "latency": 0.0,
+    "error_status": 0,
+    "error_every": 1,
+    "tool_call": "",
+    "tool_after": 0,
+}
+
+def parse_options(defaults, query):
+    """用查询参数覆盖选项（按默认值的类型转换）"""
+    options = dict(defaults)
+    for key, value in parse_qsl(query):
+        if key in options:
+            options[key] = type(DEFAULT_OPTIONS[key])(value)
+    return options
+
+def wants_tool_call(messages):
+    """只有用户新发送的消息才插入工具调用"""
+    if not messages:
+        return False
+    last = messages[-1]
+    return last.get('role') == 'user' and not str(last.get('content', '')).startswith(AGENT_CONTINUE_PROMPT)
+
+def reply_pieces(options, with_tool):
+    """按顺序生成回复中的文本片段（每个片段计为一个令牌）"""
+    tool_call = f"<tool>{options['tool_call']}</tool>" if with_tool and options['tool_call'] else ""
+    for i in range(options['tokens']):
+        if tool_call and i == options['tool_after']:
+            # 标记拆成两段发送，覆盖跨块的工具调用扫描
+            middle = len(tool_call) // 2
+            yield tool_call[:middle]
+            yield tool_call[middle:]
+        yield f"令牌{i} "
+    if tool_call and options['tool_after'] >= options['tokens']:
+        yield tool_call
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 关闭 Nagle，避免小块写入被延迟确认拖慢
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        number = server.count_request()
+        options = parse_options(server.options, urlsplit(self.path).query)
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            request = {}
+
+        if options['latency'] > 0:
+            time.sleep(options['latency'])
+
+        if options['error_status'] and number % max(1, options['error_every']) == 0:
+            error = json.dumps({"error": {"message": f"mock error {options['error_status']}"}}).encode()
+            self.send_response(options['error_status'])
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(error)))
+            self.end_headers()
+            self.wfile.write(error)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        pieces = reply_pieces(options, wants_tool_call(request.get('messages')))
+        rate = options['token_rate']
+        started = time.perf_counter()
+        sent = 0
+        try:
+            while True:
+                group = list(itertools.islice(pieces, max(1, options['chunk_tokens'])))
+                if not group:
+                    break
+                if rate > 0:
+                    # 按绝对时间表发送，睡眠误差不会累积
+                    delay = started + sent / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                event = {
+                    "id": f"chatcmpl-mock-{number}",
+                    "object": "chat.completion.chunk",
+                    "model": request.get('model', 'mock'),
+                    "choices": [{"index": 0, "delta": {"content": "".join(group)}, "finish_reason": None}],
+                }
+                self.write_chunk(b"data: " + json.dumps(event, ensure_ascii=False).encode('utf-8') + b"\n\n")
+                sent += len(group)
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端停止生成时断开连接
+            self.close_connection = True
+
+    def write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+class MockServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """模拟服务；options 可在运行中修改，对之后的请求生效"""
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, **options):
+        super().__init__((host, port), MockHandler)
+        unknown = set(options) - set(DEFAULT_OPTIONS)
+        if unknown:
+            raise ValueError(f"未知的选项: {', '.join(sorted(unknown))}")
+        self.options = dict(DEFAULT_OPTIONS, **options)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def count_request(self):
+        """返回本次请求的序号（从 1 开始）"""
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+    def start(self):
+        """在后台线程中运行，返回自身"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟的 /chat/completions 流式服务")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8000)
+    for key, value in DEFAULT_OPTIONS.items():
+        parser.add_argument('--' + key.replace('_', '-'), type=type(value), default=value)
+    args = parser.parse_args()
+    options = {key: getattr(args, key) for key in DEFAULT_OPTIONS}
+    server = MockServer(args.host, args.port, **options)
+    print(f"模拟服务已启动: {server.url}（在配置的 Base URL 中填写该地址）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1238 @@
+"""对话引擎：与界面无关的消息历史、流式请求、工具调用和自动执行
+
+AIChatInterface 只负责显示，通过 EngineListener 的回调接收引擎的事件；
+没有界面时（命令行、基准测试）可以直接使用 ChatEngine，用 pump/wait 处理后台线程的结果，
+或用 chat 以生成器的方式逐个取得事件。
+"""
+import collections
+import itertools
+import json
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import certifi
+import requests
+
+from tool_host import (
+    ToolHost, ToolHostError, ToolHostUnavailable, ToolResultCache, INTERPRETERS, run_powershell_script
+)
+from tool_registry import ToolRegistry
+from context_window import ContextWindow, CONTEXT_BUDGET, CONTEXT_KEEP_TURNS, build_summary_request
+from conversation_store import new_conversation_id, make_title
+from config_store import DEFAULT_CONFIG
+from metrics import RequestMetrics, TimedHTTPAdapter, take_connect_time, tool_record
+
+# 优先使用更快的 orjson 解析 JSON（可选依赖），未安装时退回标准库
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# 每个配置保留的最大空闲连接数
+SESSION_POOL_MAXSIZE = 4
+
+# 流式响应每次读取的字节数
+SSE_READ_SIZE = 16 * 1024
+
+# 发送对话请求使用的 HTTP 客户端（可在配置中用 http_client 覆盖）：
+# 'requests' 每个请求一个线程；'asyncio' 由 async_client 在一个事件循环中处理全部流式请求
+HTTP_CLIENT = 'requests'
+
+# 请求超时默认值（秒），可在配置中用 connect_timeout / first_byte_timeout / total_timeout 覆盖
+REQUEST_CONNECT_TIMEOUT = 10
+REQUEST_FIRST_BYTE_TIMEOUT = 60
+REQUEST_TOTAL_TIMEOUT = 600
+
+# 后台生成历史摘要的请求超时（秒）
+SUMMARY_TIMEOUT = 120
+
+# 同时执行的工具调用数上限
+TOOL_MAX_WORKERS = 4
+# 执行工具使用的解释器（见 tool_host.INTERPRETERS）
+TOOL_INTERPRETER = 'powershell'
+
+# 文本协议中的工具调用标记
+TOOL_OPEN_TAG = "<tool>"
+TOOL_CLOSE_TAG = "</tool>"
+
+# 工具调用方式（可在配置中用 tool_mode 覆盖）：
+# 'text' 把工具列表写入系统提示词并扫描回复中的 <tool> 标记；
+# 'native' 随请求发送函数描述，解析流式响应中的 tool_calls
+TOOL_MODE = 'text'
+# 自动执行：工具结果返回后自动继续对话的最大请求数和总时限（秒），
+# 可在配置中用 agent_max_steps / agent_time_budget 覆盖，步数为 1 时不自动继续
+AGENT_MAX_STEPS = 6
+AGENT_TIME_BUDGET = 300
+# 文本协议下自动继续时追加的用户消息（工具结果已写在上一条助手消息中）
+AGENT_CONTINUE_PROMPT = "以上是工具的执行结果，请根据结果继续；不再需要调用工具时直接给出结论。"
+
+# 文本协议下每轮附带完整用法的相关工具数（可在配置中用 tool_top_k 覆盖）：
+# 系统提示词只列出全部工具的名称，检索出的工具示例附在本轮用户消息之后；为 0 时在系统提示词中列出全部示例
+TOOL_TOP_K = 5
+
+# 原生函数调用模式下填入系统提示词 {tools} 的说明
+NATIVE_TOOLS_NOTE = "工具以函数调用（function calling）的方式提供，需要时直接调用对应的函数"
+
+class SessionPool:
+    """按配置复用的 HTTP 会话池，保持长连接以省去每轮的 DNS/TCP/TLS 握手"""
+    def __init__(self, maxsize=SESSION_POOL_MAXSIZE):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        # 每个会话保留的最大空闲连接数（并发请求多时应不小于并发数）
+        self._maxsize = maxsize
+        # 证书包路径只查找一次
+        self._ca_bundle = certifi.where()
+
+    def get(self, key):
+        """获取（必要时创建）指定配置的会话"""
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                session.verify = self._ca_bundle
+                # 记录新建连接的耗时（见 metrics.take_connect_time）
+                adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=self._maxsize)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[key] = session
+            return session
+
+    def reset(self, keep=()):
+        """关闭 keep（仍在使用的配置名集合）之外的所有会话"""
+        with self._lock:
+            stale = [key for key in self._sessions if key not in keep]
+            sessions = [self._sessions.pop(key) for key in stale]
+        for session in sessions:
+            session.close()
+
+    def close(self):
+        """关闭所有会话"""
+        self.reset()
+
+class RequestHandle:
+    """一次流式请求的取消句柄，可从任意线程取消并立即断开连接"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._response = None
+        self.cancelled = False
+        self.reason = None
+        # 取消时尚未收到响应头、由调用方直接结束：之后到达的响应和结束事件都被丢弃
+        self.detached = False
+
+    def attach(self, response):
+        """登记正在读取的响应；若请求已被取消则立即关闭并返回 False"""
+        with self._lock:
+            self._response = response
+            cancelled = self.cancelled
+        if cancelled:
+            self._abort(response)
+        return not cancelled
+
+    def cancel(self, reason="stopped", detach=False):
+        """取消请求：reason 为 'stopped'（用户停止）或 'timeout'（超过总时限）
+
+        detach 为 True 且还没有登记响应（阻塞在等待响应头上，无法打断）时不再等待发送线程，
+        返回 True 表示调用方应立即结束这次请求
+        """
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.cancelled = True
+            self.reason = reason
+            response = self._response
+            self.detached = detach and response is None
+        if response is not None:
+            self._abort(response)
+        return self.detached
+
+    @staticmethod
+    def _abort(response):
+        """关闭底层套接字，唤醒阻塞在读取上的线程（response 也可以是其他有 close 方法的对象）"""
+        connection = getattr(getattr(response, 'raw', None), '_connection', None)
+        sock = getattr(connection, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        response.close()
+
+def api_error_message(status_code, body):
+    """把非 200 响应转换为显示给用户的错误信息"""
+    if status_code == 401:
+        return "API Key 无效或已过期"
+    if status_code == 403:
+        return "API Key 没有权限访问该资源"
+    if status_code == 429:
+        return "请求过于频繁，请稍后再试"
+    try:
+        return json_loads(body).get('error', {}).get('message', f"API调用失败: {status_code}")
+    except Exception:
+        return f"API调用失败: {status_code}"
+
+def tool_output_failed(output):
+    """工具以 {"Status": "Failed", ...} 报告失败时进程仍正常退出，这类输出不能缓存"""
+    if not output.startswith('{'):
+        return False
+    try:
+        data = json_loads(output)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and str(data.get('Status', '')).lower() == 'failed'
+
+class SSEParser:
+    """增量解析 text/event-stream 字节流
+
+    直接在原始字节缓冲区上按行切分，只有 data 字段的值会被复制出来；
+    支持多行 data、注释行以及 event/id 字段，行结束符兼容 CRLF/LF/CR。
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data = []
+        self._event = ""
+        # 上一块是否以 CR 结尾（下一块开头的 LF 与它组成 CRLF）
+        self._pending_cr = False
+        self.last_event_id = ""
+
+    def feed(self, chunk):
+        """输入一块原始字节，返回其中已完整的事件列表 [(event, data_bytes)]"""
+        events = []
+        if not chunk:
+            # 空块不能清除上一块末尾的 CR 状态，否则下一块开头的 LF 会被当成一个空行
+            return events
+        if self._pending_cr or b"\r" in chunk:
+            chunk = self._normalize_newlines(chunk)
+        buf = self._buffer
+        buf += chunk
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end == -1:
+                break
+            self._process_line(buf, start, end, events)
+            start = end + 1
+        del buf[:start]
+        return events
+
+    def _normalize_newlines(self, chunk):
+        """把 CRLF 和单独的 CR 统一为 LF"""
+        if self._pending_cr and chunk.startswith(b"\n"):
+            # 上一块末尾的 CR 已按行结束处理，这里的 LF 属于同一个 CRLF
+            chunk = chunk[1:]
+        self._pending_cr = chunk.endswith(b"\r")
+        return chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+    def _process_line(self, buf, start, end, events):
+        """处理 buf[start:end] 这一行"""
+        if start == end:
+            # 空行：派发当前事件
+            if self._data:
+                data = self._data[0] if len(self._data) == 1 else b"\n".join(self._data)
+                events.append((self._event or "message", data))
+            self._data = []
+            self._event = ""
+            return
+        if buf.startswith(b"data:", start, end):
+            value_start = start + 5
+            if value_start < end and buf[value_start] == 0x20:
+                value_start += 1
+            self._data.append(bytes(buf[value_start:end]))
+            return
+        if buf[start] == 0x3A:
+            # 以冒号开头的是注释（常用作心跳）
+            return
+        colon = buf.find(b":", start, end)
+        if colon == -1:
+            field, value = bytes(buf[start:end]), b""
+        else:
+            field = bytes(buf[start:colon])
+            value_start = colon + 1
+            if value_start < end and buf[value_start] == 0x20:
+                value_start += 1
+            value = bytes(buf[value_start:end])
+        if field == b"data":
+            self._data.append(value)
+        elif field == b"event":
+            self._event = value.decode("utf-8", "replace")
+        elif field == b"id":
+            self.last_event_id = value.decode("utf-8", "replace")
+
+class ToolCallScanner:
+    """流式扫描 <tool>...</tool> 调用的状态机
+
+    每次只检查新到达的文本，被拆分到多个块中的标记由内部缓存的尾部补齐，
+    每个完整的工具调用只返回一次。
+    """
+    def __init__(self):
+        # 上一块末尾可能是标记前缀的残留文本
+        self._tail = ""
+        # 位于 <tool> 之后、尚未闭合的调用内容；None 表示当前不在调用中
+        self._body = None
+
+    @staticmethod
+    def _partial_tag_length(text, tag):
+        """返回 text 末尾与 tag 前缀重合的长度"""
+        for n in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:n]):
+                return n
+        return 0
+
+    def feed(self, text):
+        """输入新文本，返回其中新闭合的工具调用列表
+
+        每项为 (end, 调用内容)：end 是 </tool> 结束处在 text 中的位置，内容不含标记。
+        """
+        calls = []
+        data = self._tail + text
+        # 缓存的尾部只是标记前缀，闭合标记的结束位置总在新文本内
+        offset = len(self._tail)
+        self._tail = ""
+        pos = 0
+        while True:
+            if self._body is None:
+                start = data.find(TOOL_OPEN_TAG, pos)
+                if start == -1:
+                    keep = self._partial_tag_length(data[pos:], TOOL_OPEN_TAG)
+                    self._tail = data[len(data) - keep:] if keep else ""
+                    break
+                self._body = []
+                pos = start + len(TOOL_OPEN_TAG)
+            else:
+                end = data.find(TOOL_CLOSE_TAG, pos)
+                if end == -1:
+                    keep = self._partial_tag_length(data[pos:], TOOL_CLOSE_TAG)
+                    self._body.append(data[pos:len(data) - keep])
+                    self._tail = data[len(data) - keep:] if keep else ""
+                    break
+                self._body.append(data[pos:end])
+                body = "".join(self._body)
+                # 与之前的行为一致：未闭合的 <tool> 之后又出现 <tool> 时以最后一个为准
+                nested = body.rfind(TOOL_OPEN_TAG)
+                if nested != -1:
+                    body = body[nested + len(TOOL_OPEN_TAG):]
+                self._body = None
+                pos = end + len(TOOL_CLOSE_TAG)
+                calls.append((pos - offset, body))
+        return calls
+
+class ToolCallAccumulator:
+    """按 index 合并流式响应中的 tool_calls 增量（函数名和参数会分多次到达）"""
+    def __init__(self):
+        self._calls = {}
+
+    def feed(self, deltas):
+        for delta in deltas:
+            index = delta.get('index', len(self._calls))
+            call = self._calls.setdefault(index, {"id": None, "name": "", "arguments": []})
+            if delta.get('id'):
+                call['id'] = delta['id']
+            function = delta.get('function') or {}
+            if function.get('name'):
+                call['name'] += function['name']
+            if function.get('arguments'):
+                call['arguments'].append(function['arguments'])
+
+    def calls(self):
+        """返回合并后的调用列表（可直接写入助手消息的 tool_calls）"""
+        return [
+            {
+                "id": call['id'] or f"call_{index}",
+                "type": "function",
+                "function": {"name": call['name'], "arguments": "".join(call['arguments'])}
+            }
+            for index, call in sorted(self._calls.items())
+        ]
+
+class AssistantReply:
+    """一次助手回复：按块保存内容，工具结果返回后可原位替换占位块"""
+    def __init__(self, message_id):
+        # 回复开始时分配的消息 ID，显示记录和保存到历史的消息共用
+        self.message_id = message_id
+        self.chunks = []
+        self.scanner = ToolCallScanner()
+        # 保存到历史后的消息对象，之后返回的工具结果会同步更新它
+        self.message = None
+        # 本次回复发起的工具调用数和尚未返回的调用数
+        self.tool_count = 0
+        self.pending = 0
+        # 流式输出是否已结束及结束原因
+        self.finished = False
+        self.end_reason = None
+
+    def text(self):
+        """返回完整的回复文本"""
+        return "".join(self.chunks)
+
+    def append(self, text):
+        """追加一块内容，返回其下标"""
+        self.chunks.append(text)
+        return len(self.chunks) - 1
+
+    def replace(self, index, text):
+        """替换指定下标的内容块"""
+        self.chunks[index] = text
+        if self.message is not None:
+            self.message['content'] = self.text()
+
+class EngineListener:
+    """ChatEngine 的事件回调，全部在引擎所属的线程中调用；子类按需覆盖"""
+    def on_notice(self, text):
+        """系统提示（错误、停止、达到上限等）"""
+
+    def on_user_message(self, message):
+        """用户消息已加入历史"""
+
+    def on_run_started(self):
+        """一轮自动执行开始"""
+
+    def on_reply_started(self, reply):
+        """开始接收一条助手回复"""
+
+    def on_reply_text(self, text, tags=(), key=None):
+        """助手回复中新增的文本；key 不为空时之后会由 on_tool_result 替换"""
+
+    def on_tool_result(self, key, text):
+        """工具结果返回，替换 key 对应的占位文本"""
+
+    def on_reply_finished(self, reply):
+        """助手回复的流式输出结束（reply.end_reason 为 None 表示正常结束）"""
+
+    def on_run_finished(self):
+        """本轮自动执行结束"""
+
+    def on_metrics(self, record):
+        """一次请求或工具调用的指标（见 metrics.RequestMetrics.record 和 metrics.tool_record）"""
+
+class _RecordingListener:
+    """把回调记录为 (事件名, 参数) 并转发给原来的 listener，供 ChatEngine.chat 使用"""
+    def __init__(self, events, listener):
+        self._events = events
+        self._listener = listener
+
+    def __getattr__(self, name):
+        forward = getattr(self._listener, name)
+
+        def record(*args, **kwargs):
+            self._events.append((name[3:], args + tuple(kwargs.values())))
+            return forward(*args, **kwargs)
+        return record
+
+class ChatEngine:
+    """与界面无关的对话引擎：消息历史、流式请求、工具调用和自动执行
+
+    公开方法和 listener 回调都在同一个线程（所属线程）中执行，后台线程的结果通过 post 投递回来。
+    未提供 post 时引擎使用自己的队列，由 pump 处理，可在没有界面的环境中运行。
+    会话池、工具注册表等资源可由多个引擎共享，未提供时由引擎自己创建并在 close 时释放。
+    """
+    def __init__(self, config=None, config_name="", listener=None, post=None,
+                 session_pool=None, tool_registry=None, tool_host=None, tool_cache=None,
+                 config_store=None, conversation_store=None, async_client=None, metrics=None):
+        self.config = config if config is not None else dict(DEFAULT_CONFIG)
+        self.config_name = config_name
+        self.listener = listener or EngineListener()
+        # close 之后为 True：后台线程迟到的结果不再回调 listener，也不再发送新的请求
+        self.closed = False
+
+        # 引擎自己创建的资源，close 时释放
+        self._owned = []
+
+        # 后台线程投递回所属线程的操作
+        self._events = queue.Queue()
+        self.post = post or self._post
+
+        # HTTP 会话池（按配置复用连接）
+        if session_pool is None:
+            session_pool = SessionPool()
+            self._owned.append(session_pool)
+        self.session_pool = session_pool
+
+        # 异步流式客户端（配置的 http_client 为 'asyncio' 时使用，由调用方提供并可共享）
+        self.async_client = async_client
+
+        # 指标记录器（metrics.MetricsRecorder，可共享），未提供时指标只交给 listener
+        self.metrics = metrics
+
+        # 工具调用在线程池中执行，避免阻塞所属线程
+        self.tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
+        self.tool_call_ids = itertools.count(1)
+
+        # 工具注册表（按函数名索引，文件变化时才重新加载）
+        self.tool_registry = tool_registry or ToolRegistry('tools_config.json')
+
+        # 常驻的工具解释器，启动时在后台预热并加载全部工具函数
+        if tool_host is None:
+            tool_host = ToolHost(INTERPRETERS[TOOL_INTERPRETER])
+            tool_host.set_definitions(self.tool_registry.definitions())
+            tool_host.prewarm()
+            self._owned.append(tool_host)
+        self.tool_host = tool_host
+
+        # 只读工具的结果缓存（工具配置中的 cache_ttl 大于 0 时启用）
+        self.tool_cache = tool_cache or ToolResultCache()
+
+        # 配置存储（用于查找 summary_config），未提供时不生成摘要
+        self.config_store = config_store
+
+        # 编译后的系统提示词缓存：((模板, 工具版本), 提示词)
+        self.system_prompt_cache = None
+
+        # 自动执行状态：是否在进行中、已发送的请求数和截止时间
+        self.agent_active = False
+        self.agent_steps = 0
+        self.agent_deadline = 0
+
+        # 当前回复、请求和请求的计时
+        self.reply = None
+        self.current_request = None
+        self.request_metrics = None
+
+        # 较早对话的摘要：{"upto": n, "text": ...}，表示 messages[1:n] 已被压缩
+        self.context_summary = None
+        self.summary_running = False
+
+        # 每条消息的 ID（对话内唯一，对应显示记录和存储中的 seq）
+        self.message_ids = itertools.count(1)
+
+        # 对话存储：当前对话的 ID 和已保存的历史消息数，未提供存储时不保存
+        self.conversation_store = conversation_store
+        self.conversation_id = None
+        self.stored_count = 0
+
+        # 初始化消息历史
+        self.messages = []
+        if self.config.get('system_prompt'):
+            self.messages.append(self.create_message("system", self.config['system_prompt']))
+
+    @property
+    def busy(self):
+        """是否有正在进行的自动执行"""
+        return self.agent_active
+
+    def _post(self, func, *args):
+        self._events.put((func, args))
+
+    def pump(self, timeout=None):
+        """处理后台线程投递的操作（未提供 post 时使用），返回处理的条目数
+
+        timeout 为等待第一个条目的秒数，None 表示一直等待
+        """
+        try:
+            func, args = self._events.get(timeout=timeout)
+        except queue.Empty:
+            return 0
+        count = 1
+        func(*args)
+        while True:
+            try:
+                func, args = self._events.get_nowait()
+            except queue.Empty:
+                return count
+            func(*args)
+            count += 1
+
+    def wait(self, timeout=None):
+        """处理投递的操作直到本轮自动执行结束，返回是否已结束"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.busy:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            self.pump(timeout=0.1 if remaining is None else min(0.1, remaining))
+        return True
+
+    def chat(self, text):
+        """无界面使用：发送消息并逐个产生事件 (名称, 参数)，本轮自动执行结束后停止
+
+        名称为 EngineListener 的方法名去掉 on_ 前缀，事件同时会转发给原来的 listener
+        """
+        events = collections.deque()
+        listener = self.listener
+        self.listener = _RecordingListener(events, listener)
+        try:
+            self.send(text)
+            while True:
+                while events:
+                    yield events.popleft()
+                if not self.busy:
+                    break
+                self.pump(timeout=0.1)
+            while events:
+                yield events.popleft()
+        finally:
+            self.listener = listener
+
+    def set_config(self, config_name, config):
+        """切换配置（之后的请求使用新配置）"""
+        self.config_name = config_name
+        self.config = config
+
+    def create_message(self, role, content, **fields):
+        """创建一条带 ID 的消息（_id 只在本地使用，不随请求发送）"""
+        return dict({"_id": next(self.message_ids), "role": role, "content": content}, **fields)
+
+    def reset(self):
+        """清空历史，之后的消息保存为一个新对话（原对话仍保留在存储中）"""
+        self.messages = []
+        self.context_summary = None
+        self.start_new_conversation()
+        if self.config.get('system_prompt'):
+            self.messages.append(self.create_message("system", self.config['system_prompt']))
+
+    def send(self, text):
+        """发送用户消息并开始新一轮自动执行"""
+        message = self.create_message("user", text)
+        # 本轮相关工具的用法只在开始时检索一次，保存在消息上，之后每次发送内容都相同
+        usage = self.relevant_tools_usage(text)
+        if usage:
+            message['_tool_usage'] = usage
+        self.messages.append(message)
+        self.listener.on_user_message(message)
+
+        # 开始新一轮自动执行
+        self.agent_active = True
+        self.agent_steps = 0
+        self.agent_deadline = time.monotonic() + self.config.get('agent_time_budget', AGENT_TIME_BUDGET)
+        self.listener.on_run_started()
+        self.start_request()
+
+    def stop(self):
+        """停止生成；正在等待工具结果时不再自动继续"""
+        if not self.busy:
+            return
+        if not self.reply.finished:
+            # 还在等待响应头时发送线程无法打断，直接结束本次回复，迟到的响应被丢弃
+            if self.current_request.cancel("stopped", detach=True):
+                self.request_metrics.finish()
+                self.finish_assistant_message("stopped")
+        else:
+            self.end_agent_run("已停止自动执行")
+
+    def start_request(self):
+        """按当前历史发送一次请求（用户发送消息和自动继续时调用）"""
+        if self.closed:
+            return
+        self.agent_steps += 1
+
+        # 准备API请求
+        url = self.config['base_url']
+        headers = {
+            "Authorization": f"Bearer {self.config['api_key']}",
+            "Content-Type": "application/json"
+        }
+
+        # 生成包含工具信息的系统提示词（配置和工具未变化时复用缓存，保证每轮内容完全一致）
+        system_prompt = self.compile_system_prompt()
+        tools_error = self.tool_registry.take_error()
+        if tools_error:
+            self.listener.on_notice(tools_error)
+
+        # 更新系统提示词，内容没有变化时保持原消息不动
+        if self.messages and self.messages[0]['role'] == 'system':
+            if self.messages[0]['content'] != system_prompt:
+                self.messages[0]['content'] = system_prompt
+        else:
+            self.messages.insert(0, self.create_message("system", system_prompt))
+
+        # 保存新的用户消息和上一步的回复
+        self.persist_messages()
+
+        # 按上下文预算挑选本轮发送的消息（发送副本，完整历史保持不变）
+        window = ContextWindow(
+            self.config.get('context_budget', CONTEXT_BUDGET),
+            self.config.get('context_keep_turns', CONTEXT_KEEP_TURNS)
+        )
+        payload, cut = window.build(self.messages, self.context_summary)
+        self.summarize_history(cut)
+
+        data = {
+            "messages": payload,
+            "model": self.config['model'],
+            "temperature": self.config['temperature'],
+            "stream": True
+        }
+        if self.config.get('tool_mode', TOOL_MODE) == 'native':
+            tools = self.tool_registry.schemas()
+            if tools:
+                data["tools"] = tools
+
+        # 开始新的助手消息（重置内容分块和工具调用扫描器）
+        self.reply = AssistantReply(next(self.message_ids))
+        self.listener.on_reply_started(self.reply)
+        self.current_request = RequestHandle()
+        client = self.config.get('http_client', HTTP_CLIENT)
+        if self.async_client is None:
+            client = 'requests'
+        self.request_metrics = RequestMetrics(self.config_name, self.config['model'], client, self.agent_steps)
+
+        # 总时限不超过本轮自动执行剩余的时间
+        timeouts = (
+            self.config.get('connect_timeout', REQUEST_CONNECT_TIMEOUT),
+            self.config.get('first_byte_timeout', REQUEST_FIRST_BYTE_TIMEOUT),
+            max(1, min(self.config.get('total_timeout', REQUEST_TOTAL_TIMEOUT),
+                       self.agent_deadline - time.monotonic()))
+        )
+        if client == 'asyncio':
+            # 交给异步客户端的事件循环，不为每个请求创建线程
+            self.async_client.start_request(
+                self, self.current_request, url, headers, data, timeouts, self.request_metrics
+            )
+            return
+        # 在所属线程中取得当前配置的会话，再到新线程中发送请求
+        session = self.session_pool.get(self.config_name)
+        threading.Thread(
+            target=self.send_request,
+            args=(self.current_request, session, url, headers, data, timeouts, self.request_metrics),
+            daemon=True
+        ).start()
+
+    def relevant_tools_usage(self, query):
+        """返回与问题最相关的工具用法，作为用户消息的本地字段 _tool_usage 在发送时附在内容之后
+
+        系统提示词中只有工具名称，内容保持不变，便于服务端复用提示词缓存；
+        用法附在提问的那条消息上而不是每次请求的最后一条消息上，之前发送过的消息不会变化
+        """
+        top_k = self.config.get('tool_top_k', TOOL_TOP_K)
+        if top_k <= 0 or self.config.get('tool_mode', TOOL_MODE) == 'native':
+            return None
+        tools = self.tool_registry.relevant(query, top_k)
+        if not tools:
+            return None
+        usage = "".join(f"- {tool['name']}: {tool.get('example', '')}\n" for tool in tools)
+        return f"\n\n[可能用到的工具及用法]\n{usage}"
+
+    def summarize_history(self, cut):
+        """把被窗口丢弃且尚未摘要的消息交给 summary_config 指定的配置在后台压缩为摘要
+
+        摘要在下一轮发送时生效；未设置 summary_config 时被丢弃的消息不再发送
+        """
+        summary_config = self.config.get('summary_config')
+        start = self.context_summary['upto'] if self.context_summary else 1
+        if not summary_config or self.config_store is None or self.summary_running or cut <= start:
+            return
+        config = self.config_store.get(summary_config)
+        if not config:
+            return
+
+        previous = self.context_summary['text'] if self.context_summary else None
+        data = {
+            "messages": build_summary_request(previous, self.messages[start:cut]),
+            "model": config['model'],
+            "temperature": 0.2,
+            "stream": False
+        }
+        headers = {
+            "Authorization": f"Bearer {config['api_key']}",
+            "Content-Type": "application/json"
+        }
+        session = self.session_pool.get(summary_config)
+        self.summary_running = True
+        threading.Thread(
+            target=self.request_summary,
+            args=(session, config['base_url'], headers, data, self.messages, cut),
+            daemon=True
+        ).start()
+
+    def request_summary(self, session, url, headers, data, messages, upto):
+        """在后台线程中请求摘要，完成后在所属线程中保存"""
+        text = None
+        try:
+            response = session.post(url, json=data, headers=headers, timeout=SUMMARY_TIMEOUT)
+            if response.status_code == 200:
+                choices = response.json().get('choices') or []
+                if choices:
+                    text = (choices[0].get('message') or {}).get('content')
+            else:
+                self.post(self.notice, f"历史摘要生成失败: {response.status_code}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.post(self.notice, f"历史摘要生成失败: {str(e)}")
+        finally:
+            self.post(self.save_summary, messages, upto, text)
+
+    def save_summary(self, messages, upto, text):
+        """保存摘要；期间历史被清空或重建时丢弃结果"""
+        self.summary_running = False
+        if text and messages is self.messages:
+            self.context_summary = {"upto": upto, "text": text.strip()}
+
+    def compile_system_prompt(self):
+        """把工具列表填入系统提示词模板；模板和工具注册表版本都未变化时直接返回上次的结果"""
+        self.tool_registry.refresh()
+        template = self.config.get('system_prompt', '')
+        native = self.config.get('tool_mode', TOOL_MODE) == 'native'
+        brief = self.config.get('tool_top_k', TOOL_TOP_K) > 0
+        key = (template, self.tool_registry.version, native, brief)
+        if self.system_prompt_cache is None or self.system_prompt_cache[0] != key:
+            # 原生函数调用模式下工具描述随请求发送，不再写入提示词
+            if native:
+                tools_info = NATIVE_TOOLS_NOTE
+            else:
+                tools_info = self.tool_registry.catalogue(brief=brief)
+            try:
+                system_prompt = template.format(tools=tools_info)
+            except (KeyError, IndexError, ValueError):
+                # 提示词中含有其他花括号时只替换 {tools}
+                system_prompt = template.replace('{tools}', tools_info)
+            self.system_prompt_cache = (key, system_prompt)
+        return self.system_prompt_cache[1]
+
+    def send_request(self, handle, session, url, headers, data, timeouts, metrics):
+        connect_timeout, first_byte_timeout, total_timeout = timeouts
+        # 总时限到达时取消请求
+        deadline = threading.Timer(total_timeout, handle.cancel, args=("timeout",))
+        deadline.daemon = True
+        deadline.start()
+        # 请求未正常结束时记录原因，已生成的部分内容仍会保存到历史
+        end_reason = None
+        tool_calls = ToolCallAccumulator()
+        try:
+            # 复用会话中的长连接（会话已使用 certifi 的证书包）
+            response = session.post(
+                url,
+                json=data,
+                headers=headers,
+                stream=True,
+                timeout=(connect_timeout, first_byte_timeout)
+            )
+            metrics.connected(take_connect_time())
+            metrics.response(response.status_code)
+            if not handle.attach(response):
+                return
+
+            if response.status_code == 200:
+                # 按较大的原始字节块读取，由 SSEParser 增量切分事件
+                parser = SSEParser()
+                for chunk in response.iter_content(chunk_size=SSE_READ_SIZE):
+                    if handle.cancelled:
+                        break
+                    for event, payload in parser.feed(chunk):
+                        if event != "message" or payload == b"[DONE]":
+                            continue
+                        try:
+                            json_data = json_loads(payload)
+                        except ValueError:
+                            continue
+                        choices = json_data.get('choices')
+                        if not choices:
+                            continue
+                        delta = choices[0].get('delta') or {}
+                        content = delta.get('content')
+                        if content:
+                            metrics.token(content)
+                            # 投递回所属线程（界面按帧合并显示）
+                            self.post(self.feed_text, content)
+                        if delta.get('tool_calls'):
+                            tool_calls.feed(delta['tool_calls'])
+            else:
+                # 处理错误响应
+                self.post(self.notice, api_error_message(response.status_code, response.content))
+                end_reason = "error"
+
+        except requests.exceptions.Timeout as e:
+            if not handle.cancelled:
+                end_reason = "error"
+                self.post(self.notice, f"请求超时: {str(e)}")
+        except requests.exceptions.RequestException as e:
+            if not handle.cancelled:
+                end_reason = "error"
+                self.post(self.notice, f"网络请求错误: {str(e)}")
+        except Exception as e:
+            # 取消时关闭连接会让读取抛出各种异常，这些都按取消处理
+            if not handle.cancelled:
+                end_reason = "error"
+                self.post(self.feed_text, f"\n请求错误: {str(e)}\n")
+        finally:
+            deadline.cancel()
+            metrics.finish()
+            if handle.cancelled:
+                end_reason = handle.reason
+            # 在所属线程中保存消息到历史（排在所有文本之后），由它决定是否自动继续；
+            # 停止时已直接结束的请求不再投递
+            if not handle.detached:
+                self.post(self.finish_assistant_message, end_reason, tool_calls.calls())
+
+    def finish_assistant_message(self, end_reason=None, tool_calls=None):
+        """流式输出结束后把助手消息保存到历史
+
+        end_reason 为 None 表示正常结束；'stopped'/'timeout'/'error' 表示提前结束，
+        此时只保存已生成的部分内容，不完整的函数调用不会执行
+        """
+        reply = self.reply
+        reply.finished = True
+        reply.end_reason = end_reason
+        if end_reason == "stopped":
+            self.listener.on_notice("已停止生成")
+        elif end_reason == "timeout":
+            self.listener.on_notice("生成超过总时限，已中止")
+        content = reply.text()
+        if end_reason:
+            tool_calls = None
+        if content or not end_reason:
+            reply.message = {
+                "_id": reply.message_id,
+                "role": "assistant",
+                "content": content
+            }
+            if tool_calls:
+                reply.message["tool_calls"] = tool_calls
+            self.messages.append(reply.message)
+        self.listener.on_reply_finished(reply)
+        self.report_metrics(self.request_metrics.record(end_reason))
+        if reply.message is not None and tool_calls:
+            self.run_native_tool_calls(tool_calls)
+        # 工具都已返回（或没有调用工具）时立即决定是否继续，否则等最后一个结果返回
+        if reply.pending == 0:
+            self.continue_agent(reply)
+
+    def continue_agent(self, reply):
+        """一步结束且工具结果全部返回后，决定是否把结果自动交给模型继续"""
+        if self.closed or not self.agent_active or reply is not self.reply:
+            return
+        if reply.end_reason or reply.tool_count == 0:
+            # 出错、被停止或模型没有再调用工具：本轮结束
+            self.end_agent_run()
+            return
+        max_steps = self.config.get('agent_max_steps', AGENT_MAX_STEPS)
+        if self.agent_steps >= max_steps:
+            self.end_agent_run(f"已达到自动执行的步数上限（{max_steps} 步），可发送消息继续" if max_steps > 1 else None)
+            return
+        if time.monotonic() >= self.agent_deadline:
+            self.end_agent_run("已达到自动执行的时间上限，可发送消息继续")
+            return
+        # 原生函数调用的结果已作为 tool 消息写入历史；文本协议需要一条用户消息提示模型继续
+        if self.messages[-1].get('role') != 'tool':
+            self.messages.append(self.create_message("user", AGENT_CONTINUE_PROMPT, _continuation=True))
+        self.start_request()
+
+    def end_agent_run(self, notice=None):
+        """结束本轮自动执行"""
+        self.agent_active = False
+        self.persist_messages()
+        if notice:
+            self.listener.on_notice(notice)
+        self.listener.on_run_finished()
+
+    def run_native_tool_calls(self, tool_calls):
+        """并行执行一轮中的全部函数调用，结果作为 role: tool 消息写入历史"""
+        for call in tool_calls:
+            function = call['function']
+            tool_name = function['name']
+            # 先写入占位的工具消息，保证它们紧跟在助手消息之后
+            tool_message = self.create_message("tool", "", tool_call_id=call['id'])
+            self.messages.append(tool_message)
+            try:
+                arguments = json_loads(function['arguments'] or "{}")
+                if not isinstance(arguments, dict):
+                    raise ValueError("参数必须是 JSON 对象")
+            except ValueError as e:
+                tool_message['content'] = f"错误：无法解析工具参数：{str(e)}"
+                self.listener.on_reply_text(f"\n[工具执行结果]\n{tool_message['content']}\n", ("tool_result",))
+                continue
+            tool_args = self.tool_registry.format_arguments(tool_name, arguments)
+            self.listener.on_reply_text(f"\n[调用工具] {tool_name} {tool_args}".rstrip() + "\n")
+            self.dispatch_tool_call(tool_name, tool_args, tool_message)
+
+    def feed_text(self, new_content):
+        """追加助手回复的流式文本并检查工具调用（耗时计入本次请求的 render）"""
+        started = time.perf_counter()
+        try:
+            # 只扫描新到达的文本，得到其中新闭合的工具调用；
+            # 合并后的一批文本可能包含多个调用，按 </tool> 的位置切开，
+            # 使每个调用的占位文本紧跟在它自己的标记之后
+            shown = 0
+            for end, tool_content in self.reply.scanner.feed(new_content):
+                self.show_reply_text(new_content[shown:end])
+                shown = end
+                # 提取工具名称和参数
+                parts = tool_content.strip().split(maxsplit=1)
+                if not parts:
+                    continue
+                tool_name = parts[0]
+                tool_args = parts[1] if len(parts) > 1 else ""
+                self.dispatch_tool_call(tool_name, tool_args)
+            self.show_reply_text(new_content[shown:])
+        except Exception as e:
+            print(f"Error updating message: {str(e)}")
+            error_text = f"\n[错误]\n{str(e)}\n"
+            self.listener.on_reply_text(error_text)
+            self.reply.append(error_text)
+        self.request_metrics.render += time.perf_counter() - started
+
+    def show_reply_text(self, text):
+        """显示一段助手回复文本并追加到回复中"""
+        if text:
+            self.listener.on_reply_text(text)
+            self.reply.append(text)
+
+    def dispatch_tool_call(self, tool_name, tool_args, tool_message=None):
+        """先显示占位文本，再把工具调用交给线程池执行（需在所属线程调用）
+
+        tool_message 为原生函数调用对应的 role: tool 消息，结果写入该消息而不是助手回复
+        """
+        tag = f"tool_call_{next(self.tool_call_ids)}"
+        placeholder = f"\n[工具执行中] {tool_name} ...\n"
+        self.listener.on_reply_text(placeholder, ("tool_result",), key=tag)
+        reply = self.reply
+        index = reply.append(placeholder) if tool_message is None else None
+        reply.tool_count += 1
+        reply.pending += 1
+
+        future = self.tool_executor.submit(self.execute_tool, tool_name, tool_args)
+        # 结果投递回所属线程
+        future.add_done_callback(
+            lambda f: self.post(self.show_tool_result, reply, index, tag, f, tool_message)
+        )
+
+    def show_tool_result(self, reply, index, tag, future, tool_message=None):
+        """把工具执行结果写入历史并替换占位文本"""
+        try:
+            result = future.result()
+        except Exception as e:
+            result = f"工具执行错误：{str(e)}"
+        result_text = f"\n[工具执行结果]\n{result}\n"
+
+        # 更新消息历史
+        if tool_message is not None:
+            tool_message['content'] = result
+        else:
+            reply.replace(index, result_text)
+        self.save_late_result(tool_message if tool_message is not None else reply.message)
+
+        self.listener.on_tool_result(tag, result_text)
+
+        # 最后一个工具结果返回后决定是否自动继续
+        reply.pending -= 1
+        if reply.finished and reply.pending == 0:
+            self.continue_agent(reply)
+
+    def execute_tool(self, tool_name, args):
+        """执行工具调用（在线程池中），计时投递回所属线程记录"""
+        record = tool_record(tool_name, self.config_name)
+        started = time.perf_counter()
+        try:
+            return self.run_tool(tool_name, args, record)
+        finally:
+            record['total_s'] = round(time.perf_counter() - started, 4)
+            self.post(self.report_metrics, record)
+
+    def run_tool(self, tool_name, args, record):
+        """执行工具调用，把执行方式和各阶段耗时写入 record"""
+        try:
+            # 按函数名在注册表中查找工具
+            tool = self.tool_registry.get(tool_name)
+            if not tool:
+                record['mode'] = "missing"
+                return f"错误：找不到工具 '{tool_name}'"
+            function_code = tool['code']
+
+            # 构建完整的函数调用
+            function_call = f"{tool_name} {args}".strip()
+
+            # 声明了 cache_ttl 的只读工具优先使用缓存结果
+            cache_ttl = tool.get('cache_ttl', 0)
+            cache_key = ToolResultCache.make_key(tool_name, args, self.tool_registry.version)
+            if cache_ttl:
+                cached = self.tool_cache.get(cache_key)
+                if cached is not None:
+                    record.update(mode="cache", ok=True)
+                    return cached
+
+            # 优先在常驻解释器中执行（工具配置有变化时会先重新加载函数）
+            self.tool_host.set_definitions(self.tool_registry.definitions())
+            timings = {}
+            try:
+                result = self.tool_host.call(function_call, timings)
+            except ToolHostUnavailable:
+                # 常驻解释器无法启动或加载函数定义（脚本尚未发送）时，改用独立进程执行这一次调用
+                # （启动和执行无法分开计时）
+                started = time.perf_counter()
+                result = self.run_tool_script(function_code, function_call)
+                record.update(mode="process", spawned=True, run_s=round(time.perf_counter() - started, 4))
+            except ToolHostError as e:
+                # 脚本已经发送后超时或解释器退出：工具可能已经执行过，不再重复执行
+                record.update(timings)
+                return f"工具执行错误：{str(e)}"
+            else:
+                record.update(timings)
+
+            record['ok'] = result.returncode == 0
+            if result.returncode == 0:
+                output = result.stdout.strip()
+                errors = (result.stderr or "").strip()
+                if errors:
+                    # 非终止错误（Write-Error 等）不影响执行结果，但同样交给模型，且不缓存
+                    return f"{output}\n错误：{errors}".strip()
+                if cache_ttl and not tool_output_failed(output):
+                    self.tool_cache.put(cache_key, output, cache_ttl)
+                return output
+            else:
+                return f"错误：{result.stderr.strip()}"
+
+        except Exception as e:
+            return f"工具执行错误：{str(e)}"
+
+    def run_tool_script(self, function_code, function_call):
+        """在独立的 PowerShell 进程中执行一次工具调用（脚本在内存中传递，不落盘）"""
+        # 构建完整的 PowerShell 脚本
+        full_script = f"""
+# 设置输出编码为 UTF-8
+[Console]::OutputEncoding = [System.Text.Encoding]::UTF8
+$OutputEncoding = [System.Text.Encoding]::UTF8
+
+# 定义函数
+{function_code}
+
+# 执行函数并捕获错误
+try {{
+    {function_call}
+}} catch {{
+    Write-Error $_.Exception.Message
+    exit 1
+}}
+"""
+
+        return run_powershell_script(full_script)
+
+    def start_new_conversation(self):
+        """之后的消息保存为一个新对话"""
+        self.conversation_id = None
+        self.stored_count = 0
+
+    def persist_messages(self):
+        """把尚未保存的消息追加到对话存储（系统提示词不保存，写入在后台线程中完成）"""
+        if self.conversation_store is None:
+            return
+        messages = [m for m in self.messages[self.stored_count:] if m.get('role') != 'system']
+        self.stored_count = len(self.messages)
+        if not messages:
+            return
+        if self.conversation_id is None:
+            self.conversation_id = new_conversation_id()
+            self.conversation_store.create_conversation(
+                self.conversation_id, make_title(messages), self.config_name
+            )
+        self.conversation_store.append_messages(self.conversation_id, messages)
+
+    def save_late_result(self, message):
+        """工具结果在所属消息保存之后才返回（如等待工具时停止了自动执行）时，重新保存这条消息
+
+        否则存储中会一直是占位文本或空的 tool 消息，重新打开对话后还会发给模型
+        """
+        if self.conversation_store is None or self.conversation_id is None or message is None:
+            return
+        index = next((i for i, m in enumerate(self.messages) if m is message), None)
+        if index is not None and index < self.stored_count:
+            self.conversation_store.update_message(self.conversation_id, message)
+
+    def message_index(self, message):
+        """返回消息在历史中的下标（按对象比较，内容相同的消息互不影响）"""
+        return next(i for i, m in enumerate(self.messages) if m is message)
+
+    def owner_message(self, index):
+        """返回显示该消息的历史消息：tool 消息显示在之前的助手消息中"""
+        while index > 0 and self.messages[index]['role'] == 'tool':
+            index -= 1
+        return self.messages[index]
+
+    def invalidate_summary(self, index):
+        """已被摘要覆盖的消息修改后，摘要不再可靠"""
+        if self.context_summary and index < self.context_summary['upto']:
+            self.context_summary = None
+
+    def tool_results(self):
+        """返回 {tool_call_id: 工具结果}"""
+        return {m.get('tool_call_id'): m['content'] for m in self.messages if m.get('role') == 'tool'}
+
+    def notice(self, text):
+        """从后台线程投递的系统提示"""
+        self.listener.on_notice(text)
+
+    def report_metrics(self, record):
+        """记录一次请求或工具调用的指标并交给 listener"""
+        if self.metrics is not None:
+            self.metrics.record(record)
+        self.listener.on_metrics(record)
+
+    def update_message(self, message, content):
+        """修改一条消息的内容并只重新保存这一条，返回显示它的消息（tool 消息显示在之前的助手消息中）"""
+        message['content'] = content
+        message.pop('_tokens', None)
+        index = self.message_index(message)
+        self.invalidate_summary(index)
+
+        # 尚未保存的消息之后会按新内容追加
+        if self.conversation_store is not None and self.conversation_id is not None and index < self.stored_count:
+            self.conversation_store.update_message(self.conversation_id, message)
+        return self.owner_message(index)
+
+    def delete_message(self, message):
+        """删除一条消息；助手消息的函数调用结果一起删除"""
+        index = self.message_index(message)
+        end = index + 1
+        if message.get('tool_calls'):
+            while end < len(self.messages) and self.messages[end]['role'] == 'tool':
+                end += 1
+        removed = self.messages[index:end]
+        # 换成新的列表，正在生成的摘要（按旧下标）返回后会被丢弃
+        self.messages = self.messages[:index] + self.messages[end:]
+        self.invalidate_summary(index)
+
+        stored = [m['_id'] for i, m in enumerate(removed, index) if i < self.stored_count]
+        self.stored_count -= len(stored)
+        if stored and self.conversation_store is not None and self.conversation_id is not None:
+            self.conversation_store.delete_messages(self.conversation_id, stored)
+
+    def open_conversation(self, conversation_id):
+        """用已保存的对话替换当前历史，之后的消息继续追加到该对话；返回载入的消息"""
+        messages = self.conversation_store.load_messages(conversation_id)
+        # 较早保存的自动继续提示没有 _continuation 标记，按内容识别
+        for message in messages:
+            if message['role'] == 'user' and message['content'] == AGENT_CONTINUE_PROMPT:
+                message['_continuation'] = True
+        # 新消息的 ID 接在已保存的消息之后
+        self.message_ids = itertools.count(max((m['_id'] for m in messages), default=0) + 1)
+
+        self.messages = [self.create_message("system", self.compile_system_prompt())] + messages
+        self.context_summary = None
+        self.conversation_id = conversation_id
+        self.stored_count = len(self.messages)
+        return messages
+
+    def snapshot(self):
+        """返回当前历史和对话状态的副本，可用 restore 恢复"""
+        return {
+            'messages': [dict(message) for message in self.messages],
+            'context_summary': self.context_summary,
+            'conversation_id': self.conversation_id,
+            'stored_count': self.stored_count
+        }
+
+    def restore(self, snapshot):
+        """用 snapshot 返回的副本替换当前历史
+
+        之后仍在同一对话上且没有再保存过消息时继续追加到该对话，
+        否则存储中的对话已与副本不同，副本在下次发送时保存为新对话
+        """
+        self.messages = [dict(message) for message in snapshot['messages']]
+        self.context_summary = snapshot['context_summary']
+        if self.conversation_id != snapshot['conversation_id'] or self.stored_count != snapshot['stored_count']:
+            self.start_new_conversation()
+
+    def close(self):
+        """停止生成、保存对话并释放引擎自己创建的资源
+
+        之后请求线程和工具线程投递回来的结果只更新引擎内部的状态，listener 换成空实现，
+        界面在关闭标签页后可以立即销毁控件
+        """
+        self.closed = True
+        self.agent_active = False
+        self.listener = EngineListener()
+        if self.current_request is not None:
+            self.current_request.cancel("stopped")
+        self.persist_messages()
+        self.tool_executor.shutdown(wait=False)
+        for resource in self._owned:
+            resource.close()
@@ -1,17 +1,184 @@
+import argparse
+import sys
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
 import json
-import requests
-import threading
-import urllib3
-import certifi
 import logging
-import subprocess
-import os
 import re
+import queue
+import time
+import copy
+import itertools
+import sqlite3
+from chat_engine import ChatEngine, EngineListener, SessionPool, TOOL_INTERPRETER, json_loads
+from conversation_store import ConversationStore, make_title
+from config_store import ConfigStore
+from tool_host import ToolHost, ToolResultCache, INTERPRETERS
+from tool_registry import ToolRegistry
+from chat_view import ChatView
+from async_client import AsyncStreamClient
+from batch import run_batch, BATCH_CONCURRENCY
+from metrics import MetricsRecorder, format_status, format_progress
+
+# 界面刷新节奏（毫秒）：正常每帧刷新一次，积压时逐步放慢以合并成更大的批次
+UI_FLUSH_INTERVAL_MS = 16
+UI_FLUSH_MAX_INTERVAL_MS = 100
+# 单帧处理超过该耗时（毫秒）或条目数即视为积压
+UI_FLUSH_BUDGET_MS = 8
+UI_FLUSH_BACKLOG = 256
+
+# 标签页标题的最大长度（取第一条用户消息）
+TAB_TITLE_LENGTH = 16
+# 标签页正在生成时标题前的标记
+TAB_BUSY_MARK = "● "
+
+# 状态栏刷新间隔（毫秒）：生成中显示当前请求的进度，结束后显示最近一次请求或工具调用的指标
+STATUS_REFRESH_MS = 250
+
+class ChatTab(EngineListener):
+    """一个对话标签页：独立的引擎（消息历史、流式请求、工具执行和配置）、聊天记录和输入框
+    
+    各标签页可以同时生成，引擎事件都回调到所属的标签页；会话池、工具注册表、工具解释器和结果缓存由所有标签页共享
+    """
+    def __init__(self, app, title, config_name="", config=None):
+        self.app = app
+        self.title = title
+        self.frame = ttk.Frame(app.notebook)
+        
+        # 每个标签页的引擎有自己的工具线程池，常驻解释器池由所有标签页共享
+        self.engine = ChatEngine(
+            config,
+            config_name,
+            listener=self,
+            post=app.post_ui,
+            session_pool=app.session_pool,
+            tool_registry=app.tool_registry,
+            tool_host=app.tool_host,
+            tool_cache=app.tool_cache,
+            config_store=app.config_store,
+            conversation_store=app.conversation_store,
+            async_client=app.async_client,
+            metrics=app.metrics
+        )
+        # 最近一次请求或工具调用的指标，显示在状态栏中
+        self.last_metrics = None
+        
+        # 聊天显示区域
+        self.chat_display = scrolledtext.ScrolledText(self.frame, wrap=tk.WORD, height=20)
+        self.chat_display.pack(fill=tk.BOTH, expand=True)
+        self.chat_display.tag_config("tool_result", foreground="red")
+        self.chat_display.config(state=tk.DISABLED)
+        # 完整的聊天记录保存在 chat_view 中，控件只显示视口附近的部分
+        self.chat_view = ChatView(self.chat_display)
+        
+        self.create_input_area()
+        app.notebook.add(self.frame, text=title)
+    
+    def create_input_area(self):
+        # 输入区域框架
+        input_frame = ttk.Frame(self.frame)
+        input_frame.pack(fill=tk.X, pady=(5, 0))
+        
+        # 创建一个可调整大小的框架
+        input_resize_frame = ttk.Frame(input_frame)
+        input_resize_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        # 文本输入框
+        self.input_box = scrolledtext.ScrolledText(input_resize_frame, wrap=tk.WORD, height=3)
+        self.input_box.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        # 添加大小调整手柄
+        sizer = ttk.Sizegrip(input_resize_frame)
+        sizer.pack(side=tk.RIGHT, anchor=tk.SE)
+        
+        # 按钮框架
+        button_frame = ttk.Frame(input_frame)
+        button_frame.pack(side=tk.RIGHT)
+        
+        # 发送/停止按钮
+        self.send_button = ttk.Button(button_frame, text="发送", command=self.send_message)
+        self.send_button.pack(side=tk.LEFT, padx=2)
+        
+        # 自定义内容按钮
+        custom_button = ttk.Button(button_frame, text="⚡", width=3, command=self.app.show_custom_menu)
+        custom_button.pack(side=tk.LEFT, padx=2)
+        
+        # 绑定回车键发送
+        self.input_box.bind("<Return>", lambda e: self.send_message() if not e.state & 0x1 else None)
+    
+    def send_message(self):
+        if self.engine.busy:
+            # 停止生成；正在等待工具结果时不再自动继续
+            self.engine.stop()
+            return
+        
+        user_message = self.input_box.get("1.0", tk.END).strip()
+        if not user_message:
+            return
+        
+        # 清空输入框
+        self.input_box.delete("1.0", tk.END)
+        
+        # 交给引擎发送，用户消息和回复通过引擎事件显示
+        self.engine.send(user_message)
+    
+    def set_title(self, title=None):
+        """更新标签页标题，生成中的标签页带有标记"""
+        if title is not None:
+            self.title = title
+        mark = TAB_BUSY_MARK if self.engine.busy else ""
+        self.app.notebook.tab(self.frame, text=f"{mark}{self.title}")
+    
+    def title_from_messages(self):
+        """用第一条用户消息作为标题（还没有用户消息时保持原标题）"""
+        if any(m['role'] == 'user' for m in self.engine.messages):
+            self.set_title(make_title(self.engine.messages)[:TAB_TITLE_LENGTH])
+    
+    def append_message(self, sender, message, message_id=None):
+        """添加新消息到聊天显示区域；message_id 为对应历史消息的 ID（系统提示为 None）"""
+        sender_name = "你" if sender == "You" else "助手" if sender == "Assistant" else "系统"
+        self.chat_view.append_block(sender_name, f"{message}\n\n", follow=True, message_id=message_id)
+    
+    def close(self):
+        """停止生成、保存对话并释放引擎的资源；之后引擎迟到的结果不再回调本标签页"""
+        self.engine.close()
+        self.app.notebook.forget(self.frame)
+        self.frame.destroy()
+    
+    # 引擎事件（EngineListener），都在主线程中调用
+    
+    def on_notice(self, text):
+        self.append_message("System", text)
+    
+    def on_user_message(self, message):
+        self.append_message("You", message['content'], message['_id'])
+        self.title_from_messages()
+    
+    def on_run_started(self):
+        # 更改按钮为停止
+        self.send_button.config(text="停止")
+        self.set_title()
+    
+    def on_reply_started(self, reply):
+        # 插入新消息标记和一个空行作为占位
+        self.chat_view.append_block("助手", "\n", message_id=reply.message_id)
+    
+    def on_reply_text(self, text, tags=(), key=None):
+        self.chat_view.append_text(text, tags, key=key)
+    
+    def on_tool_result(self, key, text):
+        # 占位文本可能已随清空对话等操作被删除，此时 replace 不做任何事
+        self.chat_view.replace(key, text, ("tool_result",))
+    
+    def on_run_finished(self):
+        self.send_button.config(text="发送")
+        self.set_title()
+    
+    def on_metrics(self, record):
+        self.last_metrics = record
 
 class AIChatInterface:
-    def __init__(self, root):
+    def __init__(self, root, metrics_port=0):
         # 使用日志捕获警告
         logging.captureWarnings(True)
         
@@ -24,32 +191,203 @@ class AIChatInterface:
         # 将窗口居中显示
         self.center_window()
         
-        # 初始化空配置
-        self.config = {
-            'api_key': '',
-            'base_url': '',
-            'system_prompt': '',
-            'temperature': 0.7,
-            'model': ''
-        }
-        
-        self.processed_tools = set()
         self.custom_contents = self.load_custom_contents()
         
+        # 配置存储（缓存 configs.json，文件变化时才重新读取）
+        self.config_store = ConfigStore('configs.json')
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        # 后台线程投递的界面更新队列，由主线程按帧合并处理
+        self.ui_queue = queue.Queue()
+        self.ui_flush_interval = UI_FLUSH_INTERVAL_MS
+        
+        # 对话存储（历史对话）
+        try:
+            self.conversation_store = ConversationStore()
+        except sqlite3.Error as e:
+            print(f"Error opening conversation store: {str(e)}")
+            self.conversation_store = None
+        
+        # 各标签页共享的资源：按配置复用的会话池、异步流式客户端（配置的 http_client 为 'asyncio' 时使用，
+        # 结果经 post_ui 回到主线程）、工具注册表、常驻工具解释器和工具结果缓存
+        self.session_pool = SessionPool()
+        self.async_client = AsyncStreamClient()
+        self.tool_registry = ToolRegistry('tools_config.json')
+        # 解释器池由所有标签页共用（与批量执行相同），新建标签页不再启动新的解释器进程
+        self.tool_host = ToolHost(INTERPRETERS[TOOL_INTERPRETER])
+        self.tool_host.set_definitions(self.tool_registry.definitions())
+        self.tool_host.prewarm()
+        self.tool_cache = ToolResultCache()
+        
+        # 请求和工具调用的指标：写入 metrics.jsonl（轮转）和 metrics.prom，指定端口时另开 HTTP 端点
+        self.metrics = MetricsRecorder()
+        if metrics_port:
+            try:
+                self.metrics.serve(metrics_port)
+            except OSError as e:
+                print(f"Error starting metrics endpoint: {str(e)}")
+        self.status_updated = 0
+        
+        # 对话标签页（按创建顺序），每个标签页有独立的引擎，可以同时生成
+        self.tabs = {}
+        self.tab_numbers = itertools.count(1)
+        
         # 设置UI
         self.setup_ui()
         
-        # 加载配置列表并选择第一个（如果有）
-        configs = self.load_configs()
-        if configs:
-            first_config_name = list(configs.keys())[0]
-            self.config = configs[first_config_name]
-            # 更新界面
-            self.config_var.set(first_config_name)
-            self.api_key_var.set(self.config['api_key'])
-            self.base_url_var.set(self.config['base_url'])
-            self.model_var.set(self.config['model'])
-            self.temperature_var.set(str(self.config['temperature']))
+        # 加载配置列表并在第一个标签页中使用第一个配置（如果有）
+        config_names = self.config_store.names()
+        if config_names:
+            self.new_tab(config_names[0], self.config_store.get(config_names[0]))
+        else:
+            self.new_tab()
+        
+        # 启动界面刷新循环
+        self.root.after(self.ui_flush_interval, self.flush_ui_queue)
+    
+    @property
+    def tab(self):
+        """当前选中的标签页"""
+        return self.tabs[self.notebook.select()]
+    
+    @property
+    def engine(self):
+        """当前标签页的引擎"""
+        return self.tab.engine
+    
+    @property
+    def chat_view(self):
+        return self.tab.chat_view
+    
+    @property
+    def input_box(self):
+        return self.tab.input_box
+    
+    @property
+    def config(self):
+        """当前标签页的配置（保存在引擎中）"""
+        return self.engine.config
+    
+    def new_tab(self, config_name=None, config=None):
+        """新建一个对话标签页并切换过去；未指定配置时沿用当前标签页的配置（副本）"""
+        if config is None and self.tabs:
+            config_name, config = self.engine.config_name, copy.deepcopy(self.config)
+        tab = ChatTab(self, f"对话 {next(self.tab_numbers)}", config_name or "", config)
+        self.tabs[str(tab.frame)] = tab
+        self.notebook.select(tab.frame)
+        tab.input_box.focus_set()
+        return tab
+    
+    def close_tab(self, tab=None):
+        """关闭标签页（正在生成时先确认）；关闭最后一个时新建一个空白标签页"""
+        tab = tab or self.tab
+        if tab.engine.busy and not messagebox.askyesno("确认", f"“{tab.title}”正在生成，确定要关闭吗？"):
+            return
+        if len(self.tabs) == 1:
+            self.new_tab()
+        del self.tabs[str(tab.frame)]
+        tab.close()
+        # 释放已经没有标签页使用的配置的连接
+        self.session_pool.reset(keep={t.engine.config_name for t in self.tabs.values()})
+    
+    def on_tab_changed(self, event=None):
+        """切换标签页时在设置栏中显示该标签页的配置"""
+        if self.notebook.select() in self.tabs:
+            self.show_config()
+            self.tab.input_box.focus_set()
+            self.update_status()
+    
+    def on_tab_click(self, event):
+        """鼠标中键点击标签关闭该标签页"""
+        try:
+            index = self.notebook.index(f"@{event.x},{event.y}")
+        except tk.TclError:
+            return
+        self.close_tab(self.tabs[self.notebook.tabs()[index]])
+    
+    def show_config(self):
+        """在设置栏中显示当前标签页的配置"""
+        self.config_var.set(self.engine.config_name)
+        self.api_key_var.set(self.config['api_key'])
+        self.base_url_var.set(self.config['base_url'])
+        self.model_var.set(self.config['model'])
+        self.temperature_var.set(str(self.config['temperature']))
+    
+    def post_ui(self, func, *args):
+        """从任意线程投递一个在主线程执行的界面操作"""
+        self.ui_queue.put((func, args))
+    
+    def flush_ui_queue(self):
+        """按固定节奏处理界面更新队列，把连续的流式文本合并为一次插入"""
+        started = time.perf_counter()
+        # 只处理本帧开始时已有的条目，避免生产过快时一直占用主线程
+        count = self.ui_queue.qsize()
+        pending = []
+        pending_func = None
+        try:
+            for _ in range(count):
+                func, args = self.ui_queue.get_nowait()
+                # 引擎投递的流式文本先积累，连续的几段合并后一次处理
+                if getattr(func, '__func__', None) is ChatEngine.feed_text:
+                    if pending and func != pending_func:
+                        self.run_ui_item(pending_func, ''.join(pending))
+                        pending = []
+                    pending_func = func
+                    pending.append(args[0])
+                    continue
+                # 保持顺序：先显示之前积累的文本，再执行其他操作
+                if pending:
+                    self.run_ui_item(pending_func, ''.join(pending))
+                    pending = []
+                self.run_ui_item(func, *args)
+            if pending:
+                self.run_ui_item(pending_func, ''.join(pending))
+        finally:
+            if (started - self.status_updated) * 1000 >= STATUS_REFRESH_MS:
+                self.update_status()
+            # 积压时放慢刷新节奏，用更粗的批次换取界面响应；空闲后逐步恢复
+            elapsed = (time.perf_counter() - started) * 1000
+            if elapsed > UI_FLUSH_BUDGET_MS or count > UI_FLUSH_BACKLOG:
+                self.ui_flush_interval = min(self.ui_flush_interval * 2, UI_FLUSH_MAX_INTERVAL_MS)
+            else:
+                self.ui_flush_interval = max(self.ui_flush_interval // 2, UI_FLUSH_INTERVAL_MS)
+            self.root.after(self.ui_flush_interval, self.flush_ui_queue)
+    
+    @staticmethod
+    def run_ui_item(func, *args):
+        """执行一个界面操作；出错只影响这一条，本帧的其他条目（包括其他标签页的文本）照常处理"""
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"Error flushing UI queue: {str(e)}")
+    
+    def update_status(self):
+        """在状态栏中显示当前标签页的请求进度或最近一次的指标"""
+        self.status_updated = time.perf_counter()
+        tab = self.tabs.get(self.notebook.select())
+        if tab is None:
+            return
+        engine = tab.engine
+        if engine.busy and engine.request_metrics is not None and not engine.reply.finished:
+            text = format_progress(engine.request_metrics)
+        elif tab.last_metrics is not None:
+            text = format_status(tab.last_metrics)
+        else:
+            text = ""
+        if text != self.status_var.get():
+            self.status_var.set(text)
+    
+    def on_close(self):
+        """关闭窗口时保存所有标签页的对话并释放连接"""
+        for tab in self.tabs.values():
+            tab.engine.close()
+        self.session_pool.close()
+        self.async_client.close()
+        self.tool_host.close()
+        self.metrics.close()
+        if self.conversation_store is not None:
+            self.conversation_store.close()
+        self.root.destroy()
     
     def center_window(self):
         """将窗口居中显示"""
@@ -90,16 +428,13 @@ class AIChatInterface:
         # 创建工具栏
         self.create_toolbar()
         
+        # 状态栏（先放在底部，窗口缩小时不被聊天区域挤掉）
+        self.status_var = tk.StringVar()
+        ttk.Label(self.main_frame, textvariable=self.status_var, anchor=tk.W).pack(side=tk.BOTTOM, fill=tk.X, padx=5)
+        
         # 创建聊天区域
         self.create_chat_area()
         
-        # 创建输入区域
-        self.create_input_area()
-        
-        # 初始化消息历史
-        self.messages = []
-        if self.config['system_prompt']:
-            self.messages.append({"role": "system", "content": self.config['system_prompt']})
     
     def create_toolbar(self):
         # 工具栏框架
@@ -133,7 +468,7 @@ class AIChatInterface:
         api_frame = ttk.Frame(left_frame)
         api_frame.pack(fill=tk.X, expand=True)
         ttk.Label(api_frame, text="API Key:").pack(side=tk.LEFT, padx=5)
-        self.api_key_var = tk.StringVar(value=self.config['api_key'])
+        self.api_key_var = tk.StringVar()
         ttk.Entry(api_frame, textvariable=self.api_key_var, show="*").pack(side=tk.LEFT, fill=tk.X, expand=True)
         
         # 添加显示/隐藏按钮
@@ -150,7 +485,7 @@ class AIChatInterface:
         url_frame = ttk.Frame(left_frame)
         url_frame.pack(fill=tk.X, expand=True, pady=(5,0))
         ttk.Label(url_frame, text="Base URL:").pack(side=tk.LEFT, padx=5)
-        self.base_url_var = tk.StringVar(value=self.config['base_url'])
+        self.base_url_var = tk.StringVar()
         ttk.Entry(url_frame, textvariable=self.base_url_var).pack(side=tk.LEFT, fill=tk.X, expand=True)
         
         # 在右侧框架中添加 Model、Temperature 和按钮
@@ -158,7 +493,7 @@ class AIChatInterface:
         model_frame = ttk.Frame(right_frame)
         model_frame.pack(fill=tk.X, expand=True)
         ttk.Label(model_frame, text="Model:").pack(side=tk.LEFT, padx=5)
-        self.model_var = tk.StringVar(value=self.config['model'])
+        self.model_var = tk.StringVar()
         ttk.Entry(model_frame, textvariable=self.model_var).pack(side=tk.LEFT, fill=tk.X, expand=True)
         
         # Temperature 和按钮
@@ -169,7 +504,7 @@ class AIChatInterface:
         temp_frame = ttk.Frame(bottom_frame)
         temp_frame.pack(side=tk.LEFT, fill=tk.X, expand=True)
         ttk.Label(temp_frame, text="Temperature:").pack(side=tk.LEFT, padx=5)
-        self.temperature_var = tk.StringVar(value=str(self.config['temperature']))
+        self.temperature_var = tk.StringVar()
         ttk.Entry(temp_frame, textvariable=self.temperature_var, width=10).pack(side=tk.LEFT)
         
         # 按钮
@@ -184,49 +519,24 @@ class AIChatInterface:
         # 绑定选择事件
         self.config_dropdown.bind('<<ComboboxSelected>>', self.load_selected_config)
     
-    def load_configs(self):
-        """加载所有配置"""
-        try:
-            with open('configs.json', 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            # 创建默认配置
-            default_config = {
-                'default': {
-                    'api_key': '',
-                    'base_url': '',
-                    'system_prompt': '',
-                    'temperature': 0.7,
-                    'model': ''
-                }
-            }
-            self.save_configs(default_config)
-            return default_config
-    
-    def save_configs(self, configs):
-        """保存所有配置"""
-        with open('configs.json', 'w') as f:
-            json.dump(configs, f, indent=4)
-    
     def update_config_list(self):
         """更新配置下拉框"""
-        configs = self.load_configs()
-        self.config_dropdown['values'] = list(configs.keys())
-        if not self.config_var.get() and configs:
-            self.config_var.set(list(configs.keys())[0])
+        config_names = self.config_store.names()
+        self.config_dropdown['values'] = config_names
+        if not self.config_var.get() and config_names:
+            self.config_var.set(config_names[0])
     
     def load_selected_config(self, event=None):
         """加载选中的配置"""
         config_name = self.config_var.get()
         if config_name:
-            configs = self.load_configs()
-            if config_name in configs:
-                self.config = configs[config_name]
+            config = self.config_store.get(config_name)
+            if config is not None:
+                self.engine.set_config(config_name, config)
+                # 切换配置时释放已经没有标签页使用的配置的连接
+                self.session_pool.reset(keep={tab.engine.config_name for tab in self.tabs.values()})
                 # 更新界面
-                self.api_key_var.set(self.config['api_key'])
-                self.base_url_var.set(self.config['base_url'])
-                self.model_var.set(self.config['model'])
-                self.temperature_var.set(str(self.config['temperature']))
+                self.show_config()
     
     def save_as_config(self):
         """保存为新配置"""
@@ -249,15 +559,17 @@ class AIChatInterface:
         def save():
             name = name_var.get().strip()
             if name:
-                configs = self.load_configs()
-                configs[name] = {
+                # 以当前配置为基础，保留超时等高级设置
+                config = dict(self.config)
+                config.update({
                     'api_key': self.api_key_var.get(),
                     'base_url': self.base_url_var.get(),
                     'model': self.model_var.get(),
                     'temperature': float(self.temperature_var.get()),
                     'system_prompt': self.config.get('system_prompt', '')
-                }
-                self.save_configs(configs)
+                })
+                self.config_store.put(name, config)
+                self.engine.set_config(name, config)
                 self.update_config_list()
                 self.config_var.set(name)
                 dialog.destroy()
@@ -296,26 +608,21 @@ class AIChatInterface:
         if config_name:
             if messagebox.askyesno("删除配置", 
                                      f"确定要删除配置 '{config_name}' 吗？"):
-                configs = self.load_configs()
-                if config_name in configs:
-                    del configs[config_name]
-                    self.save_configs(configs)
-                    self.update_config_list()
+                self.config_store.delete(config_name)
+                self.update_config_list()
     
     def save_settings(self):
         """保存当前设置到当前配置"""
         config_name = self.config_var.get()
         if config_name:
-            configs = self.load_configs()
-            configs[config_name].update({
+            # 只更新界面上的字段，文件中的其他字段（包括其他窗口写入的）保持不变
+            self.engine.set_config(config_name, self.config_store.merge(config_name, {
                 'api_key': self.api_key_var.get(),
                 'base_url': self.base_url_var.get(),
                 'model': self.model_var.get(),
                 'temperature': float(self.temperature_var.get()),
                 'system_prompt': self.config.get('system_prompt', '')
-            })
-            self.save_configs(configs)
-            self.config = configs[config_name]
+            }))
     
     def create_chat_area(self):
         # 创建一个框架来包含聊天区域和按钮
@@ -326,18 +633,37 @@ class AIChatInterface:
         button_frame = ttk.Frame(chat_frame)
         button_frame.pack(side=tk.TOP, fill=tk.X, pady=2)
         
+        # 标签页按钮（靠左对齐）
+        ttk.Button(button_frame, text="新建标签页", command=self.new_tab).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="关闭标签页", command=self.close_tab).pack(side=tk.LEFT, padx=5)
+        
         # 添加按钮（靠右对齐）
         ttk.Button(button_frame, text="清空对话", command=self.clear_chat).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="历史对话", command=self.show_history).pack(side=tk.RIGHT, padx=5)
         ttk.Button(button_frame, text="编辑历史", command=self.edit_chat_history).pack(side=tk.RIGHT, padx=5)
         ttk.Button(button_frame, text="新窗口打开", command=self.open_in_new_window).pack(side=tk.RIGHT, padx=5)
         ttk.Button(button_frame, text="提取代码", command=self.extract_code).pack(side=tk.RIGHT, padx=5)
-        
-        # 聊天显示区域
-        self.chat_display = scrolledtext.ScrolledText(chat_frame, wrap=tk.WORD, height=20)
-        self.chat_display.pack(fill=tk.BOTH, expand=True)
-        self.chat_display.config(state=tk.DISABLED)
+        ttk.Button(button_frame, text="清空工具缓存", command=self.clear_tool_cache).pack(side=tk.RIGHT, padx=5)
+        
+        # 工具结果缓存开关（关闭后每次都重新执行工具）
+        self.tool_cache_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(button_frame, text="缓存工具结果", variable=self.tool_cache_var,
+                        command=self.toggle_tool_cache).pack(side=tk.RIGHT, padx=5)
+        
+        # 对话标签页，每页包含聊天记录和输入框
+        self.notebook = ttk.Notebook(chat_frame)
+        self.notebook.pack(fill=tk.BOTH, expand=True)
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+        self.notebook.bind("<Button-2>", self.on_tab_click)
+        self.root.bind("<Control-t>", lambda e: self.new_tab())
+        self.root.bind("<Control-w>", lambda e: self.close_tab())
     
     def edit_chat_history(self):
+        """逐条编辑聊天历史：只重新显示和保存修改过的消息"""
+        if self.engine.busy:
+            messagebox.showwarning("警告", "请先停止当前的生成")
+            return
+        
         # 创建编辑窗口
         edit_window = tk.Toplevel(self.root)
         edit_window.title("编辑聊天历史")
@@ -354,37 +680,93 @@ class AIChatInterface:
         main_frame = ttk.Frame(edit_window)
         main_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
-        # 创建文本编辑区
-        edit_text = scrolledtext.ScrolledText(main_frame, wrap=tk.WORD)
+        # 左侧消息列表
+        list_frame = ttk.Frame(main_frame)
+        list_frame.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 5))
+        message_list = tk.Listbox(list_frame, width=36, exportselection=False)
+        message_list.pack(side=tk.LEFT, fill=tk.Y)
+        list_scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=message_list.yview)
+        list_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        message_list.config(yscrollcommand=list_scrollbar.set)
+        
+        # 右侧编辑区
+        edit_frame = ttk.Frame(main_frame)
+        edit_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        role_label = ttk.Label(edit_frame, text="")
+        role_label.pack(anchor=tk.W)
+        edit_text = scrolledtext.ScrolledText(edit_frame, wrap=tk.WORD, undo=True)
         edit_text.pack(fill=tk.BOTH, expand=True)
         
         # 创建按钮框架
-        button_frame = ttk.Frame(main_frame)
+        button_frame = ttk.Frame(edit_frame)
         button_frame.pack(fill=tk.X, pady=5)
         
-        # 获取当前的聊天内容
-        current_text = self.chat_display.get("1.0", tk.END)
-        edit_text.insert("1.0", current_text)
+        role_names = {"user": "你", "assistant": "助手", "tool": "工具结果"}
+        # 可编辑的消息（系统提示词在“编辑提示词”中修改）
+        entries = []
+        current = [None]
+        
+        def entry_text(message):
+            preview = " ".join((message.get('content') or "").split())[:40]
+            return f"{role_names.get(message['role'], message['role'])}: {preview}"
+        
+        def load_list():
+            entries[:] = [m for m in self.engine.messages if m['role'] in role_names]
+            message_list.delete(0, tk.END)
+            for message in entries:
+                message_list.insert(tk.END, entry_text(message))
+        
+        def apply_current():
+            # 内容有变化时才更新该消息
+            message = current[0]
+            if message is None:
+                return
+            content = edit_text.get("1.0", "end-1c")
+            if content != message['content']:
+                self.edit_message(message, content)
+                index = entries.index(message)
+                message_list.delete(index)
+                message_list.insert(index, entry_text(message))
         
-        def save_changes():
-            # 获取编辑后的内容
-            new_text = edit_text.get("1.0", tk.END).strip()
-            
-            # 清空当前显示
-            self.chat_display.config(state=tk.NORMAL)
-            self.chat_display.delete("1.0", tk.END)
-            self.chat_display.insert("1.0", new_text + "\n")
-            self.chat_display.config(state=tk.DISABLED)
-            
-            # 重建消息历史
-            self.rebuild_messages_from_text(new_text)
-            
-            # 关闭编辑窗口
+        def on_select(event=None):
+            selection = message_list.curselection()
+            if not selection or entries[selection[0]] is current[0]:
+                return
+            apply_current()
+            message = entries[selection[0]]
+            current[0] = message
+            role_label.config(text=role_names[message['role']])
+            edit_text.delete("1.0", tk.END)
+            edit_text.insert("1.0", message['content'])
+            edit_text.edit_reset()
+        
+        def delete_current():
+            message = current[0]
+            if message is None:
+                return
+            if message['role'] == 'tool':
+                messagebox.showwarning("警告", "工具结果随对应的助手消息一起删除", parent=edit_window)
+                return
+            if not messagebox.askyesno("确认", "确定要删除这条消息吗？", parent=edit_window):
+                return
+            self.remove_message(message)
+            current[0] = None
+            role_label.config(text="")
+            edit_text.delete("1.0", tk.END)
+            load_list()
+        
+        def close():
+            apply_current()
             edit_window.destroy()
         
-        # 保存按钮
-        save_button = ttk.Button(button_frame, text="保存", command=save_changes)
-        save_button.pack(side=tk.RIGHT, padx=5)
+        message_list.bind("<<ListboxSelect>>", on_select)
+        edit_window.protocol("WM_DELETE_WINDOW", close)
+        
+        ttk.Button(button_frame, text="完成", command=close).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="删除消息", command=delete_current).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="应用修改", command=apply_current).pack(side=tk.RIGHT, padx=5)
+        
+        load_list()
         
         # 计算对话框位置使其居中
         def center_dialog():
@@ -409,81 +791,26 @@ class AIChatInterface:
         # 等待窗口创建完成后再居中
         self.root.after(10, center_dialog)
         
-        # 设置输入框焦点
+        # 默认选中最后一条消息
+        if entries:
+            message_list.selection_set(tk.END)
+            message_list.see(tk.END)
+            on_select()
         edit_text.focus_set()
     
-    def rebuild_messages_from_text(self, text):
-        """从编辑后的文本重建消息历史"""
-        self.messages = []
-        
-        # 首先添加system prompt（如果有的话）
-        if self.config['system_prompt']:
-            self.messages.append({"role": "system", "content": self.config['system_prompt']})
-        
-        # 解析文本内容重建消息历史
-        lines = text.split('\n')
-        current_role = None
-        current_message = []
-        
-        for line in lines:
-            line = line.strip()
-            if line.endswith(':'):  # 发现新的角色标记
-                # 保存之前的消息（如果有）
-                if current_role and current_message:
-                    role = "assistant" if current_role == "Assistant" else "user"
-                    self.messages.append({
-                        "role": role,
-                        "content": '\n'.join(current_message).strip()
-                    })
-                    current_message = []
-                
-                # 设置新的角色
-                current_role = line[:-1]  # 移除冒号
-            elif line and current_role:  # 消息内容
-                current_message.append(line)
-        
-        # 保存最后一条消息
-        if current_role and current_message:
-            role = "assistant" if current_role == "Assistant" else "user"
-            self.messages.append({
-                "role": role,
-                "content": '\n'.join(current_message).strip()
-            })
+    def edit_message(self, message, content):
+        """修改一条消息：只重新显示对应的记录，只重新保存这一条"""
+        owner = self.engine.update_message(message, content)
+        block = self.chat_view.block_for(owner['_id'])
+        if block is not None:
+            self.chat_view.update_block(block, self.render_message(owner))
     
-    def create_input_area(self):
-        # 输入区域框架
-        input_frame = ttk.Frame(self.main_frame)
-        input_frame.pack(fill=tk.X, padx=5, pady=5)
-        
-        # 创建一个可调整大小的框架
-        input_resize_frame = ttk.Frame(input_frame)
-        input_resize_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        # 文本输入框
-        self.input_box = scrolledtext.ScrolledText(input_resize_frame, wrap=tk.WORD, height=3)
-        self.input_box.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        # 添加大小调整手柄
-        sizer = ttk.Sizegrip(input_resize_frame)
-        sizer.pack(side=tk.RIGHT, anchor=tk.SE)
-        
-        # 按钮框架
-        button_frame = ttk.Frame(input_frame)
-        button_frame.pack(side=tk.RIGHT)
-        
-        # 发送/停止按钮
-        self.send_button = ttk.Button(button_frame, text="发送", command=self.send_message)
-        self.send_button.pack(side=tk.LEFT, padx=2)
-        
-        # 自定义内容按钮
-        custom_button = ttk.Button(button_frame, text="⚡", width=3, command=self.show_custom_menu)
-        custom_button.pack(side=tk.LEFT, padx=2)
-        
-        # 绑定回车键发送
-        self.input_box.bind("<Return>", lambda e: self.send_message() if not e.state & 0x1 else None)
-        
-        # 添加停止标志
-        self.stop_generation = False
+    def remove_message(self, message):
+        """删除一条消息及其显示记录"""
+        self.engine.delete_message(message)
+        block = self.chat_view.block_for(message['_id'])
+        if block is not None:
+            self.chat_view.remove_block(block)
     
     def edit_system_prompt(self):
         # 创建新窗口
@@ -519,9 +846,7 @@ class AIChatInterface:
             self.save_config()
             
             # 更新消息历史
-            self.messages = []
-            if self.config['system_prompt']:
-                self.messages.append({"role": "system", "content": self.config['system_prompt']})
+            self.engine.reset()
             
             # 关闭窗口
             prompt_window.destroy()
@@ -557,221 +882,181 @@ class AIChatInterface:
         prompt_text.focus_set()
     
     def send_message(self):
-        if self.send_button["text"] == "停止":
-            self.stop_generation = True
+        """发送（或停止）当前标签页的消息"""
+        self.tab.send_message()
+    
+    def toggle_tool_cache(self):
+        """启用或绕过工具结果缓存"""
+        tool_cache = self.engine.tool_cache
+        tool_cache.enabled = self.tool_cache_var.get()
+        if not tool_cache.enabled:
+            tool_cache.clear()
+    
+    def clear_tool_cache(self):
+        """清空工具结果缓存"""
+        self.engine.tool_cache.clear()
+        self.append_message("System", "工具结果缓存已清空")
+    
+    def show_history(self):
+        """历史对话：分页列出已保存的对话，可按内容搜索并打开"""
+        if self.conversation_store is None:
+            messagebox.showerror("错误", "对话存储不可用")
             return
+        for tab in self.tabs.values():
+            tab.engine.persist_messages()
         
-        user_message = self.input_box.get("1.0", tk.END).strip()
-        if not user_message:
-            return
+        history_window = tk.Toplevel(self.root)
+        history_window.title("历史对话")
+        history_window.geometry("700x500")
+        history_window.transient(self.root)
         
-        # 清空输入框
-        self.input_box.delete("1.0", tk.END)
-        
-        # 显示用户消息
-        self.append_message("You", user_message)
-        
-        # 添加到消息历史
-        self.messages.append({"role": "user", "content": user_message})
-        
-        # 准备API请求
-        url = self.config['base_url']
-        headers = {
-            "Authorization": f"Bearer {self.config['api_key']}",
-            "Content-Type": "application/json"
-        }
-        
-        tools_info = ""
-        # 加载工具列表并添加到系统提示词中
-        try:
-            with open('tools_config.json', 'r', encoding='utf-8') as f:
-                tools = json.load(f)
-                for tool in tools:
-                    tools_info += f"- {tool['name']}: {tool['example']}\n"
-        except FileNotFoundError:
-            tools_info = "没有可用的工具"
-
-        print(tools_info)
+        main_frame = ttk.Frame(history_window)
+        main_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
-        # 更新系统提示词，包含工具信息
-        if self.messages and self.messages[0]['role'] == 'system':
-            system_prompt = self.config['system_prompt'].format(tools=tools_info)
-            self.messages[0]['content'] = system_prompt
-        else:
-            system_prompt = self.config['system_prompt'].format(tools=tools_info)
-            self.messages.insert(0, {"role": "system", "content": system_prompt})
-        
-        data = {
-            "messages": self.messages,
-            "model": self.config['model'],
-            "temperature": self.config['temperature'],
-            "stream": True
-        }
+        # 搜索栏
+        search_frame = ttk.Frame(main_frame)
+        search_frame.pack(fill=tk.X, pady=(0, 5))
+        search_var = tk.StringVar()
+        search_entry = ttk.Entry(search_frame, textvariable=search_var)
+        search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
+        
+        # 对话列表
+        list_frame = ttk.Frame(main_frame)
+        list_frame.pack(fill=tk.BOTH, expand=True)
+        conversation_list = tk.Listbox(list_frame)
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=conversation_list.yview)
+        conversation_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
-        # 开始新的助手消息
-        self.start_new_assistant_message()
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=tk.X, pady=(5, 0))
         
-        # 更改按钮为停止
-        self.send_button.config(text="停止")
-        self.stop_generation = False
+        # 当前列表中的对话和查询条件
+        results = []
+        state = {"query": "", "exhausted": False}
         
-        # 在新线程中发送请求
-        threading.Thread(target=self.send_request, args=(url, headers, data)).start()
-    
-    def send_request(self, url, headers, data):
-        try:
-            # 使用 certifi 提供的证书包
-            response = requests.post(
-                url,
-                json=data,
-                headers=headers,
-                stream=True,
-                verify=certifi.where()  # 使用 certifi 的证书包而不是 verify=False
-            )
-            
-            if response.status_code == 200:
-                for line in response.iter_lines():
-                    if line:
-                        line = line.decode('utf-8')
-                        if line.startswith('data: '):
-                            data = line[6:]
-                            if data != '[DONE]':
-                                try:
-                                    json_data = json.loads(data)
-                                    content = json_data['choices'][0]['delta'].get('content', '')
-                                    if content:
-                                        # 使用 after 方法在主线程中更新 UI
-                                        self.root.after(0, self.update_assistant_message, content)
-                                except json.JSONDecodeError:
-                                    continue
-                
-                # 完成后保存消息到历史
-                if hasattr(self, 'current_assistant_message'):
-                    self.messages.append({
-                        "role": "assistant",
-                        "content": self.current_assistant_message
-                    })
+        def load_page():
+            """加载下一页"""
+            if state["exhausted"]:
+                return
+            if state["query"]:
+                page = self.conversation_store.search(state["query"], offset=len(results))
             else:
-                # 处理错误响应
-                error_msg = ""
-                if response.status_code == 401:
-                    error_msg = "API Key 无效或已过期"
-                elif response.status_code == 403:
-                    error_msg = "API Key 没有权限访问该资源"
-                elif response.status_code == 429:
-                    error_msg = "请求过于频繁，请稍后再试"
-                else:
-                    try:
-                        error_data = response.json()
-                        error_msg = error_data.get('error', {}).get('message', f"API调用失败: {response.status_code}")
-                    except:
-                        error_msg = f"API调用失败: {response.status_code}"
-                
-                self.root.after(0, self.append_message, "System", error_msg)
-                
-        except requests.exceptions.RequestException as e:
-            self.root.after(0, self.append_message, "System", f"网络请求错误: {str(e)}")
-        except Exception as e:
-            self.root.after(0, self.update_assistant_message, f"\n请求错误: {str(e)}\n")
-        finally:
-            # 恢复发送按钮状态
-            self.root.after(0, lambda: self.send_button.config(text="发送"))
-            self.stop_generation = False
+                page = self.conversation_store.list_conversations(offset=len(results))
+            if not page:
+                state["exhausted"] = True
+                return
+            for item in page:
+                updated = time.strftime('%Y-%m-%d %H:%M', time.localtime(item['updated_at']))
+                line = f"{updated}  {item['title']}"
+                if item.get('snippet'):
+                    line += f"  —  {' '.join(item['snippet'].split())}"
+                conversation_list.insert(tk.END, line)
+                results.append(item)
+        
+        def search(event=None):
+            state["query"] = search_var.get().strip()
+            state["exhausted"] = False
+            results.clear()
+            conversation_list.delete(0, tk.END)
+            load_page()
+        
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            # 滚动到底部时自动加载下一页
+            if float(last) >= 1.0 and results:
+                load_page()
+        
+        def selected():
+            selection = conversation_list.curselection()
+            return results[selection[0]] if selection else None
+        
+        def open_selected(event=None):
+            item = selected()
+            if item is None:
+                return
+            # 已在其他标签页中打开的对话直接切换过去，同一对话不能由两个引擎同时追加
+            for tab in self.tabs.values():
+                if tab.engine.conversation_id == item['id']:
+                    self.notebook.select(tab.frame)
+                    history_window.destroy()
+                    return
+            if self.engine.busy:
+                messagebox.showwarning("提示", "请先停止当前的生成，或新建标签页后再打开")
+                return
+            self.open_conversation(item['id'])
+            history_window.destroy()
+        
+        def delete_selected():
+            item = selected()
+            if item is None or not messagebox.askyesno("确认", f"确定要删除对话“{item['title']}”吗？", parent=history_window):
+                return
+            self.conversation_store.delete_conversation(item['id'])
+            for tab in self.tabs.values():
+                if item['id'] == tab.engine.conversation_id:
+                    # 仍打开的对话在下次发送时连同已有消息一起保存为新对话
+                    tab.engine.start_new_conversation()
+            index = results.index(item)
+            results.pop(index)
+            conversation_list.delete(index)
+        
+        conversation_list.config(yscrollcommand=on_scroll)
+        conversation_list.bind("<Double-Button-1>", open_selected)
+        search_entry.bind("<Return>", search)
+        ttk.Button(search_frame, text="搜索", command=search).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="打开", command=open_selected).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="删除", command=delete_selected).pack(side=tk.RIGHT, padx=5)
+        
+        search()
+        search_entry.focus_set()
     
-    def start_new_assistant_message(self):
-        """开始新的助手消息"""
-        self.chat_display.config(state=tk.NORMAL)
-        # 插入新消息标记
-        self.chat_display.insert("end", "\n助手:\n")
-        # 记录内容开始位置
-        self.current_message_start = self.chat_display.index("end")
-        # 插入一个空行作为占位
-        self.chat_display.insert("end", "\n")
-        self.chat_display.see("end")
-        self.chat_display.config(state=tk.DISABLED)
-        # 重置当前消息和已处理工具集合
-        self.current_assistant_message = ""
-        self.processed_tools = set()  # 重置已处理工具集合
+    def open_conversation(self, conversation_id):
+        """用已保存的对话替换当前对话，之后的消息继续追加到该对话"""
+        messages = self.engine.open_conversation(conversation_id)
+        
+        self.chat_view.clear()
+        results = self.engine.tool_results()
+        for message in messages:
+            # 自动继续时追加的提示在生成时不显示，重新打开时也不显示
+            if message['role'] in ('user', 'assistant') and not message.get('_continuation'):
+                header = "你" if message['role'] == 'user' else "助手"
+                self.chat_view.append_block(header, message_id=message['_id'])
+                for text, tags in self.render_message(message, results):
+                    self.chat_view.append_text(text, tags)
+        self.chat_view.jump_to_end()
+        self.tab.title_from_messages()
     
-    def update_assistant_message(self, new_content):
-        """更新助手消息的显示并检查工具调用"""
-        self.chat_display.config(state=tk.NORMAL)
-        
-        try:
-            # 显示新内容
-            self.chat_display.insert("end-1c", new_content)
-            self.current_assistant_message += new_content
-            
-            # 检查是否包含完整的工具调用
-            current_message = self.current_assistant_message
-            tool_start = current_message.rfind("<tool>")
-            tool_end = current_message.find("</tool>", tool_start if tool_start != -1 else 0)
-            
-            # 只有当找到完整的工具调用标记时才处理
-            if tool_start != -1 and tool_end != -1 and tool_end > tool_start:
-                # 提取工具调用文本
-                tool_text = current_message[tool_start:tool_end + 7]  # +7 是 </tool> 的长度
-                
-                # 检查这个工具调用是否已经被处理过
-                if tool_text not in self.processed_tools:
-                    # 提取工具名称和参数
-                    tool_content = tool_text[6:-7].strip()  # 移除 <tool> 和 </tool>
-                    parts = tool_content.split(maxsplit=1)
-                    tool_name = parts[0]
-                    tool_args = parts[1] if len(parts) > 1 else ""
-                    
-                    # 执行工具调用
-                    result = self.execute_tool(tool_name, tool_args)
-                    
-                    # 显示工具执行结果（红色）
-                    result_text = f"\n[工具执行结果]\n{result}\n"
-                    result_index = self.chat_display.index("end-1c")
-                    self.chat_display.insert("end-1c", result_text)
-                    
-                    # 为结果添加红色标签
-                    start_index = f"{result_index} linestart"
-                    end_index = f"{result_index} lineend + {len(result.splitlines()) + 1} lines"
-                    self.chat_display.tag_add("tool_result", start_index, end_index)
-                    self.chat_display.tag_config("tool_result", foreground="red")
-                    
-                    # 更新消息历史
-                    self.current_assistant_message = (
-                        current_message[:tool_end + 7] +  # 包含 </tool>
-                        result_text
-                    )
-                    
-                    # 将此工具调用标记为已处理
-                    self.processed_tools.add(tool_text)
-            
-            self.chat_display.see("end")
-        except Exception as e:
-            print(f"Error updating message: {str(e)}")
-            error_text = f"\n[错误]\n{str(e)}\n"
-            self.chat_display.insert("end-1c", error_text)
-            self.current_assistant_message += error_text
-        
-        self.chat_display.config(state=tk.DISABLED)
+    def render_message(self, message, results=None):
+        """返回用户或助手消息在聊天记录中显示的 [(文本, 标签)]，原生函数调用的结果显示在对应的助手消息中"""
+        if message['role'] != 'assistant':
+            return [(f"{message['content']}\n\n", ())]
+        segments = [(f"\n{message['content']}", ())]
+        tool_calls = message.get('tool_calls') or []
+        if tool_calls and results is None:
+            results = self.engine.tool_results()
+        for call in tool_calls:
+            function = call['function']
+            try:
+                tool_args = self.engine.tool_registry.format_arguments(function['name'], json_loads(function['arguments'] or "{}"))
+            except (ValueError, AttributeError):
+                tool_args = function['arguments']
+            segments.append((f"\n[调用工具] {function['name']} {tool_args}".rstrip() + "\n", ()))
+            if call['id'] in results:
+                segments.append((f"\n[工具执行结果]\n{results[call['id']]}\n", ("tool_result",)))
+        return segments
     
-    def append_message(self, sender, message):
-        """添加新消息到聊天显示区域"""
-        sender_name = "你" if sender == "You" else "助手" if sender == "Assistant" else "系统"
-        self.chat_display.config(state=tk.NORMAL)
-        self.chat_display.insert(tk.END, f"\n{sender_name}:\n{message}\n\n")
-        self.chat_display.see(tk.END)
-        self.chat_display.config(state=tk.DISABLED)
+    def append_message(self, sender, message, message_id=None):
+        """添加新消息到当前标签页的聊天显示区域"""
+        self.tab.append_message(sender, message, message_id)
     
     def clear_chat(self):
         """清空对话历史"""
         if messagebox.askyesno("确认", "确定要清空所有对话历史吗？"):
             # 清空聊天显示
-            self.chat_display.config(state=tk.NORMAL)
-            self.chat_display.delete("1.0", tk.END)
-            self.chat_display.config(state=tk.DISABLED)
+            self.chat_view.clear()
             
-            # 重置消息历史
-            self.messages = []
-            if self.config['system_prompt']:
-                self.messages.append({"role": "system", "content": self.config['system_prompt']})
+            # 重置消息历史（原对话已保存，可在历史对话中找回）
+            self.engine.reset()
             
             # 聚焦到输入框
             self.input_box.focus_set()
@@ -816,6 +1101,11 @@ class AIChatInterface:
         name_entry = ttk.Entry(edit_frame, textvariable=name_var)
         name_entry.pack(fill=tk.X, padx=5, pady=2)
         
+        # 结果缓存时间（只读工具可设置，0 表示不缓存）
+        ttk.Label(edit_frame, text="结果缓存(秒，0 表示不缓存):").pack(anchor=tk.W, padx=5, pady=2)
+        cache_ttl_var = tk.StringVar(value="0")
+        ttk.Entry(edit_frame, textvariable=cache_ttl_var, width=10).pack(anchor=tk.W, padx=5, pady=2)
+        
         # 工具示例
         ttk.Label(edit_frame, text="示例:").pack(anchor=tk.W, padx=5, pady=2)
         example_text = scrolledtext.ScrolledText(edit_frame, height=4)
@@ -827,21 +1117,16 @@ class AIChatInterface:
         code_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=2)
         
         def load_tools():
-            """加载工具列表"""
-            try:
-                with open('tools_config.json', 'r', encoding='utf-8') as f:
-                    tools = json.load(f)
-                    tools_list.delete(0, tk.END)
-                    for tool in tools:
-                        tools_list.insert(tk.END, tool['name'])
-                    return tools
-            except FileNotFoundError:
-                return []
+            """加载工具列表（复制一份用于编辑）"""
+            tools = [dict(tool) for tool in self.engine.tool_registry.tools()]
+            tools_list.delete(0, tk.END)
+            for tool in tools:
+                tools_list.insert(tk.END, tool['name'])
+            return tools
         
         def save_tools(tools):
-            """保存工具列表"""
-            with open('tools_config.json', 'w', encoding='utf-8') as f:
-                json.dump(tools, f, ensure_ascii=False, indent=4)
+            """保存工具列表（注册表随即重新加载）"""
+            self.engine.tool_registry.save(tools)
         
         def on_select(event):
             """选择工具时的处理"""
@@ -850,6 +1135,7 @@ class AIChatInterface:
             index = tools_list.curselection()[0]
             tool = tools[index]
             name_var.set(tool['name'])
+            cache_ttl_var.set(str(tool.get('cache_ttl', 0)))
             example_text.delete('1.0', tk.END)
             example_text.insert('1.0', tool['example'])
             code_text.delete('1.0', tk.END)
@@ -875,11 +1161,23 @@ class AIChatInterface:
             if not tools_list.curselection():
                 return
             index = tools_list.curselection()[0]
-            tools[index] = {
+            try:
+                cache_ttl = int(cache_ttl_var.get().strip() or 0)
+            except ValueError:
+                messagebox.showwarning("警告", "结果缓存时间必须是整数秒！")
+                return
+            # 在原有条目上更新，保留界面上没有展示的字段
+            tool = dict(tools[index])
+            tool.update({
                 'name': name_var.get(),
                 'example': example_text.get('1.0', tk.END).strip(),
                 'code': code_text.get('1.0', tk.END).strip()
-            }
+            })
+            if cache_ttl > 0:
+                tool['cache_ttl'] = cache_ttl
+            else:
+                tool.pop('cache_ttl', None)
+            tools[index] = tool
             tools_list.delete(index)
             tools_list.insert(index, name_var.get())
             tools_list.selection_set(index)
@@ -901,6 +1199,7 @@ class AIChatInterface:
         def clear_form():
             """清空表单"""
             name_var.set("")
+            cache_ttl_var.set("0")
             example_text.delete('1.0', tk.END)
             code_text.delete('1.0', tk.END)
         
@@ -940,73 +1239,6 @@ class AIChatInterface:
         # 等待窗口创建完成后再居中
         self.root.after(10, center_dialog)
     
-    def execute_tool(self, tool_name, args):
-        """执行工具调用"""
-        try:
-            # 加载工具配置
-            with open('tools_config.json', 'r', encoding='utf-8') as f:
-                tools = json.load(f)
-            
-            # 从函数定义中查找工具
-            function_code = None
-            for tool in tools:
-                if tool['code'].startswith(f"function {tool_name}"):
-                    function_code = tool['code']
-                    break
-            
-            if not function_code:
-                return f"错误：找不到工具 '{tool_name}'"
-            
-            # 构建完整的函数调用
-            function_call = f"{tool_name} {args}".strip()
-            
-            # 创建临时 PowerShell 脚本文件
-            script_path = 'temp_script.ps1'
-            
-            # 构建完整的 PowerShell 脚本
-            full_script = f"""
-# 设置输出编码为 UTF-8
-[Console]::OutputEncoding = [System.Text.Encoding]::UTF8
-$OutputEncoding = [System.Text.Encoding]::UTF8
-
-# 定义函数
-{function_code}
-
-# 执行函数并捕获错误
-try {{
-    {function_call}
-}} catch {{
-    Write-Error $_.Exception.Message
-    exit 1
-}}
-"""
-            
-            # 使用 UTF-8 编码保存脚本
-            with open(script_path, 'w', encoding='utf-8') as f:
-                f.write(full_script)
-            
-            # 执行 PowerShell 脚本
-            result = subprocess.run(
-                ['powershell', '-NoProfile', '-ExecutionPolicy', 'Bypass', '-File', script_path],
-                capture_output=True,
-                text=True,
-                encoding='utf-8'
-            )
-            
-            # 删除临时脚本文件
-            try:
-                os.remove(script_path)
-            except:
-                pass
-            
-            if result.returncode == 0:
-                return result.stdout.strip()
-            else:
-                return f"错误：{result.stderr.strip()}"
-            
-        except Exception as e:
-            return f"工具执行错误：{str(e)}"
-    
     def load_custom_contents(self):
         """加载自定义内容"""
         try:
@@ -1237,32 +1469,21 @@ try {{
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(side=tk.TOP, fill=tk.X, pady=(0, 5))
         
+        # 当前聊天记录和消息历史的副本（替换时写回打开时所在的标签页，两者保持一致）
+        chat_view = self.chat_view
+        engine = self.engine
+        snapshot = chat_view.snapshot()
+        engine_snapshot = engine.snapshot()
+        
         # 添加替换按钮
         def replace_main_content():
-            if messagebox.askyesno("确认", "确定要用此对话内容替换主窗口的内容吗？"):
-                # 清空主窗口内容
-                self.chat_display.config(state=tk.NORMAL)
-                self.chat_display.delete("1.0", tk.END)
-                
-                # 先配置主窗口的标签
-                self.chat_display.tag_configure("tool_result", foreground="red")
-                
-                # 复制内容到主窗口
-                self.chat_display.insert("1.0", text_area.get("1.0", tk.END))
-                
-                # 复制标签范围
-                for tag in text_area.tag_names():
-                    if tag != "sel":  # 跳过选择标签
-                        try:
-                            ranges = text_area.tag_ranges(tag)
-                            for i in range(0, len(ranges), 2):
-                                start = self.chat_display.index(ranges[i])
-                                end = self.chat_display.index(ranges[i+1])
-                                self.chat_display.tag_add(tag, start, end)
-                        except Exception as e:
-                            print(f"Error copying tag {tag}: {str(e)}")
-                
-                self.chat_display.config(state=tk.DISABLED)
+            if engine.busy:
+                messagebox.showwarning("警告", "请先停止当前的生成", parent=dialog_window)
+                return
+            if messagebox.askyesno("确认", "确定要用此对话内容替换主窗口的内容吗？", parent=dialog_window):
+                # 用副本替换主窗口的聊天记录和之后发送的历史
+                engine.restore(engine_snapshot)
+                chat_view.restore(snapshot)
 
         ttk.Button(button_frame, text="替换到主窗口", command=replace_main_content).pack(side=tk.LEFT, padx=5)
         
@@ -1273,20 +1494,9 @@ try {{
         # 配置工具结果标签
         text_area.tag_configure("tool_result", foreground="red")
         
-        # 复制当前对话内容
-        text_area.insert("1.0", self.chat_display.get("1.0", tk.END))
-        
-        # 复制所有标签范围
-        for tag in self.chat_display.tag_names():
-            if tag != "sel":  # 跳过选择标签
-                try:
-                    ranges = self.chat_display.tag_ranges(tag)
-                    for i in range(0, len(ranges), 2):
-                        start = text_area.index(ranges[i])
-                        end = text_area.index(ranges[i+1])
-                        text_area.tag_add(tag, start, end)
-                except Exception as e:
-                    print(f"Error copying tag {tag}: {str(e)}")
+        # 复制当前对话内容（带工具结果等标签）
+        for text, tags in self.chat_view.segments():
+            text_area.insert(tk.END, text, tags)
         
         text_area.config(state=tk.DISABLED)
         
@@ -1304,7 +1514,7 @@ try {{
     def extract_code(self):
         """提取对话中的代码块"""
         # 获取当前对话内容
-        content = self.chat_display.get("1.0", tk.END)
+        content = self.chat_view.text()
         
         # 使用正则表达式查找所有代码块
         # 匹配 ```language 和 ``` 之间的内容
@@ -1353,7 +1563,19 @@ try {{
         if block_count == 0:
             messagebox.showinfo("提示", "未找到代码块")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI 对话客户端")
+    parser.add_argument('--batch', metavar='PROMPTS', help="不打开界面，批量执行 JSONL 提示词文件（每行 {\"name\": ..., \"content\": ...}）")
+    parser.add_argument('--config', help="批量执行使用的配置名（默认为第一个配置）")
+    parser.add_argument('--output', default='-', help="批量执行结果的 JSONL 文件（默认输出到标准输出）")
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY, help="同时执行的提示词数")
+    parser.add_argument('--metrics-port', type=int, default=0, help="在该端口提供 Prometheus 格式的指标（默认不开启）")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.batch:
+        sys.exit(run_batch(args.batch, args.config, args.output, args.concurrency, args.metrics_port))
     root = tk.Tk()
-    app = AIChatInterface(root)
+    app = AIChatInterface(root, args.metrics_port)
     root.mainloop() 
\ No newline at end of file
@@ -0,0 +1,375 @@
+"""聊天记录的窗口化显示
+
+完整的显示内容保存在 ChatView 的记录列表中，Text 控件只保留视口附近的一段记录：
+新内容追加到末尾，超出字符预算时从远离视口的一端移除整条记录，滚动到顶部或底部时再从记录列表中分页载入。
+控件中的文本量因此有上限，追加和滚动的开销与会话总长度无关。
+"""
+import itertools
+import tkinter as tk
+
+# Text 控件中最多保留的字符数
+CHAT_VIEW_MAX_CHARS = 200000
+# 滚动到边缘时每次载入的字符数
+CHAT_VIEW_PAGE_CHARS = 50000
+# 单个片段的显示上限，更长的内容（如大段工具输出）只显示首尾，完整内容仍保存在记录中
+CHAT_VIEW_SEGMENT_LIMIT = 20000
+
+def display_text(text):
+    """返回片段在控件中显示的文本"""
+    if len(text) <= CHAT_VIEW_SEGMENT_LIMIT:
+        return text
+    half = CHAT_VIEW_SEGMENT_LIMIT // 2
+    return f"{text[:half]}\n……（省略 {len(text) - 2 * half} 个字符）……\n{text[-half:]}"
+
+class Segment:
+    """记录中的一段文本；key 不为空时可以之后原位替换（如工具结果占位）"""
+    __slots__ = ('text', 'tags', 'key')
+
+    def __init__(self, text, tags=(), key=None):
+        self.text = text
+        self.tags = tuple(tags)
+        self.key = key
+
+    def display_tags(self):
+        return self.tags + (self.key,) if self.key else self.tags
+
+class Block:
+    """一条显示记录：标题行（如“助手:”）和若干文本片段；message_id 为对应消息的 ID（系统提示等为 None）"""
+    __slots__ = ('id', 'index', 'header', 'segments', 'length', 'message_id')
+
+    def __init__(self, block_id, index, header, message_id=None):
+        self.id = block_id
+        self.index = index
+        self.header = header
+        self.message_id = message_id
+        self.segments = []
+        # 在控件中显示的字符数（未显示时为 0）
+        self.length = 0
+
+    def pieces(self):
+        """返回在控件中显示的 (文本, 标签) 列表"""
+        pieces = [(f"\n{self.header}:\n", ())] if self.header else []
+        pieces.extend((display_text(segment.text), segment.display_tags()) for segment in self.segments)
+        return pieces
+
+    def text(self):
+        """返回记录的完整文本"""
+        header = f"\n{self.header}:\n" if self.header else ""
+        return header + "".join(segment.text for segment in self.segments)
+
+class ChatView:
+    """在 ScrolledText 上按窗口显示聊天记录，控件中只保留 [first, last) 范围内的记录"""
+    def __init__(self, text, max_chars=CHAT_VIEW_MAX_CHARS, page_chars=CHAT_VIEW_PAGE_CHARS):
+        self.widget = text
+        self.max_chars = max_chars
+        self.page_chars = page_chars
+        self.blocks = []
+        self.first = 0
+        self.last = 0
+        # 控件中的字符数
+        self.chars = 0
+        self._ids = itertools.count(1)
+        self._keys = {}
+        # 消息 ID 到记录的映射
+        self._messages = {}
+        self._check_pending = False
+        # 接管滚动条回调，滚动到边缘时分页载入
+        self._scrollbar_set = text.vbar.set if hasattr(text, 'vbar') else None
+        text.config(yscrollcommand=self._on_yscroll)
+
+    @staticmethod
+    def _mark(block):
+        return f"block_{block.id}"
+
+    def _edit(self, func, *args):
+        """在可编辑状态下修改控件"""
+        self.widget.config(state=tk.NORMAL)
+        try:
+            func(*args)
+        finally:
+            self.widget.config(state=tk.DISABLED)
+
+    def _tail_shown(self):
+        return self.last == len(self.blocks)
+
+    def _shown(self, block):
+        return self.first <= block.index < self.last
+
+    def _following(self):
+        """视口是否停在末尾（此时新内容自动滚动可见）"""
+        return self._tail_shown() and self.widget.yview()[1] >= 1.0
+
+    def _show_at_end(self, block):
+        """把记录显示在控件末尾"""
+        mark = self._mark(block)
+        self.widget.mark_set(mark, "end-1c")
+        self.widget.mark_gravity(mark, tk.LEFT)
+        for text, tags in block.pieces():
+            self.widget.insert("end-1c", text, tags)
+            block.length += len(text)
+        self.chars += block.length
+        self.last = block.index + 1
+
+    def _show_at_top(self, block):
+        """把记录显示在控件开头（位于当前第一条记录之前）"""
+        self.widget.mark_set("page_in", "1.0")
+        self.widget.mark_gravity("page_in", tk.RIGHT)
+        for text, tags in block.pieces():
+            self.widget.insert("page_in", text, tags)
+            block.length += len(text)
+        if self.first < self.last:
+            self.widget.mark_set(self._mark(self.blocks[self.first]), "page_in")
+        mark = self._mark(block)
+        self.widget.mark_set(mark, "1.0")
+        self.widget.mark_gravity(mark, tk.LEFT)
+        self.widget.mark_unset("page_in")
+        self.chars += block.length
+        self.first = block.index
+
+    def _hide_first(self):
+        block = self.blocks[self.first]
+        self.widget.delete("1.0", self._mark(self.blocks[self.first + 1]))
+        self.widget.mark_unset(self._mark(block))
+        self.chars -= block.length
+        block.length = 0
+        self.first += 1
+
+    def _hide_last(self):
+        block = self.blocks[self.last - 1]
+        self.widget.delete(self._mark(block), "end-1c")
+        self.widget.mark_unset(self._mark(block))
+        self.chars -= block.length
+        block.length = 0
+        self.last -= 1
+
+    def _redraw(self, block):
+        """重新显示一条已显示的记录，其余记录不动"""
+        following = self.blocks[block.index + 1] if block.index + 1 < self.last else None
+        self.widget.delete(self._mark(block), self._mark(following) if following else "end-1c")
+        self.chars -= block.length
+        block.length = 0
+        self.widget.mark_set("redraw", self._mark(block))
+        self.widget.mark_gravity("redraw", tk.RIGHT)
+        for text, tags in block.pieces():
+            self.widget.insert("redraw", text, tags)
+            block.length += len(text)
+        if following:
+            self.widget.mark_set(self._mark(following), "redraw")
+        self.widget.mark_unset("redraw")
+        self.chars += block.length
+
+    def _keep_view(self, func, *args):
+        """修改视口之外的内容，同时保持视口顶部的内容不动"""
+        self.widget.mark_set("view_anchor", "@0,0")
+        self.widget.mark_gravity("view_anchor", tk.RIGHT)
+        func(*args)
+        self.widget.yview("view_anchor")
+        self.widget.mark_unset("view_anchor")
+
+    def _trim(self, prefer=None):
+        """超出字符预算时从远离视口的一端移除整条记录（至少保留一条）"""
+        while self.chars > self.max_chars and self.last - self.first > 1:
+            if prefer is None:
+                top, bottom = self.widget.yview()
+                side = 'top' if top + bottom >= 1.0 else 'bottom'
+            else:
+                side = prefer
+            if side == 'top':
+                following = self._following()
+                self._keep_view(self._hide_first)
+                if following:
+                    self.widget.see("end")
+            else:
+                self._hide_last()
+
+    def _add_block(self, header, message_id):
+        block = Block(next(self._ids), len(self.blocks), header, message_id)
+        if message_id is not None:
+            self._messages[message_id] = block
+        return block
+
+    def _drop_keys(self, block):
+        for segment in block.segments:
+            if segment.key is not None:
+                self._keys.pop(segment.key, None)
+                self.widget.tag_delete(segment.key)
+
+    def append_block(self, header, text=None, tags=(), follow=False, message_id=None):
+        """追加一条记录；follow 为 True 时（如用户发送消息）跳到末尾显示"""
+        if follow:
+            self.jump_to_end()
+        following = self._following()
+        block = self._add_block(header, message_id)
+        if text:
+            block.segments.append(Segment(text, tags))
+        tail_shown = self._tail_shown()
+        self.blocks.append(block)
+        if tail_shown:
+            self._edit(self._show_at_end, block)
+            if following:
+                self.widget.see("end")
+            self._edit(self._trim)
+        return block
+
+    def append_text(self, text, tags=(), key=None):
+        """向最后一条记录追加文本；key 用于之后通过 replace 替换这段文本"""
+        if not self.blocks:
+            self.append_block(None)
+        block = self.blocks[-1]
+        tags = tuple(tags)
+        last = block.segments[-1] if block.segments else None
+        if (key is None and last is not None and last.key is None and last.tags == tags
+                and len(last.text) + len(text) <= CHAT_VIEW_SEGMENT_LIMIT):
+            last.text += text
+            shown = text
+        else:
+            segment = Segment(text, tags, key)
+            block.segments.append(segment)
+            if key is not None:
+                self._keys[key] = (block, segment)
+            shown = display_text(text)
+            tags = segment.display_tags()
+        if self._shown(block):
+            following = self._following()
+            self._edit(self.widget.insert, "end-1c", shown, tags)
+            block.length += len(shown)
+            self.chars += len(shown)
+            if following:
+                self.widget.see("end")
+            self._edit(self._trim)
+
+    def replace(self, key, text, tags=()):
+        """替换 append_text 时用 key 标记的文本"""
+        entry = self._keys.pop(key, None)
+        if entry is None:
+            return
+        block, segment = entry
+        old = display_text(segment.text)
+        segment.text = text
+        segment.tags = tuple(tags)
+        segment.key = None
+        if self._shown(block):
+            ranges = self.widget.tag_ranges(key)
+            if ranges:
+                new = display_text(text)
+                start = self.widget.index(ranges[0])
+
+                def swap():
+                    self.widget.delete(start, ranges[1])
+                    self.widget.insert(start, new, segment.tags)
+                self._edit(swap)
+                block.length += len(new) - len(old)
+                self.chars += len(new) - len(old)
+        self.widget.tag_delete(key)
+
+    def block_for(self, message_id):
+        """返回消息对应的记录（没有时返回 None）"""
+        return self._messages.get(message_id)
+
+    def update_block(self, block, segments):
+        """用 [(文本, 标签)] 替换一条记录的内容，只重绘这一条"""
+        self._drop_keys(block)
+        block.segments = [Segment(text, tags) for text, tags in segments]
+        if self._shown(block):
+            self._edit(self._keep_view, self._redraw, block)
+            self._edit(self._trim)
+
+    def remove_block(self, block):
+        """删除一条记录，之后的记录依次前移"""
+        if self._shown(block):
+            following = self.blocks[block.index + 1] if block.index + 1 < self.last else None
+            self._edit(self.widget.delete, self._mark(block), self._mark(following) if following else "end-1c")
+            self.widget.mark_unset(self._mark(block))
+            self.chars -= block.length
+            self.last -= 1
+        elif block.index < self.first:
+            self.first -= 1
+            self.last -= 1
+        self._drop_keys(block)
+        if block.message_id is not None:
+            self._messages.pop(block.message_id, None)
+        del self.blocks[block.index]
+        for later in self.blocks[block.index:]:
+            later.index -= 1
+        if self.first == self.last and self.blocks:
+            self.jump_to_end()
+
+    def clear(self):
+        """清空全部记录"""
+        self._edit(self.widget.delete, "1.0", tk.END)
+        for block in self.blocks[self.first:self.last]:
+            self.widget.mark_unset(self._mark(block))
+        for key in self._keys:
+            self.widget.tag_delete(key)
+        self.blocks = []
+        self._keys = {}
+        self._messages = {}
+        self.first = self.last = 0
+        self.chars = 0
+
+    def jump_to_end(self):
+        """显示最后一页记录并滚动到末尾"""
+        if not self._tail_shown():
+            self._edit(self.widget.delete, "1.0", tk.END)
+            for block in self.blocks[self.first:self.last]:
+                self.widget.mark_unset(self._mark(block))
+                block.length = 0
+            self.first = self.last = len(self.blocks)
+            self.chars = 0
+            while self.first > 0 and self.chars < self.page_chars:
+                self._edit(self._show_at_top, self.blocks[self.first - 1])
+        self.widget.see("end")
+
+    def _on_yscroll(self, first, last):
+        if self._scrollbar_set is not None:
+            self._scrollbar_set(first, last)
+        if not self._check_pending:
+            self._check_pending = True
+            self.widget.after_idle(self._check_scroll)
+
+    def _check_scroll(self):
+        """视口到达已显示内容的边缘时载入相邻的记录"""
+        self._check_pending = False
+        top, bottom = self.widget.yview()
+        if top <= 0.0 and self.first > 0:
+            def page_in_top():
+                added = self.chars
+                while self.first > 0 and self.chars - added < self.page_chars:
+                    self._show_at_top(self.blocks[self.first - 1])
+            self._edit(self._keep_view, page_in_top)
+            self._edit(self._trim, 'bottom')
+        elif bottom >= 1.0 and not self._tail_shown():
+            def page_in_bottom():
+                added = self.chars
+                while not self._tail_shown() and self.chars - added < self.page_chars:
+                    self._show_at_end(self.blocks[self.last])
+            self._edit(page_in_bottom)
+            self._edit(self._trim, 'top')
+
+    def text(self):
+        """返回全部记录的完整文本（不受窗口和显示上限影响）"""
+        return "".join(block.text() for block in self.blocks)
+
+    def segments(self):
+        """按顺序返回全部记录的 (完整文本, 标签)"""
+        for block in self.blocks:
+            if block.header:
+                yield f"\n{block.header}:\n", ()
+            for segment in block.segments:
+                yield segment.text, segment.tags
+
+    def snapshot(self):
+        """返回当前全部记录的副本，可用 restore 恢复"""
+        return [
+            (block.header, [(s.text, s.tags) for s in block.segments], block.message_id)
+            for block in self.blocks
+        ]
+
+    def restore(self, snapshot):
+        """用 snapshot 返回的副本替换当前记录"""
+        self.clear()
+        for header, segments, message_id in snapshot:
+            block = self._add_block(header, message_id)
+            block.segments = [Segment(text, tags) for text, tags in segments]
+            self.blocks.append(block)
+        self.jump_to_end()
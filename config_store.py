@@ -0,0 +1,185 @@
+"""配置存储：configs.json 的内存缓存
+
+读取时只检查文件的修改时间、大小和 inode，未变化时直接使用缓存；
+写入时在文件锁内重新读取磁盘上的最新内容，只修改目标配置后写入临时文件再原子替换，
+多个程序实例同时修改不同配置时不会互相覆盖，也不会留下写了一半的文件。
+"""
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+# 默认的配置文件
+CONFIGS_FILE = 'configs.json'
+# 替换文件失败时的重试次数
+REPLACE_RETRIES = 20
+
+DEFAULT_CONFIG = {
+    'api_key': '',
+    'base_url': '',
+    'system_prompt': '',
+    'temperature': 0.7,
+    'model': ''
+}
+
+@contextmanager
+def file_lock(path):
+    """在 path + '.lock' 上加独占锁（跨进程），退出时释放"""
+    with open(path + '.lock', 'a+b') as f:
+        if msvcrt is not None:
+            f.seek(0)
+            while True:
+                try:
+                    # LK_LOCK 重试约 10 秒后仍失败会抛出 OSError，继续等待
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def atomic_write(path, data):
+    """先写入同目录下的临时文件，再用 os.replace 替换目标文件；返回写入文件的标记"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            stamp = _stat_stamp(os.fstat(f.fileno()))
+        for attempt in range(REPLACE_RETRIES):
+            try:
+                os.replace(temp_path, path)
+                break
+            except PermissionError:
+                # Windows 上目标文件正被其他程序读取时无法替换，稍后重试
+                if attempt == REPLACE_RETRIES - 1:
+                    raise
+                time.sleep(0.05)
+        return stamp
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def _stat_stamp(stat):
+    # 替换文件会改变 inode，同一时间戳内的两次写入也能区分
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def _file_stamp(path):
+    try:
+        return _stat_stamp(os.stat(path))
+    except FileNotFoundError:
+        return None
+
+class ConfigStore:
+    """按配置名索引的配置表，文件变化时自动重新加载；返回的配置都是副本"""
+    def __init__(self, path=CONFIGS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._configs = {}
+        self._stamp = None
+        self._loaded = False
+
+    def _read(self):
+        """读取磁盘上的配置，返回 (配置表, 文件标记)；文件不存在时配置表为 None"""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return None, None
+        with f:
+            stamp = _stat_stamp(os.fstat(f.fileno()))
+            configs = json.loads(f.read().decode('utf-8-sig'))
+        if not isinstance(configs, dict):
+            raise ValueError("顶层必须是配置名到配置的映射")
+        return configs, stamp
+
+    def _refresh(self):
+        """文件变化时重新加载（需持有 _lock）"""
+        stamp = _file_stamp(self.path)
+        if self._loaded and stamp == self._stamp:
+            return
+        if stamp is None:
+            # 第一次运行：写入默认配置
+            self._update({}, lambda configs: configs.setdefault('default', dict(DEFAULT_CONFIG)))
+            return
+        try:
+            configs, stamp = self._read()
+        except (OSError, ValueError) as e:
+            # 文件损坏或正在被其他程序写入：继续使用上一次加载的配置，不覆盖文件
+            print(f"Error loading configs: {str(e)}")
+            if not self._loaded:
+                self._configs = {'default': dict(DEFAULT_CONFIG)}
+                self._loaded = True
+            return
+        self._configs = configs or {}
+        self._stamp = stamp
+        self._loaded = True
+
+    def _update(self, fallback, modify):
+        """在文件锁内读取最新内容、修改并原子写回（需持有 _lock）"""
+        with file_lock(self.path):
+            try:
+                configs, _ = self._read()
+            except ValueError as e:
+                print(f"Error loading configs: {str(e)}")
+                configs = None
+            if configs is None:
+                configs = fallback
+            modify(configs)
+            data = json.dumps(configs, indent=4, ensure_ascii=False).encode('utf-8')
+            self._stamp = atomic_write(self.path, data)
+            self._configs = configs
+            self._loaded = True
+
+    def names(self):
+        """返回全部配置名（按文件中的顺序）"""
+        with self._lock:
+            self._refresh()
+            return list(self._configs.keys())
+
+    def get(self, name):
+        """返回指定配置的副本，不存在时返回 None"""
+        with self._lock:
+            self._refresh()
+            config = self._configs.get(name)
+            return copy.deepcopy(config) if config is not None else None
+
+    def put(self, name, config):
+        """保存（新建或整体替换）一个配置"""
+        config = copy.deepcopy(config)
+        with self._lock:
+            self._update(copy.deepcopy(self._configs), lambda configs: configs.__setitem__(name, config))
+
+    def merge(self, name, fields):
+        """只更新配置中的指定字段，其他字段（包括其他程序实例写入的）保持不变；返回更新后的副本"""
+        fields = copy.deepcopy(fields)
+        with self._lock:
+            self._update(copy.deepcopy(self._configs), lambda configs: configs.setdefault(name, {}).update(fields))
+            return copy.deepcopy(self._configs[name])
+
+    def delete(self, name):
+        """删除一个配置"""
+        with self._lock:
+            self._update(copy.deepcopy(self._configs), lambda configs: configs.pop(name, None))
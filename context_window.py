@@ -0,0 +1,122 @@
+"""上下文窗口管理：按 token 预算裁剪每轮发送给模型的消息
+
+固定保留系统提示词和最近几轮对话，较早的轮次在预算内尽量保留，超出预算的部分被丢弃，
+可选地由后台调用较便宜的配置把被丢弃的轮次压缩为摘要。
+"""
+import re
+
+# 默认的上下文预算（估算的 token 数），可在配置中用 context_budget 覆盖
+CONTEXT_BUDGET = 32000
+# 无论预算多少都保留的最近轮数，可在配置中用 context_keep_turns 覆盖
+CONTEXT_KEEP_TURNS = 3
+# 每条消息的格式开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 中日韩字符及全角符号大致每个字符一个 token，其余文本大致每 4 个字符一个 token
+CJK_PATTERN = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+SUMMARY_PROMPT = (
+    "你是对话摘要助手。请把下面的历史对话压缩为简洁的摘要，保留用户的目标、"
+    "已执行的工具及其关键结果、已得出的结论和尚未解决的问题，不要编造内容。"
+)
+
+def estimate_text_tokens(text):
+    """本地估算一段文本的 token 数（不依赖具体模型的分词器）"""
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def estimate_message_tokens(message):
+    """估算单条消息的 token 数
+
+    结果缓存在消息的本地字段 _tokens 中，按内容的长度和哈希判断是否仍然有效
+    （字符串的哈希值只计算一次），缓存随消息一起释放，不会让已删除的长文本常驻内存。
+    """
+    content = message.get('content') or ''
+    if not isinstance(content, str):
+        content = str(content)
+    content += message.get('_tool_usage') or ''
+    key = (len(content), hash(content))
+    cached = message.get('_tokens')
+    if cached is None or cached[0] != key:
+        cached = (key, estimate_text_tokens(content) + MESSAGE_OVERHEAD_TOKENS)
+        message['_tokens'] = cached
+    return cached[1]
+
+def outgoing_message(message):
+    """去掉只在本地使用的字段（以下划线开头，如消息 ID）后的发送副本
+
+    用户消息上保存的相关工具用法（_tool_usage）附在内容之后一起发送
+    """
+    outgoing = {key: value for key, value in message.items() if not key.startswith('_')}
+    if message.get('_tool_usage'):
+        outgoing['content'] = f"{outgoing.get('content') or ''}{message['_tool_usage']}"
+    return outgoing
+
+def summary_message(summary):
+    """把摘要包装为一条消息，放在系统提示词之后"""
+    return {"role": "user", "content": f"[此前对话的摘要]\n{summary['text']}"}
+
+def split_turns(messages, offset):
+    """按用户消息把消息切分为轮次，返回 [(起始下标, 结束下标)]，下标相对于完整历史
+
+    自动继续时追加的提示（_continuation）属于同一轮，不开始新的一轮，
+    否则保留最近几轮时可能只剩下自动继续的步骤而丢掉真正的问题
+    """
+    turns = []
+    start = None
+    for i, message in enumerate(messages):
+        if (message.get('role') == 'user' and not message.get('_continuation')) or start is None:
+            if start is not None:
+                turns.append((offset + start, offset + i))
+            start = i
+    if start is not None:
+        turns.append((offset + start, offset + len(messages)))
+    return turns
+
+class ContextWindow:
+    """按 token 预算从完整历史中挑选本轮要发送的消息"""
+    def __init__(self, budget=CONTEXT_BUDGET, keep_turns=CONTEXT_KEEP_TURNS):
+        self.budget = budget
+        self.keep_turns = keep_turns
+
+    def build(self, messages, summary=None):
+        """返回 (发送的消息副本列表, 截断位置)
+
+        summary 为 {"upto": n, "text": ...}，表示 messages[1:n] 已被压缩为摘要；
+        截断位置 cut 表示 messages[cut:] 全部被保留，之前的非系统消息没有原样发送。
+        """
+        head = []
+        start = 0
+        if messages and messages[0].get('role') == 'system':
+            head.append(messages[0])
+            start = 1
+        if summary and start < summary['upto'] <= len(messages):
+            head.append(summary_message(summary))
+            start = summary['upto']
+
+        used = sum(estimate_message_tokens(message) for message in head)
+        turns = split_turns(messages[start:], start)
+        cut = len(messages)
+        # 从最近的轮次往前保留：最近 keep_turns 轮必定保留，其余在预算内尽量保留
+        for count, (turn_start, turn_end) in enumerate(reversed(turns)):
+            cost = sum(estimate_message_tokens(message) for message in messages[turn_start:turn_end])
+            if count >= self.keep_turns and used + cost > self.budget:
+                break
+            used += cost
+            cut = turn_start
+
+        return [outgoing_message(message) for message in head + messages[cut:]], cut
+
+def build_summary_request(previous_summary, messages):
+    """构造让模型压缩历史对话的请求消息"""
+    lines = []
+    if previous_summary:
+        lines.append(f"[已有摘要]\n{previous_summary}\n")
+    for message in messages:
+        lines.append(f"[{message.get('role')}]\n{message.get('content') or ''}\n")
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": "\n".join(lines)}
+    ]
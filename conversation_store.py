@@ -0,0 +1,292 @@
+"""对话存储：把对话和消息保存到本地 SQLite 数据库
+
+写入由后台线程批量执行，界面线程只把操作放入队列，不会因磁盘写入卡顿；
+读取使用独立的连接（WAL 模式下可与写入并发）直接读取已提交的数据，列表按页加载；
+只有载入的对话本身还有排队的写入时，load_messages 才等待这个对话的写入完成。
+SQLite 支持 FTS5 时建立全文索引（优先使用 trigram 分词以支持中文子串搜索），否则退回 LIKE 查询。
+"""
+import collections
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+# 默认的数据库文件
+CONVERSATION_DB = 'conversations.db'
+# 对话列表每页条数
+CONVERSATION_PAGE_SIZE = 50
+# 标题取第一条用户消息的前若干个字符
+CONVERSATION_TITLE_LENGTH = 40
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    config TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    extra TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_conversation ON messages(conversation_id, seq);
+CREATE INDEX IF NOT EXISTS conversations_updated ON conversations(updated_at);
+"""
+
+# 全文索引与 messages 表通过触发器保持同步
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id'{tokenizer}
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+# 写入队列中的结束标记
+_STOP = object()
+
+def new_conversation_id():
+    return uuid.uuid4().hex
+
+def make_title(messages):
+    """取第一条用户消息作为对话标题"""
+    for message in messages:
+        if message.get('role') == 'user' and message.get('content'):
+            title = ' '.join(message['content'].split())
+            return title[:CONVERSATION_TITLE_LENGTH]
+    return "新对话"
+
+# 需要保存的本地字段（不随请求原样发送）：_continuation 标记自动继续时追加的提示，
+# _tool_usage 是提问时检索到的相关工具用法（重新打开对话后发送的内容保持不变）
+STORED_LOCAL_FIELDS = ('_continuation', '_tool_usage')
+
+def _message_extra(message):
+    """role/content 以外的字段（如 tool_calls、tool_call_id）以 JSON 保存，本地字段（如 _id）只保存 STORED_LOCAL_FIELDS"""
+    extra = {
+        key: value for key, value in message.items()
+        if key not in ('role', 'content') and (not key.startswith('_') or key in STORED_LOCAL_FIELDS)
+    }
+    return json.dumps(extra, ensure_ascii=False) if extra else None
+
+def _message_row(message):
+    return message.get('role', ''), message.get('content') or '', _message_extra(message)
+
+class ConversationStore:
+    """SQLite 对话存储"""
+    def __init__(self, path=CONVERSATION_DB):
+        self.path = path
+        self.fts = None
+        self._queue = queue.Queue()
+        # 每个对话排队中（尚未提交）的写入数
+        self._pending = collections.Counter()
+        self._committed = threading.Condition()
+
+        # 建表在当前线程中完成，之后的读取使用这个连接
+        self._reader = self._connect()
+        self._reader.executescript(SCHEMA)
+        self.fts = self._create_fts(self._reader)
+        self._reader.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    @staticmethod
+    def _create_fts(connection):
+        """创建全文索引，返回使用的分词器（'trigram'/'unicode61'），不支持 FTS5 时返回 None"""
+        for tokenizer in ('trigram', 'unicode61'):
+            try:
+                connection.executescript(FTS_SCHEMA.format(tokenizer=f", tokenize='{tokenizer}'"))
+                return tokenizer
+            except sqlite3.OperationalError:
+                continue
+        return None
+
+    def _write_loop(self):
+        """后台写入线程：每次取出全部排队的操作，在同一个事务中执行"""
+        connection = self._connect()
+        while True:
+            entries = [self._queue.get()]
+            while True:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            try:
+                with connection:
+                    for conversation_id, operation in entries:
+                        if operation is _STOP:
+                            stop = True
+                        else:
+                            operation(connection)
+            except sqlite3.Error as e:
+                print(f"Error writing conversation store: {str(e)}")
+            finally:
+                with self._committed:
+                    for conversation_id, _ in entries:
+                        self._pending[conversation_id] -= 1
+                        if self._pending[conversation_id] <= 0:
+                            del self._pending[conversation_id]
+                    self._committed.notify_all()
+                for _ in entries:
+                    self._queue.task_done()
+            if stop:
+                connection.close()
+                return
+
+    def _submit(self, conversation_id, operation):
+        with self._committed:
+            self._pending[conversation_id] += 1
+        self._queue.put((conversation_id, operation))
+
+    def _wait_for(self, conversation_id):
+        """等待指定对话已排队的写入提交（通常没有排队的写入，立即返回）"""
+        with self._committed:
+            self._committed.wait_for(lambda: conversation_id not in self._pending)
+
+    def create_conversation(self, conversation_id, title, config=None):
+        """新建对话"""
+        now = time.time()
+        self._submit(conversation_id, lambda c: c.execute(
+            "INSERT OR IGNORE INTO conversations(id, title, config, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (conversation_id, title, config, now, now)
+        ))
+
+    def append_messages(self, conversation_id, messages):
+        """追加消息，消息的 _id 作为 seq 保存（对话内唯一且递增，之后按它更新或删除单条消息）"""
+        now = time.time()
+        rows = [(conversation_id, message['_id']) + _message_row(message) + (now,) for message in messages]
+
+        def write(connection):
+            connection.executemany(
+                "INSERT INTO messages(conversation_id, seq, role, content, extra, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            connection.execute("UPDATE conversations SET updated_at = ? WHERE id = ?", (now, conversation_id))
+        self._submit(conversation_id, write)
+
+    def update_message(self, conversation_id, message):
+        """重新保存一条编辑过的消息"""
+        now = time.time()
+        row = _message_row(message) + (conversation_id, message['_id'])
+
+        def write(connection):
+            connection.execute(
+                "UPDATE messages SET role = ?, content = ?, extra = ? WHERE conversation_id = ? AND seq = ?", row
+            )
+            connection.execute("UPDATE conversations SET updated_at = ? WHERE id = ?", (now, conversation_id))
+        self._submit(conversation_id, write)
+
+    def delete_messages(self, conversation_id, message_ids):
+        """删除对话中的若干条消息，其余消息的 seq 保持不变"""
+        now = time.time()
+        rows = [(conversation_id, message_id) for message_id in message_ids]
+
+        def write(connection):
+            connection.executemany("DELETE FROM messages WHERE conversation_id = ? AND seq = ?", rows)
+            connection.execute("UPDATE conversations SET updated_at = ? WHERE id = ?", (now, conversation_id))
+        self._submit(conversation_id, write)
+
+    def delete_conversation(self, conversation_id):
+        """删除对话及其消息"""
+        self._submit(conversation_id, lambda c: c.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,)))
+
+    def flush(self):
+        """等待已排队的写入完成"""
+        self._queue.join()
+
+    def close(self):
+        """写完剩余操作后关闭数据库"""
+        self._submit(None, _STOP)
+        self._writer.join(timeout=5)
+        self._reader.close()
+
+    def list_conversations(self, offset=0, limit=CONVERSATION_PAGE_SIZE):
+        """按最近更新时间分页列出对话（已提交的数据，不等待排队的写入）"""
+        rows = self._reader.execute(
+            "SELECT id, title, config, updated_at FROM conversations ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+            (limit, offset)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def search(self, text, offset=0, limit=CONVERSATION_PAGE_SIZE):
+        """按消息内容搜索对话，返回包含匹配片段（snippet）的对话列表（已提交的数据）"""
+        text = text.strip()
+        if not text:
+            return self.list_conversations(offset, limit)
+
+        # trigram 分词至少需要 3 个字符，更短的查询和不支持 FTS5 时使用 LIKE
+        if self.fts and (self.fts != 'trigram' or len(text) >= 3):
+            query = '"' + text.replace('"', '""') + '"'
+            rows = self._reader.execute(
+                """
+                SELECT c.id, c.title, c.config, c.updated_at, hits.snippet
+                FROM (
+                    SELECT rowid, snippet(messages_fts, 0, '[', ']', '…', 16) AS snippet
+                    FROM messages_fts WHERE messages_fts MATCH ?
+                    LIMIT -1  -- 阻止子查询被展开到 GROUP BY 中（snippet 只能在全文查询中使用）
+                ) AS hits
+                JOIN messages m ON m.id = hits.rowid
+                JOIN conversations c ON c.id = m.conversation_id
+                GROUP BY c.id
+                ORDER BY c.updated_at DESC
+                LIMIT ? OFFSET ?
+                """,
+                (query, limit, offset)
+            ).fetchall()
+        else:
+            pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            rows = self._reader.execute(
+                """
+                SELECT c.id, c.title, c.config, c.updated_at, substr(m.content, 1, 80) AS snippet
+                FROM messages m
+                JOIN conversations c ON c.id = m.conversation_id
+                WHERE m.content LIKE ? ESCAPE '\\'
+                GROUP BY c.id
+                ORDER BY c.updated_at DESC
+                LIMIT ? OFFSET ?
+                """,
+                (pattern, limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def load_messages(self, conversation_id):
+        """按顺序读取对话的全部消息，seq 恢复为消息的 _id
+
+        之后的消息接着最大的 seq 追加，因此先等这个对话自己排队的写入提交，其他对话的写入不影响
+        """
+        self._wait_for(conversation_id)
+        rows = self._reader.execute(
+            "SELECT seq, role, content, extra FROM messages WHERE conversation_id = ? ORDER BY seq",
+            (conversation_id,)
+        ).fetchall()
+        messages = []
+        for row in rows:
+            message = {"_id": row['seq'], "role": row['role'], "content": row['content']}
+            if row['extra']:
+                message.update(json.loads(row['extra']))
+            messages.append(message)
+        return messages
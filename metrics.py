@@ -0,0 +1,426 @@
+"""请求和工具调用的性能指标：定位响应慢的原因（建立连接、网关排队、模型速度、界面渲染还是工具）
+
+每次流式请求记录建立连接、首字节（TTFB）、首个内容令牌的耗时，令牌间隔的分位数，令牌数和流式持续时间；
+每次工具调用记录等待空闲解释器、启动（含加载函数定义）和执行的耗时。
+MetricsRecorder 把每条记录追加到轮转的 JSONL 日志，并汇总为 Prometheus 文本格式，
+写入文件（可交给 node_exporter 的 textfile 收集器）或由 serve 开启的 HTTP 端点提供。
+
+本模块不依赖 chat_engine，请求和异步客户端都可以使用。
+"""
+import http.server
+import json
+import logging
+import logging.handlers
+import math
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from config_store import atomic_write
+
+# JSONL 日志：单个文件的最大字节数和保留的旧文件数（metrics.jsonl.1 ...）
+METRICS_LOG = 'metrics.jsonl'
+METRICS_LOG_MAX_BYTES = 5 * 1024 * 1024
+METRICS_LOG_BACKUPS = 3
+
+# Prometheus 文本文件及最短的重写间隔（秒）
+PROMETHEUS_FILE = 'metrics.prom'
+PROMETHEUS_WRITE_INTERVAL = 1.0
+
+# 直方图的桶上限（秒）：请求各阶段的耗时和令牌间隔
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+GAP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+def percentile(values, p):
+    """最近秩百分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def _round(value):
+    return round(value, 4) if value is not None else None
+
+# 建立连接的耗时按线程记录：requests 在发送请求的线程中建立连接
+_connect_times = threading.local()
+
+def take_connect_time():
+    """返回并清除当前线程最近一次建立连接（TCP + TLS 握手）的秒数；复用长连接时为 None"""
+    seconds = getattr(_connect_times, 'seconds', None)
+    _connect_times.seconds = None
+    return seconds
+
+class _TimedConnection:
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        _connect_times.seconds = time.perf_counter() - started
+
+class _TimedHTTPConnection(_TimedConnection, HTTPConnection):
+    pass
+
+class _TimedHTTPSConnection(_TimedConnection, HTTPSConnection):
+    pass
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """记录建立连接耗时的 HTTPAdapter（经代理的连接不计时），由 take_connect_time 取出"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+class RequestMetrics:
+    """一次流式请求的计时，在发送请求的线程（或事件循环）中更新
+
+    所属线程可以随时读取 snapshot 显示进度；feed_text 等在所属线程中处理文本的耗时记入 render。
+    """
+    def __init__(self, config_name="", model=None, client=None, step=1):
+        self.config_name = config_name
+        self.model = model
+        self.client = client
+        self.step = step
+        self.time = time.time()
+        self.started = time.perf_counter()
+        self.connect = None
+        self.reused = None
+        self.status = None
+        self.ttfb = None
+        self.first_token = None
+        self.last_token = None
+        self.ended = None
+        self.tokens = 0
+        self.chars = 0
+        self.gaps = []
+        self.render = 0.0
+
+    def connected(self, seconds):
+        """建立连接的秒数；None 表示复用了空闲的长连接"""
+        self.reused = seconds is None
+        self.connect = seconds
+
+    def response(self, status):
+        """收到响应头"""
+        self.status = status
+        self.ttfb = time.perf_counter() - self.started
+
+    def token(self, text):
+        """收到一段内容（一个 SSE 事件中的 delta.content 计为一个令牌）"""
+        now = time.perf_counter()
+        if self.last_token is None:
+            self.first_token = now - self.started
+        else:
+            self.gaps.append(now - self.last_token)
+        self.last_token = now
+        self.tokens += 1
+        self.chars += len(text)
+
+    def finish(self):
+        """流式读取结束"""
+        self.ended = time.perf_counter()
+
+    def snapshot(self):
+        """生成过程中的进度：(已用秒数, 令牌数, 每秒令牌数)"""
+        now = self.ended or time.perf_counter()
+        streaming = now - (self.started + self.first_token) if self.first_token is not None else 0
+        rate = (self.tokens - 1) / streaming if self.tokens > 1 and streaming > 0 else None
+        return now - self.started, self.tokens, rate
+
+    def record(self, end_reason=None):
+        """生成日志记录；_gaps 为全部令牌间隔，只用于汇总直方图，不写入日志"""
+        ended = self.ended or time.perf_counter()
+        # 流式持续时间：首个令牌到结束
+        duration = ended - (self.started + self.first_token) if self.first_token is not None else None
+        return {
+            "type": "request",
+            "time": round(self.time, 3),
+            "config": self.config_name,
+            "model": self.model,
+            "client": self.client,
+            "step": self.step,
+            "status": self.status,
+            "end_reason": end_reason,
+            "reused": self.reused,
+            "connect_s": _round(self.connect),
+            "ttfb_s": _round(self.ttfb),
+            "first_token_s": _round(self.first_token),
+            "tokens": self.tokens,
+            "chars": self.chars,
+            "duration_s": _round(duration),
+            "total_s": _round(ended - self.started),
+            "tokens_per_s": round(len(self.gaps) / duration, 1) if self.gaps and duration else None,
+            "gap_p50_s": _round(percentile(self.gaps, 50)),
+            "gap_p90_s": _round(percentile(self.gaps, 90)),
+            "gap_p99_s": _round(percentile(self.gaps, 99)),
+            "gap_max_s": _round(max(self.gaps) if self.gaps else None),
+            "render_s": _round(self.render),
+            "_gaps": self.gaps,
+        }
+
+def tool_record(tool_name, config_name=""):
+    """一次工具调用的日志记录，mode 为 host（常驻解释器）/process（独立进程）/cache（缓存命中）/missing"""
+    return {
+        "type": "tool",
+        "time": round(time.time(), 3),
+        "config": config_name,
+        "tool": tool_name,
+        "mode": "host",
+        "ok": False,
+        "spawned": False,
+        "wait_s": None,
+        "spawn_s": None,
+        "run_s": None,
+        "total_s": None,
+    }
+
+def _ms(seconds):
+    return f"{seconds * 1000:.0f}ms" if seconds is not None else "-"
+
+def format_status(record):
+    """状态栏中显示的一行摘要"""
+    if record['type'] == 'tool':
+        if record['mode'] == 'cache':
+            return f"工具 {record['tool']}：缓存命中"
+        if record['mode'] == 'missing':
+            return f"工具 {record['tool']}：未找到"
+        spawn = "独立进程" if record['mode'] == 'process' else f"启动 {_ms(record['spawn_s'])}"
+        return (f"工具 {record['tool']}：等待 {_ms(record['wait_s'])} · {spawn} · "
+                f"执行 {_ms(record['run_s'])}{'' if record['ok'] else ' · 失败'}")
+    parts = [
+        "复用连接" if record['reused'] else f"连接 {_ms(record['connect_s'])}",
+        f"首字节 {_ms(record['ttfb_s'])}",
+        f"首令牌 {_ms(record['first_token_s'])}",
+        f"{record['tokens']} 令牌 / {record['duration_s'] or 0:.1f}s",
+    ]
+    if record['tokens_per_s'] is not None:
+        parts.append(f"{record['tokens_per_s']:.1f} 令牌/秒")
+    if record['gap_p50_s'] is not None:
+        parts.append(f"间隔 p50 {_ms(record['gap_p50_s'])} p99 {_ms(record['gap_p99_s'])}")
+    parts.append(f"渲染 {_ms(record['render_s'])}")
+    if record['end_reason']:
+        parts.append(record['end_reason'])
+    return " · ".join(parts)
+
+def format_progress(metrics):
+    """生成过程中状态栏显示的进度"""
+    elapsed, tokens, rate = metrics.snapshot()
+    if metrics.ttfb is None:
+        return f"等待响应 {elapsed:.1f}s"
+    parts = [
+        "复用连接" if metrics.reused else f"连接 {_ms(metrics.connect)}",
+        f"首字节 {_ms(metrics.ttfb)}",
+        f"首令牌 {_ms(metrics.first_token)}",
+        f"{tokens} 令牌",
+    ]
+    if rate is not None:
+        parts.append(f"{rate:.1f} 令牌/秒")
+    return "生成中 · " + " · ".join(parts)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}" if labels else ""
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{name}_bucket{_labels(labels + (('le', _number(float(bound))),))} {cumulative}"
+        yield f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {self.count}"
+        yield f"{name}_sum{_labels(labels)} {_number(self.sum)}"
+        yield f"{name}_count{_labels(labels)} {self.count}"
+
+# 汇总的指标：名称 -> (类型, 说明, 直方图的桶或 None)
+_METRICS = {
+    "aiclient_requests_total": ("counter", "流式请求数（result 为 ok 或结束原因）", None),
+    "aiclient_request_tokens_total": ("counter", "收到的内容令牌数", None),
+    "aiclient_request_connect_seconds": ("histogram", "建立连接的耗时（复用连接不计入）", LATENCY_BUCKETS),
+    "aiclient_request_ttfb_seconds": ("histogram", "发送请求到收到响应头的耗时", LATENCY_BUCKETS),
+    "aiclient_request_first_token_seconds": ("histogram", "发送请求到首个内容令牌的耗时", LATENCY_BUCKETS),
+    "aiclient_request_duration_seconds": ("histogram", "首个令牌到流式结束的耗时", LATENCY_BUCKETS),
+    "aiclient_request_token_gap_seconds": ("histogram", "相邻内容令牌的间隔", GAP_BUCKETS),
+    "aiclient_request_render_seconds": ("histogram", "所属线程处理和显示回复文本的耗时", LATENCY_BUCKETS),
+    "aiclient_tool_calls_total": ("counter", "工具调用数", None),
+    "aiclient_tool_wait_seconds": ("histogram", "等待空闲解释器的耗时", LATENCY_BUCKETS),
+    "aiclient_tool_spawn_seconds": ("histogram", "启动解释器和加载函数定义的耗时", LATENCY_BUCKETS),
+    "aiclient_tool_run_seconds": ("histogram", "执行工具的耗时", LATENCY_BUCKETS),
+}
+
+class MetricsRecorder:
+    """汇总指标记录：追加到轮转的 JSONL 日志，维护 Prometheus 格式的计数器和直方图
+
+    可被多个引擎和线程共享；log_path / prometheus_path 为 None 时不写对应的文件。
+    """
+    def __init__(self, log_path=METRICS_LOG, prometheus_path=PROMETHEUS_FILE,
+                 max_bytes=METRICS_LOG_MAX_BYTES, backups=METRICS_LOG_BACKUPS):
+        self.prometheus_path = prometheus_path
+        self._lock = threading.Lock()
+        # (指标名, 标签) -> 计数或 _Histogram
+        self._series = {}
+        self._written = 0
+        self._dirty = False
+        self._flush_timer = None
+        self._server = None
+
+        # 用独立的 logger 写日志：RotatingFileHandler 负责按大小轮转和多线程写入
+        self._handler = None
+        self._logger = logging.getLogger(f"{__name__}.{id(self)}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if log_path:
+            self._handler = logging.handlers.RotatingFileHandler(
+                log_path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True
+            )
+            self._handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(self._handler)
+
+    def record(self, record):
+        """记录一条请求或工具调用的指标（任意线程）"""
+        gaps = record.get('_gaps') or ()
+        entry = {key: value for key, value in record.items() if not key.startswith('_')}
+        if self._handler is not None:
+            self._logger.info(json.dumps(entry, ensure_ascii=False))
+        with self._lock:
+            if entry['type'] == 'request':
+                self._observe_request(entry, gaps)
+            else:
+                self._observe_tool(entry)
+            self._dirty = True
+            wait = self._written + PROMETHEUS_WRITE_INTERVAL - time.monotonic()
+            if wait > 0 and self._flush_timer is None and self.prometheus_path:
+                # 间隔内的记录稍后一起写出
+                self._flush_timer = threading.Timer(wait, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        if wait <= 0:
+            self.flush()
+
+    def _count(self, name, labels, amount=1):
+        key = (name, labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def _observe(self, name, labels, value):
+        if value is None:
+            return
+        key = (name, labels)
+        histogram = self._series.get(key)
+        if histogram is None:
+            histogram = self._series[key] = _Histogram(_METRICS[name][2])
+        histogram.observe(value)
+
+    def _observe_request(self, entry, gaps):
+        labels = (("config", entry['config']),)
+        self._count("aiclient_requests_total", labels + (("result", entry['end_reason'] or "ok"),))
+        self._count("aiclient_request_tokens_total", labels, entry['tokens'])
+        self._observe("aiclient_request_connect_seconds", labels, entry['connect_s'])
+        self._observe("aiclient_request_ttfb_seconds", labels, entry['ttfb_s'])
+        self._observe("aiclient_request_first_token_seconds", labels, entry['first_token_s'])
+        self._observe("aiclient_request_duration_seconds", labels, entry['duration_s'])
+        self._observe("aiclient_request_render_seconds", labels, entry['render_s'])
+        for gap in gaps:
+            self._observe("aiclient_request_token_gap_seconds", labels, gap)
+
+    def _observe_tool(self, entry):
+        labels = (("tool", entry['tool']),)
+        self._count("aiclient_tool_calls_total", labels + (("mode", entry['mode']), ("ok", str(entry['ok']).lower())))
+        self._observe("aiclient_tool_wait_seconds", labels, entry['wait_s'])
+        self._observe("aiclient_tool_spawn_seconds", labels, entry['spawn_s'])
+        self._observe("aiclient_tool_run_seconds", labels, entry['run_s'])
+
+    def render(self):
+        """返回 Prometheus 文本格式的全部指标"""
+        with self._lock:
+            lines = []
+            for name, (kind, help_text, _) in _METRICS.items():
+                series = sorted((labels, value) for (metric, labels), value in self._series.items() if metric == name)
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in series:
+                    if kind == "histogram":
+                        lines.extend(value.lines(name, labels))
+                    else:
+                        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+            return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """有新记录时重写 Prometheus 文本文件"""
+        with self._lock:
+            self._flush_timer = None
+            if not self._dirty or not self.prometheus_path:
+                return
+            self._dirty = False
+            self._written = time.monotonic()
+        try:
+            atomic_write(self.prometheus_path, self.render().encode('utf-8'))
+        except OSError as e:
+            print(f"Error writing metrics: {str(e)}")
+
+    def serve(self, port, host="127.0.0.1"):
+        """在后台线程中开启 HTTP 端点（任意路径返回 Prometheus 文本），返回实际监听的端口"""
+        recorder = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = recorder.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        return self._server.server_address[1]
+
+    def close(self):
+        """写出最后的汇总，关闭日志文件和 HTTP 端点"""
+        timer = self._flush_timer
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+        if self._handler is not None:
+            self._logger.removeHandler(self._handler)
+            self._handler.close()
+            self._handler = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,96 @@
+"""ConfigStore 的测试：缓存、字段合并和并发写入
+
+运行：python -m pytest -q tests
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config_store import ConfigStore, DEFAULT_CONFIG
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_first_run_writes_default(tmp_path):
+    path = str(tmp_path / 'configs.json')
+    store = ConfigStore(path)
+    assert store.names() == ['default']
+    assert store.get('default') == DEFAULT_CONFIG
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == {'default': DEFAULT_CONFIG}
+
+def test_get_returns_copy(tmp_path):
+    store = ConfigStore(str(tmp_path / 'configs.json'))
+    store.put('a', {'model': 'm', 'extra': {'x': 1}})
+    config = store.get('a')
+    config['extra']['x'] = 2
+    assert store.get('a')['extra'] == {'x': 1}
+
+def test_merge_keeps_other_fields(tmp_path):
+    path = str(tmp_path / 'configs.json')
+    store = ConfigStore(path)
+    store.put('a', {'model': 'm', 'temperature': 0.5})
+    # 另一个程序实例修改的字段不会被覆盖
+    ConfigStore(path).merge('a', {'api_key': 'k'})
+    assert store.merge('a', {'temperature': 0.1}) == {'model': 'm', 'temperature': 0.1, 'api_key': 'k'}
+
+def test_reload_after_external_change(tmp_path):
+    path = str(tmp_path / 'configs.json')
+    store = ConfigStore(path)
+    store.names()
+    ConfigStore(path).put('b', {'model': 'other'})
+    assert store.names() == ['default', 'b']
+    store.delete('b')
+    assert ConfigStore(path).names() == ['default']
+
+def test_corrupt_file_keeps_last_configs(tmp_path):
+    path = str(tmp_path / 'configs.json')
+    store = ConfigStore(path)
+    store.put('a', {'model': 'm'})
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"a": ')
+    assert store.get('a') == {'model': 'm'}
+
+def test_concurrent_merge_threads(tmp_path):
+    path = str(tmp_path / 'configs.json')
+    ConfigStore(path).put('shared', {})
+    errors = []
+
+    def worker(n):
+        # 每个线程使用独立的实例，相当于两个程序实例同时修改
+        store = ConfigStore(path)
+        try:
+            for i in range(20):
+                store.merge('shared', {f'field_{n}_{i}': i})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    config = ConfigStore(path).get('shared')
+    assert len(config) == 40
+
+def test_concurrent_merge_processes(tmp_path):
+    path = str(tmp_path / 'configs.json')
+    ConfigStore(path).put('shared', {})
+    code = (
+        "import sys\n"
+        f"sys.path.insert(0, {ROOT!r})\n"
+        "from config_store import ConfigStore\n"
+        "store = ConfigStore(sys.argv[1])\n"
+        "for i in range(20):\n"
+        "    store.merge('shared', {f'{sys.argv[2]}_{i}': i})\n"
+    )
+    processes = [subprocess.Popen([sys.executable, '-c', code, path, name]) for name in ('first', 'second')]
+    assert [process.wait(timeout=60) for process in processes] == [0, 0]
+    config = ConfigStore(path).get('shared')
+    assert sorted(config) == sorted([f'{name}_{i}' for name in ('first', 'second') for i in range(20)])
+    # 不留下临时文件
+    assert sorted(os.listdir(tmp_path)) == ['configs.json', 'configs.json.lock']
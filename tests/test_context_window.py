@@ -0,0 +1,103 @@
+"""ContextWindow 和 split_turns 的测试：按轮次裁剪历史
+
+运行：python -m pytest -q tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_window import (
+    ContextWindow, estimate_message_tokens, estimate_text_tokens, outgoing_message, split_turns
+)
+
+def message(role, content, **fields):
+    return dict({"role": role, "content": content}, **fields)
+
+def history(turns, size=400):
+    """系统提示词加 turns 轮问答，每条消息约 size/4 个 token"""
+    messages = [message("system", "系统提示词")]
+    for i in range(turns):
+        messages.append(message("user", f"问题{i} " + "q" * size, _id=2 * i + 1))
+        messages.append(message("assistant", f"回答{i} " + "a" * size, _id=2 * i + 2))
+    return messages
+
+def test_estimate_text_tokens():
+    assert estimate_text_tokens("") == 0
+    assert estimate_text_tokens("abcd" * 10) == 10
+    # 中日韩字符按每个字符一个 token 估算
+    assert estimate_text_tokens("中文测试") == 4
+
+def test_message_estimate_follows_content():
+    item = message("user", "abcd")
+    first = estimate_message_tokens(item)
+    item['content'] = "abcd" * 100
+    assert estimate_message_tokens(item) > first
+    # 估算结果保存在本地字段中，不随请求发送
+    assert '_tokens' in item
+    assert '_tokens' not in outgoing_message(item)
+
+def test_split_turns():
+    messages = history(3)[1:]
+    assert split_turns(messages, 1) == [(1, 3), (3, 5), (5, 7)]
+
+def test_continuation_stays_in_turn():
+    messages = [
+        message("user", "真正的问题"),
+        message("assistant", "<tool>Get-Info</tool>"),
+        message("user", "继续", _continuation=True),
+        message("assistant", "结论"),
+        message("user", "下一个问题"),
+    ]
+    assert split_turns(messages, 0) == [(0, 4), (4, 5)]
+
+def test_keeps_everything_within_budget():
+    messages = history(4)
+    payload, cut = ContextWindow(budget=100000, keep_turns=1).build(messages)
+    assert cut == 1
+    assert [m['content'] for m in payload] == [m['content'] for m in messages]
+    assert all('_id' not in m for m in payload)
+
+def test_keeps_latest_turns():
+    messages = history(10)
+    payload, cut = ContextWindow(budget=1, keep_turns=3).build(messages)
+    # 预算不足时只保留系统提示词和最近 3 轮
+    assert cut == len(messages) - 6
+    assert payload[0]['role'] == "system"
+    assert [m['content'][:3] for m in payload[1:]] == ["问题7", "回答7", "问题8", "回答8", "问题9", "回答9"]
+
+def test_budget_keeps_more_turns():
+    messages = history(10)
+    per_turn = sum(estimate_message_tokens(m) for m in messages[1:3])
+    budget = estimate_message_tokens(messages[0]) + 5 * per_turn
+    payload, cut = ContextWindow(budget=budget, keep_turns=1).build(messages)
+    assert cut == len(messages) - 10
+    assert len(payload) == 11
+
+def test_keep_turns_include_continuation():
+    messages = [
+        message("system", "系统提示词"),
+        message("user", "旧问题 " + "x" * 4000),
+        message("assistant", "旧回答"),
+        message("user", "新问题"),
+        message("assistant", "<tool>Get-Info</tool>"),
+        message("user", "继续", _continuation=True),
+        message("assistant", "结论"),
+    ]
+    payload, cut = ContextWindow(budget=1, keep_turns=1).build(messages)
+    # 保留的一轮从真正的问题开始，而不是只剩自动继续的提示
+    assert cut == 3
+    assert payload[1]['content'] == "新问题"
+
+def test_summary_replaces_older_messages():
+    messages = history(4)
+    summary = {"upto": 5, "text": "前两轮的摘要"}
+    payload, cut = ContextWindow(budget=100000, keep_turns=1).build(messages, summary)
+    assert cut == 5
+    assert payload[1]['content'].endswith("前两轮的摘要")
+    assert [m['content'][:3] for m in payload[2:]] == ["问题2", "回答2", "问题3", "回答3"]
+
+def test_tool_usage_is_sent_with_its_message():
+    item = message("user", "问题", _tool_usage="\n\n[可能用到的工具及用法]\n- 工具\n")
+    assert outgoing_message(item) == {"role": "user", "content": "问题\n\n[可能用到的工具及用法]\n- 工具\n"}
+    assert item['content'] == "问题"
@@ -0,0 +1,96 @@
+"""ConversationStore 的测试：使用临时目录中的 SQLite 文件
+
+运行：python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_store import ConversationStore, make_title, new_conversation_id
+
+@pytest.fixture
+def store(tmp_path):
+    store = ConversationStore(str(tmp_path / 'conversations.db'))
+    yield store
+    store.close()
+
+def message(message_id, role, content, **fields):
+    return dict({"_id": message_id, "role": role, "content": content}, **fields)
+
+def create(store, messages):
+    conversation_id = new_conversation_id()
+    store.create_conversation(conversation_id, make_title(messages), "默认配置")
+    store.append_messages(conversation_id, messages)
+    return conversation_id
+
+def test_append_and_load(store):
+    messages = [
+        message(1, "user", "你好"),
+        message(2, "assistant", "", tool_calls=[{"id": "call_0", "type": "function"}]),
+        message(3, "tool", "结果", tool_call_id="call_0"),
+        message(4, "user", "继续", _continuation=True, _tokens=((2, 0), 6)),
+    ]
+    conversation_id = create(store, messages)
+    loaded = store.load_messages(conversation_id)
+    # 只保存 STORED_LOCAL_FIELDS 中的本地字段
+    assert loaded == [dict(m) for m in messages[:3]] + [message(4, "user", "继续", _continuation=True)]
+
+def test_update_and_delete_by_seq(store):
+    conversation_id = create(store, [message(seq, "user", f"消息{seq}") for seq in (1, 2, 3, 5)])
+    store.update_message(conversation_id, message(3, "assistant", "修改后"))
+    store.delete_messages(conversation_id, [2, 5])
+    loaded = store.load_messages(conversation_id)
+    assert [(m['_id'], m['role'], m['content']) for m in loaded] == [
+        (1, "user", "消息1"),
+        (3, "assistant", "修改后"),
+    ]
+
+def test_list_and_delete_conversation(store):
+    first = create(store, [message(1, "user", "第一个对话")])
+    second = create(store, [message(1, "user", "第二个对话")])
+    store.flush()
+    conversations = store.list_conversations()
+    assert {item['id'] for item in conversations} == {first, second}
+    assert {item['title'] for item in conversations} == {"第一个对话", "第二个对话"}
+
+    store.delete_conversation(first)
+    store.flush()
+    assert [item['id'] for item in store.list_conversations()] == [second]
+    assert store.load_messages(first) == []
+
+@pytest.mark.parametrize("query", ["磁盘", "磁盘空间", "disk"])
+def test_search_cjk(store, query):
+    # trigram 分词时两个字符的查询走 LIKE，更长的查询使用全文索引
+    matched = create(store, [message(1, "user", "查询 C 盘的磁盘空间 disk usage")])
+    create(store, [message(1, "user", "查看内存使用情况")])
+    store.flush()
+    results = store.search(query)
+    assert [item['id'] for item in results] == [matched]
+    assert results[0]['snippet']
+
+def test_search_updated_content(store):
+    conversation_id = create(store, [message(1, "assistant", "[工具执行中] Get-Info ...")])
+    store.update_message(conversation_id, message(1, "assistant", "网络连接正常"))
+    store.flush()
+    assert [item['id'] for item in store.search("网络连接")] == [conversation_id]
+    assert store.search("工具执行中") == []
+
+def test_load_waits_for_own_writes(store):
+    # 不调用 flush：load_messages 等待这个对话排队的写入提交
+    conversation_id = create(store, [message(seq, "user", str(seq)) for seq in range(1, 51)])
+    assert len(store.load_messages(conversation_id)) == 50
+
+def test_reopen(tmp_path):
+    path = str(tmp_path / 'conversations.db')
+    store = ConversationStore(path)
+    conversation_id = create(store, [message(1, "user", "保存后重新打开")])
+    store.close()
+
+    store = ConversationStore(path)
+    try:
+        assert store.load_messages(conversation_id) == [message(1, "user", "保存后重新打开")]
+    finally:
+        store.close()
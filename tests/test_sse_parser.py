@@ -0,0 +1,84 @@
+"""SSEParser 和 ToolCallScanner 的测试：事件和标记被拆分到多个块中时的增量解析
+
+运行：python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_engine import SSEParser, ToolCallScanner
+
+STREAM = (
+    b": ping\r\n\r\n"
+    b"data: {\"a\": 1}\r\n\r\n"
+    b"event: custom\r\nid: 7\r\ndata: line1\r\ndata: line2\r\n\r\n"
+    b"data:no-space\n\n"
+    b"data: [DONE]\r\r"
+)
+
+EXPECTED = [
+    ("message", b"{\"a\": 1}"),
+    ("custom", b"line1\nline2"),
+    ("message", b"no-space"),
+    ("message", b"[DONE]"),
+]
+
+def feed_all(chunks):
+    parser = SSEParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return parser, events
+
+def test_whole_stream():
+    parser, events = feed_all([STREAM])
+    assert events == EXPECTED
+    assert parser.last_event_id == "7"
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 16])
+def test_split_chunks(size):
+    # 每种块大小都会把 CRLF、字段名和 data 值拆到不同的块中
+    chunks = [STREAM[i:i + size] for i in range(0, len(STREAM), size)]
+    assert feed_all(chunks)[1] == EXPECTED
+
+def test_crlf_split_between_chunks():
+    assert feed_all([b"data: a\r", b"\ndata: b\r", b"\n\r", b"\n"])[1] == [("message", b"a\nb")]
+
+def test_pending_cr_survives_empty_chunk():
+    assert feed_all([b"data: a\r", b"", b"\ndata: b\r\n\r\n"])[1] == [("message", b"a\nb")]
+
+def test_incomplete_event_is_kept():
+    parser = SSEParser()
+    assert parser.feed(b"data: partial") == []
+    assert parser.feed(b"\n") == []
+    assert parser.feed(b"\n") == [("message", b"partial")]
+
+def scan(chunks):
+    scanner = ToolCallScanner()
+    return [[call for _, call in scanner.feed(chunk)] for chunk in chunks]
+
+def test_scanner_tags_split_across_chunks():
+    chunks = ["前文 <to", "ol>Get-Info -name ", "'a'</t", "ool> 后文"]
+    assert scan(chunks) == [[], [], [], ["Get-Info -name 'a'"]]
+
+def test_scanner_end_positions():
+    scanner = ToolCallScanner()
+    assert scanner.feed("x <tool>A</to") == []
+    # 结束位置相对于本块文本，用于在 </tool> 之后切开显示的内容
+    text = "ol> mid <tool>B</tool> end"
+    calls = scanner.feed(text)
+    assert calls == [(3, "A"), (22, "B")]
+    assert [text[:end] for end, _ in calls] == ["ol>", "ol> mid <tool>B</tool>"]
+
+def test_scanner_single_characters():
+    text = "a<tool>X 1</tool>b<tool>Y</tool><tool"
+    assert sum(scan(list(text)), []) == ["X 1", "Y"]
+
+def test_scanner_nested_open_tag_uses_last():
+    assert scan(["<tool>A <tool>B</tool>"]) == [["B"]]
+
+def test_scanner_ignores_text_without_tags():
+    assert scan(["普通文本 <b>粗体</b> 和 < 符号"]) == [[]]
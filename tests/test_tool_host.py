@@ -0,0 +1,121 @@
+"""ToolHost 的测试：使用 Python 替身解释器（INTERPRETERS['python']），不需要 PowerShell
+
+运行：python -m pytest -q tests
+"""
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tool_host import ToolHost, ToolHostError, ToolHostTimeout, ToolHostUnavailable, INTERPRETERS
+
+@pytest.fixture
+def host():
+    host = ToolHost(INTERPRETERS['python'], timeout=10)
+    host.set_definitions([])
+    yield host
+    host.close()
+
+def test_round_trip(host):
+    result = host.call("print('ok')")
+    assert result.returncode == 0
+    assert result.stdout == "ok\n"
+
+    result = host.call("raise ValueError('失败')")
+    assert result.returncode == 1
+    assert result.stderr == "失败"
+
+def test_timings(host):
+    timings = {}
+    host.call("pass", timings)
+    assert timings['spawned'] is True
+    assert set(timings) == {'spawned', 'wait_s', 'spawn_s', 'run_s'}
+
+    timings = {}
+    host.call("pass", timings)
+    assert timings['spawned'] is False
+
+def test_crash_and_restart(host):
+    host.set_definitions(["def hello():\n    print('hello')"])
+    host.call("hello()")
+    with pytest.raises(ToolHostError) as excinfo:
+        host.call("import os; os._exit(3)")
+    # 脚本已发送后退出不能按“未发送”处理，否则调用方会重复执行
+    assert not isinstance(excinfo.value, ToolHostUnavailable)
+    # 重启后重新加载函数定义
+    for _ in range(3):
+        assert host.call("hello()").stdout == "hello\n"
+
+def test_timeout():
+    host = ToolHost(INTERPRETERS['python'], size=1, timeout=0.5)
+    host.set_definitions([])
+    try:
+        with pytest.raises(ToolHostTimeout):
+            host.call("import time; time.sleep(5)")
+        assert host.call("print('after')").stdout == "after\n"
+    finally:
+        host.close()
+
+def test_reload_definitions(host):
+    host.set_definitions(["def value():\n    print(1)"])
+    assert host.call("value()").stdout == "1\n"
+    host.set_definitions(["def value():\n    print(2)"])
+    # 池中的每个进程都在下一次调用前重新加载
+    assert [host.call("value()").stdout for _ in range(4)] == ["2\n"] * 4
+
+def test_non_ascii_output(host):
+    assert host.call("print('中文输出')").stdout == "中文输出\n"
+
+def test_stray_console_output(host):
+    # 绕过重定向直接写到控制台的内容（含非 UTF-8 字节和看起来像响应的行）被跳过
+    code = (
+        "import sys\n"
+        "sys.__stdout__.buffer.write(b'\\xff\\xfe raw\\n')\n"
+        "sys.__stdout__.write('中文 0 x y\\n')\n"
+        "sys.__stdout__.flush()\n"
+        "print('ok')"
+    )
+    result = host.call(code)
+    assert result.returncode == 0
+    assert result.stdout == "ok\n"
+    assert host.call("print('next')").stdout == "next\n"
+
+def test_concurrent_calls(host):
+    results = {}
+    errors = []
+
+    def worker(n):
+        try:
+            results[n] = host.call(f"import os, time; time.sleep(0.05); print({n}, os.getpid())").stdout.split()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert sorted(int(values[0]) for values in results.values()) == list(range(8))
+    # 两个常驻进程同时处理
+    assert len({values[1] for values in results.values()}) == 2
+
+def test_unavailable_interpreter():
+    host = ToolHost([os.path.join(os.path.dirname(__file__), 'missing-interpreter')])
+    with pytest.raises(ToolHostUnavailable):
+        host.call("pass")
+    host.close()
+
+def test_error_output(host):
+    # 没有中断执行的错误输出（对应 PowerShell 的 Write-Error）随结果一起返回
+    result = host.call("import sys\nsys.stderr.write('磁盘不存在')\nprint('partial')")
+    assert result.returncode == 0
+    assert result.stdout == "partial\n"
+    assert result.stderr == "磁盘不存在"
+
+    result = host.call("import sys\nsys.stderr.write('warn; ')\nraise RuntimeError('stop')")
+    assert result.returncode == 1
+    assert result.stderr == "warn; stop"
@@ -0,0 +1,70 @@
+"""tool_registry 的测试：param() 块解析、函数调用描述和工具配置加载
+
+运行：python -m pytest -q tests
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tool_registry import ToolRegistry, build_schema, format_arguments, parse_parameters
+
+POWER_CONTROL = """function Invoke-PowerControl {
+    param(
+        [Parameter(Mandatory=$true)]
+        [ValidateSet('shutdown', 'restart', 'cancel')]
+        [string]$action,
+        [int]$delay = 60
+    )
+}"""
+
+def properties(code, name='F'):
+    return build_schema(name, {}, parse_parameters(code))['function']['parameters']['properties']
+
+def test_parse_parameters():
+    parameters = parse_parameters(POWER_CONTROL)
+    assert [(p['name'], p['type'], p['required'], p['default']) for p in parameters] == [
+        ('action', 'string', True, None),
+        ('delay', 'integer', False, '60'),
+    ]
+
+def test_validate_set_quoted():
+    schema = build_schema('Invoke-PowerControl', {}, parse_parameters(POWER_CONTROL))['function']
+    assert schema['parameters']['properties']['action'] == {
+        'type': 'string', 'enum': ['shutdown', 'restart', 'cancel']
+    }
+    assert schema['parameters']['required'] == ['action']
+    assert 'enum' not in schema['parameters']['properties']['delay']
+
+def test_validate_set_numeric():
+    assert properties("function F { param([ValidateSet(1, 2, 4)][int]$level) }")['level'] == {
+        'type': 'integer', 'enum': [1, 2, 4]
+    }
+
+def test_validate_set_named_arguments():
+    code = """function F { param([ValidateSet("a,b", 'c', IgnoreCase = $false)][string]$mode) }"""
+    assert properties(code)['mode'] == {'type': 'string', 'enum': ['a,b', 'c']}
+
+def test_validate_set_array():
+    assert properties("function F { param([ValidateSet('x', 'y')][string[]]$items) }")['items'] == {
+        'type': 'array', 'items': {'type': 'string', 'enum': ['x', 'y']}
+    }
+
+def test_format_arguments():
+    parameters = parse_parameters(
+        "function F { param([string]$name, [int]$count, [switch]$all, [string[]]$tags) }"
+    )
+    arguments = {'name': "it's", 'count': 3, 'all': True, 'tags': ['a', 'b'], 'unknown': 1}
+    assert format_arguments(parameters, arguments) == "-name 'it''s' -count 3 -all -tags 'a', 'b'"
+
+def test_registry_coerces_cache_ttl(tmp_path):
+    path = tmp_path / 'tools_config.json'
+    tools = [
+        {'name': 'a', 'code': 'function Get-A { }', 'cache_ttl': '600'},
+        {'name': 'b', 'code': 'function Get-B { }', 'cache_ttl': 'soon'},
+        {'name': 'c', 'code': 'function Get-C { }', 'cache_ttl': -5},
+    ]
+    path.write_text(json.dumps(tools), encoding='utf-8')
+    registry = ToolRegistry(str(path))
+    assert [registry.get(name)['cache_ttl'] for name in ('Get-A', 'get-b', 'GET-C')] == [600, 0, 0]
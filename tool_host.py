@@ -0,0 +1,374 @@
+"""常驻的工具解释器进程池
+
+工具函数只在解释器启动时加载一次，之后的调用都通过管道发送，省去每次调用
+冷启动解释器、重新设置编码和重新定义函数的开销。
+
+管道协议（每条消息一行，脚本和输出均为 UTF-8 再做 base64 编码）：
+    请求：<id> <脚本>
+    响应：<id> <状态码> <标准输出> <错误信息>
+错误信息包括脚本抛出的异常和脚本写出的错误（Write-Error、非终止错误、Python 的 stderr），
+与独立进程执行时的标准错误一样返回给调用方。
+解释器命令可替换：Windows 上使用 PowerShell，其他平台可用 Python 替身进程运行同样的协议。
+
+脚本一律通过管道或 -EncodedCommand 参数在内存中传递，只有超出命令行长度时才写入
+唯一命名的临时文件，因此并发调用之间不会互相覆盖，也不会在工作目录中留下文件。
+"""
+import base64
+import itertools
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# 常驻解释器进程数
+TOOL_HOST_POOL_SIZE = 2
+# 单次工具调用的超时时间（秒），超时后结束并重启该解释器
+TOOL_CALL_TIMEOUT = 300
+# Windows 命令行长度上限为 32767 个字符，-EncodedCommand 参数超过该值时改用临时文件
+ENCODED_COMMAND_LIMIT = 30000
+# 工具结果缓存的最大条目数
+TOOL_CACHE_MAX_ENTRIES = 128
+
+# PowerShell 端的请求循环：函数定义和调用都在脚本作用域中点执行，定义的函数在后续调用中保持可用
+POWERSHELL_HOST_SCRIPT = r"""
+[Console]::OutputEncoding = [System.Text.Encoding]::UTF8
+$OutputEncoding = [System.Text.Encoding]::UTF8
+while ($true) {
+    $__line = [Console]::In.ReadLine()
+    if ($__line -eq $null) { break }
+    $__parts = $__line.Split(' ', 2)
+    $__code = [System.Text.Encoding]::UTF8.GetString([Convert]::FromBase64String($__parts[1]))
+    $__status = 0
+    $__out = ''
+    $__err = ''
+    try {
+        # 合并全部输出流，错误记录（Write-Error、非终止错误）单独作为错误信息返回
+        $__records = @(. ([ScriptBlock]::Create($__code)) *>&1)
+        $__out = $__records | Where-Object { $_ -isnot [System.Management.Automation.ErrorRecord] } | Out-String
+        $__err = ($__records | Where-Object { $_ -is [System.Management.Automation.ErrorRecord] } | ForEach-Object { $_.ToString() }) -join "`n"
+    } catch {
+        $__status = 1
+        $__err = $_.Exception.Message
+    }
+    $__o = [Convert]::ToBase64String([System.Text.Encoding]::UTF8.GetBytes([string]$__out))
+    $__e = [Convert]::ToBase64String([System.Text.Encoding]::UTF8.GetBytes([string]$__err))
+    [Console]::Out.WriteLine("$($__parts[0]) $__status $__o $__e")
+    [Console]::Out.Flush()
+}
+"""
+
+# Python 替身的请求循环：用于在没有 PowerShell 的环境中运行同样的协议
+PYTHON_HOST_SCRIPT = r"""
+import base64, contextlib, io, sys
+scope = {}
+def encode(text):
+    return base64.b64encode(text.encode('utf-8')).decode('ascii')
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    request_id, _, payload = line.rstrip('\n').partition(' ')
+    code = base64.b64decode(payload).decode('utf-8')
+    status, out, err = 0, io.StringIO(), io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            exec(code, scope)
+    except Exception as e:
+        status = 1
+        err.write(str(e))
+    sys.stdout.write(f"{request_id} {status} {encode(out.getvalue())} {encode(err.getvalue())}\n")
+    sys.stdout.flush()
+"""
+
+def encode_powershell_command(script):
+    """把脚本编码为 PowerShell -EncodedCommand 参数（UTF-16LE 后 base64）"""
+    return base64.b64encode(script.encode('utf-16-le')).decode('ascii')
+
+# 可用的解释器命令
+INTERPRETERS = {
+    'powershell': ['powershell', '-NoProfile', '-NonInteractive', '-ExecutionPolicy', 'Bypass',
+                   '-EncodedCommand', encode_powershell_command(POWERSHELL_HOST_SCRIPT)],
+    'pwsh': ['pwsh', '-NoProfile', '-NonInteractive',
+             '-EncodedCommand', encode_powershell_command(POWERSHELL_HOST_SCRIPT)],
+    'python': [sys.executable, '-u', '-c', PYTHON_HOST_SCRIPT],
+}
+
+def run_powershell_script(script, executable='powershell', timeout=None):
+    """在独立的 PowerShell 进程中执行一段脚本，返回 subprocess.CompletedProcess
+    
+    脚本通过 -EncodedCommand 在内存中传递；过长时才写入唯一命名的临时文件，执行后立即删除。
+    """
+    options = ['-NoProfile', '-NonInteractive', '-ExecutionPolicy', 'Bypass']
+    encoded = encode_powershell_command(script)
+    if len(encoded) <= ENCODED_COMMAND_LIMIT:
+        return subprocess.run(
+            [executable] + options + ['-EncodedCommand', encoded],
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            timeout=timeout
+        )
+    
+    fd, script_path = tempfile.mkstemp(prefix='aiclient_', suffix='.ps1')
+    try:
+        # 带 BOM 的 UTF-8，Windows PowerShell 才能正确识别中文
+        with os.fdopen(fd, 'w', encoding='utf-8-sig') as f:
+            f.write(script)
+        return subprocess.run(
+            [executable] + options + ['-File', script_path],
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            timeout=timeout
+        )
+    finally:
+        try:
+            os.remove(script_path)
+        except OSError:
+            pass
+
+class ToolHostError(Exception):
+    """解释器无法启动或在调用过程中退出"""
+
+class ToolHostUnavailable(ToolHostError):
+    """解释器无法启动或加载函数定义，本次调用的脚本尚未发送（可以改用其他方式执行）"""
+
+class ToolHostTimeout(ToolHostError):
+    """工具调用超时"""
+
+def _encode(text):
+    return base64.b64encode(text.encode('utf-8')).decode('ascii')
+
+def _decode(text):
+    return base64.b64decode(text).decode('utf-8', 'replace')
+
+class _HostProcess:
+    """单个常驻解释器进程"""
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+        self.lines = None
+        # 已加载的函数定义版本
+        self.version = None
+        self._ids = itertools.count(1)
+    
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+    
+    def start(self):
+        """启动解释器进程和读取线程"""
+        self.stop()
+        try:
+            self.process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                # 协议行只含 ASCII；工具直接写到控制台的其他内容可能是任意编码，按替换字符读取后跳过
+                encoding='utf-8',
+                errors='replace',
+                bufsize=1
+            )
+        except OSError as e:
+            self.process = None
+            raise ToolHostUnavailable(f"无法启动工具解释器：{str(e)}")
+        self.version = None
+        # 后台线程逐行读取响应，主调用方可以带超时等待
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read_lines, args=(self.process, self.lines), daemon=True).start()
+    
+    @staticmethod
+    def _read_lines(process, lines):
+        try:
+            for line in process.stdout:
+                lines.put(line)
+        except (OSError, ValueError):
+            pass
+        finally:
+            # 读取线程结束时总是通知等待的调用方，避免一直等到超时
+            lines.put(None)
+    
+    def stop(self):
+        """结束解释器进程"""
+        if self.process is not None:
+            try:
+                self.process.kill()
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        self.process = None
+        self.version = None
+    
+    def run(self, code, timeout):
+        """在解释器中执行一段脚本，返回 (状态码, 标准输出, 错误信息)
+        
+        脚本未能发送时抛出 ToolHostUnavailable；发送之后的失败（超时、进程退出）抛出其他 ToolHostError
+        """
+        request_id = str(next(self._ids))
+        try:
+            self.process.stdin.write(f"{request_id} {_encode(code)}\n")
+            self.process.stdin.flush()
+        except (OSError, ValueError):
+            self.stop()
+            raise ToolHostUnavailable("工具解释器已退出")
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                line = self.lines.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                self.stop()
+                raise ToolHostTimeout(f"工具执行超时（{timeout} 秒）")
+            if line is None:
+                self.stop()
+                raise ToolHostError("工具解释器意外退出")
+            parts = line.rstrip('\n').split(' ', 3)
+            # 工具直接写到控制台的内容（Out-Host、原生程序等）不是响应，跳过
+            if len(parts) != 4 or parts[0] != request_id:
+                continue
+            try:
+                return int(parts[1]), _decode(parts[2]), _decode(parts[3])
+            except ValueError:
+                continue
+
+class ToolHost:
+    """常驻解释器进程池：预先加载全部工具函数，通过管道接收调用，进程崩溃后自动重启"""
+    def __init__(self, command, size=TOOL_HOST_POOL_SIZE, timeout=TOOL_CALL_TIMEOUT):
+        self.command = command
+        self.timeout = timeout
+        self._definitions = []
+        self._version = 0
+        self._lock = threading.Lock()
+        self._processes = [_HostProcess(command) for _ in range(size)]
+        self._idle = queue.LifoQueue()
+        for host_process in self._processes:
+            self._idle.put(host_process)
+    
+    def set_definitions(self, definitions):
+        """更新需要预先加载的函数定义；各进程在下次调用前重新加载"""
+        with self._lock:
+            if definitions != self._definitions:
+                self._definitions = list(definitions)
+                self._version += 1
+    
+    def prewarm(self):
+        """在后台启动全部解释器并加载函数定义"""
+        for _ in self._processes:
+            threading.Thread(target=self._with_process, args=(self._warm,), daemon=True).start()
+    
+    def _warm(self, host_process):
+        try:
+            self._checkout(host_process)
+        except ToolHostError:
+            pass
+    
+    def _with_process(self, func):
+        host_process = self._idle.get()
+        try:
+            return func(host_process)
+        finally:
+            self._idle.put(host_process)
+    
+    def _checkout(self, host_process):
+        """确保进程在运行且已加载最新的函数定义，返回是否启动了新进程"""
+        with self._lock:
+            definitions, version = self._definitions, self._version
+        spawned = not host_process.alive()
+        if spawned:
+            host_process.start()
+        if host_process.version != version:
+            try:
+                for code in definitions:
+                    # 单个定义出错不影响其他工具
+                    host_process.run(code, self.timeout)
+            except ToolHostUnavailable:
+                raise
+            except ToolHostError as e:
+                # 加载定义没有副作用，失败时本次调用按解释器不可用处理
+                host_process.stop()
+                raise ToolHostUnavailable(f"工具解释器加载函数定义失败：{str(e)}")
+            host_process.version = version
+        return spawned
+    
+    def call(self, code, timings=None):
+        """执行一次工具调用，返回 subprocess.CompletedProcess（returncode/stdout/stderr）
+        
+        timings 为字典时写入各阶段的秒数：wait_s 等待空闲进程，spawn_s 启动进程和加载函数定义
+        （进程已就绪时接近 0），run_s 执行本次调用；spawned 表示是否启动了新进程
+        """
+        requested = time.perf_counter()
+        def run(host_process):
+            acquired = time.perf_counter()
+            spawned = self._checkout(host_process)
+            ready = time.perf_counter()
+            try:
+                returncode, stdout, stderr = host_process.run(code, self.timeout)
+            finally:
+                if timings is not None:
+                    timings.update(
+                        spawned=spawned,
+                        wait_s=round(acquired - requested, 4),
+                        spawn_s=round(ready - acquired, 4),
+                        run_s=round(time.perf_counter() - ready, 4)
+                    )
+            return subprocess.CompletedProcess(self.command, returncode, stdout, stderr)
+        return self._with_process(run)
+    
+    def close(self):
+        """结束全部解释器进程"""
+        for host_process in self._processes:
+            host_process.stop()
+
+class ToolResultCache:
+    """只读工具的结果缓存
+    
+    按工具名和规范化后的参数索引，每个条目按所属工具设置的 TTL 过期，
+    超出容量时淘汰最久未使用的条目。
+    """
+    def __init__(self, max_entries=TOOL_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.enabled = True
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(tool_name, args, version=None):
+        """工具名不区分大小写，参数中的连续空白视为一个空格；version 变化后旧结果自然失效"""
+        return (version, tool_name.lower(), ' '.join(args.split()))
+    
+    def get(self, key):
+        """返回未过期的缓存结果，没有时返回 None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def put(self, key, value, ttl):
+        """保存结果，ttl 为有效秒数"""
+        if not self.enabled or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """清空全部缓存"""
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self):
+        return len(self._entries)
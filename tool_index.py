@@ -0,0 +1,70 @@
+"""工具检索：对工具名称、函数名和示例建立 BM25 词法索引
+
+中文按单字和相邻两字切分，英文按连字符和大小写边界切分（Get-TopProcesses → get / top / processes），
+不依赖分词库，用于每轮只把最相关的几个工具的完整示例交给模型。
+"""
+import math
+import re
+from collections import Counter
+
+# 连续的中文或连续的字母数字
+WORD_PATTERN = re.compile(r'[\u4e00-\u9fff]+|[A-Za-z0-9]+')
+# 驼峰拆分：HTTPServer → HTTP / Server，TopProcesses → Top / Processes
+CAMEL_PATTERN = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+def tokenize(text):
+    """把文本切分为检索用的词项"""
+    tokens = []
+    for match in WORD_PATTERN.finditer(text or ''):
+        word = match.group()
+        if '\u4e00' <= word[0] <= '\u9fff':
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            parts = CAMEL_PATTERN.findall(word)
+            tokens.extend(part.lower() for part in parts)
+            if len(parts) > 1:
+                tokens.append(word.lower())
+    return tokens
+
+class ToolIndex:
+    """工具列表的 BM25 索引"""
+    def __init__(self, entries=()):
+        """entries 为 [(工具, 函数名)]"""
+        self.tools = []
+        self._docs = []
+        self._lengths = []
+        df = Counter()
+        for tool, function_name in entries:
+            self.tools.append(tool)
+            text = " ".join((tool.get('name', ''), function_name or '', tool.get('example', '')))
+            terms = Counter(tokenize(text))
+            self._docs.append(terms)
+            self._lengths.append(sum(terms.values()))
+            df.update(terms.keys())
+        count = len(self.tools)
+        self._avg_length = sum(self._lengths) / count if count else 0
+        self._idf = {
+            term: math.log(1 + (count - n + 0.5) / (n + 0.5))
+            for term, n in df.items()
+        }
+
+    def search(self, query, top_k):
+        """返回与查询最相关的至多 top_k 个工具（按得分从高到低，不含零分）"""
+        terms = set(tokenize(query))
+        scored = []
+        for i, doc in enumerate(self._docs):
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[i] / (self._avg_length or 1))
+            for term in terms:
+                tf = doc.get(term)
+                if tf:
+                    score += self._idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+            if score > 0:
+                scored.append((score, i))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [self.tools[i] for _, i in scored[:top_k]]
@@ -0,0 +1,337 @@
+"""工具注册表：tools_config.json 的内存索引
+
+文件只在修改时间、大小或内容变化时重新解析，工具按函数名建立索引；
+解析失败时保留上一次成功加载的工具，错误信息只报告一次。
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+from tool_index import ToolIndex
+
+# 从工具代码中解析函数名，例如 "function Get-SystemInfo {"
+FUNCTION_NAME_PATTERN = re.compile(r'^\s*function\s+([\w-]+)', re.IGNORECASE)
+
+# 函数的 param( 块、参数名、类型和属性
+PARAM_BLOCK_PATTERN = re.compile(r'\bparam\s*\(', re.IGNORECASE)
+PARAM_VARIABLE_PATTERN = re.compile(r'\s*\$(\w+)')
+PARAM_ATTRIBUTE_PATTERN = re.compile(r'\s*\[\s*([\w.]+)\s*(\[\s*\])?\s*(?:\((.*?)\))?\s*\]', re.DOTALL)
+
+# PowerShell 参数类型到 JSON Schema 类型的映射，未列出的类型按字符串处理
+PARAM_TYPES = {
+    'int': 'integer', 'int32': 'integer', 'int64': 'integer', 'long': 'integer',
+    'double': 'number', 'float': 'number', 'single': 'number', 'decimal': 'number',
+    'bool': 'boolean', 'boolean': 'boolean', 'switch': 'boolean',
+}
+
+def parse_function_name(code):
+    """返回工具代码定义的函数名，无法识别时返回 None"""
+    match = FUNCTION_NAME_PATTERN.match(code or '')
+    return match.group(1) if match else None
+
+def _split_top_level(text):
+    """按不在括号或引号内的逗号切分"""
+    parts, depth, quote, start = [], 0, None, 0
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+def _parse_validate_set(arguments):
+    """解析 [ValidateSet('a', 'b')] 的取值列表，未加引号的数字按数字处理"""
+    values = []
+    for item in _split_top_level(arguments or ''):
+        item = item.strip()
+        if not item:
+            continue
+        if item[0] in '\'"' and item[-1] == item[0] and len(item) > 1:
+            values.append(item[1:-1])
+        elif '=' in item:
+            # IgnoreCase = $false 等命名参数
+            continue
+        else:
+            try:
+                values.append(int(item))
+            except ValueError:
+                try:
+                    values.append(float(item))
+                except ValueError:
+                    values.append(item)
+    return values
+
+def parse_parameters(code):
+    """解析函数第一个 param() 块，返回 [{name, type, required, default, enum}]"""
+    match = PARAM_BLOCK_PATTERN.search(code or '')
+    if not match:
+        return []
+    # 找到与 param( 配对的右括号
+    depth, end = 1, match.end()
+    while end < len(code) and depth:
+        if code[end] == '(':
+            depth += 1
+        elif code[end] == ')':
+            depth -= 1
+        end += 1
+    
+    parameters = []
+    for part in _split_top_level(code[match.end():end - 1]):
+        # 参数名之前是 [Parameter(...)]、[类型] 等属性
+        attributes = []
+        position = 0
+        while True:
+            attribute = PARAM_ATTRIBUTE_PATTERN.match(part, position)
+            if not attribute:
+                break
+            attributes.append(attribute.groups())
+            position = attribute.end()
+        variable = PARAM_VARIABLE_PATTERN.match(part, position)
+        if not variable:
+            continue
+        param_type, required, enum = 'string', False, None
+        for name, is_array, arguments in attributes:
+            if name.lower() == 'parameter':
+                required = bool(re.search(r'mandatory(?!\s*=\s*\$false)', arguments or '', re.IGNORECASE))
+            elif name.lower() == 'validateset':
+                enum = _parse_validate_set(arguments) or None
+            elif not name.lower().startswith('validate'):
+                param_type = 'array' if is_array else PARAM_TYPES.get(name.lower(), 'string')
+                if name.lower() == 'switch':
+                    param_type = 'switch'
+        default = part[variable.end():].partition('=')[2].strip() or None
+        parameters.append({
+            'name': variable.group(1),
+            'type': param_type,
+            'required': required,
+            'default': default,
+            'enum': enum
+        })
+    return parameters
+
+def _quote(value):
+    """转为 PowerShell 单引号字符串"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def format_arguments(parameters, arguments):
+    """把函数调用的 JSON 参数转换为 PowerShell 命令行参数，未声明的参数被忽略"""
+    declared = {param['name'].lower(): param for param in parameters}
+    parts = []
+    for key, value in arguments.items():
+        param = declared.get(str(key).lower())
+        if param is None or value is None:
+            continue
+        name = param['name']
+        if param['type'] == 'switch':
+            if value:
+                parts.append(f"-{name}")
+        elif isinstance(value, bool):
+            parts.append(f"-{name}:${'true' if value else 'false'}")
+        elif isinstance(value, (int, float)):
+            parts.append(f"-{name} {value}")
+        elif isinstance(value, list):
+            parts.append(f"-{name} " + ", ".join(_quote(item) for item in value))
+        else:
+            parts.append(f"-{name} {_quote(value)}")
+    return " ".join(parts)
+
+def parse_cache_ttl(value):
+    """把工具配置中的 cache_ttl 转换为非负秒数，无法识别时返回 0（不缓存）"""
+    if isinstance(value, bool):
+        return 0
+    try:
+        ttl = float(value)
+    except (TypeError, ValueError):
+        return 0
+    if not ttl > 0 or ttl == float('inf'):
+        return 0
+    return int(ttl) if ttl.is_integer() else ttl
+
+def build_schema(function_name, tool, parameters):
+    """生成 OpenAI 风格的函数调用描述"""
+    properties = {}
+    for param in parameters:
+        param_type = param['type']
+        if param_type == 'switch':
+            schema = {'type': 'boolean'}
+        elif param_type == 'array':
+            schema = {'type': 'array', 'items': {'type': 'string'}}
+        else:
+            schema = {'type': param_type}
+        # [ValidateSet(...)] 限定的取值
+        if param.get('enum'):
+            target = schema['items'] if param_type == 'array' else schema
+            target['enum'] = [
+                value if param_type in ('integer', 'number') or isinstance(value, str) else str(value)
+                for value in param['enum']
+            ]
+        if param['default'] is not None:
+            schema['description'] = f"默认值：{param['default']}"
+        properties[param['name']] = schema
+    return {
+        'type': 'function',
+        'function': {
+            'name': function_name,
+            'description': tool.get('example') or tool.get('name', function_name),
+            'parameters': {
+                'type': 'object',
+                'properties': properties,
+                'required': [param['name'] for param in parameters if param['required']]
+            }
+        }
+    }
+
+class ToolRegistry:
+    """按函数名索引的工具表，文件变化时自动重新加载"""
+    def __init__(self, path='tools_config.json'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._tools = []
+        self._index = {}
+        self._definitions = []
+        self._parameters = {}
+        self._schemas = []
+        self._names = {}
+        # 检索索引按需构建：(版本, ToolIndex)
+        self._search_index = None
+        self._stamp = None
+        self._digest = None
+        # 每次工具内容变化时递增，供提示词缓存等判断是否需要重建
+        self.version = 0
+        self._error = None
+        self._error_reported = False
+        self.refresh()
+
+    def refresh(self, force=False):
+        """文件变化时重新加载，返回是否加载了新内容"""
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamp = None
+
+        with self._lock:
+            if stamp == self._stamp and not force:
+                return False
+            self._stamp = stamp
+
+            if stamp is None:
+                data = b''
+            else:
+                try:
+                    with open(self.path, 'rb') as f:
+                        data = f.read()
+                except OSError as e:
+                    self._set_error(f"无法读取工具配置：{str(e)}")
+                    return False
+
+            # 只修改了时间而内容相同（例如重新保存）时不必重新解析
+            digest = hashlib.sha1(data).hexdigest()
+            if digest == self._digest:
+                return False
+            self._digest = digest
+
+            try:
+                tools = json.loads(data.decode('utf-8-sig')) if data else []
+                if not isinstance(tools, list):
+                    raise ValueError("顶层必须是工具列表")
+            except ValueError as e:
+                self._set_error(f"工具配置解析失败，继续使用上一次加载的工具：{str(e)}")
+                return False
+
+            self._tools = tools
+            self._index = {}
+            self._parameters = {}
+            self._schemas = []
+            self._names = {}
+            for i, tool in enumerate(tools):
+                # 手工编辑的配置中 cache_ttl 可能是字符串或其他无效值
+                if 'cache_ttl' in tool:
+                    tool['cache_ttl'] = parse_cache_ttl(tool['cache_ttl'])
+                name = parse_function_name(tool.get('code', ''))
+                self._names[i] = name
+                if name:
+                    parameters = parse_parameters(tool['code'])
+                    self._index[name.lower()] = tool
+                    self._parameters[name.lower()] = parameters
+                    self._schemas.append(build_schema(name, tool, parameters))
+            self._definitions = [tool['code'] for tool in tools if tool.get('code')]
+            self._error = None
+            self.version += 1
+            return True
+
+    def _set_error(self, message):
+        if message != self._error:
+            self._error = message
+            self._error_reported = False
+
+    def take_error(self):
+        """返回尚未报告过的加载错误（每个错误只返回一次）"""
+        with self._lock:
+            if self._error and not self._error_reported:
+                self._error_reported = True
+                return self._error
+            return None
+
+    def tools(self):
+        """返回全部工具（只读）"""
+        self.refresh()
+        return self._tools
+
+    def get(self, function_name):
+        """按函数名查找工具，函数名不区分大小写"""
+        self.refresh()
+        return self._index.get(function_name.lower())
+
+    def definitions(self):
+        """返回全部工具的函数定义代码"""
+        self.refresh()
+        return self._definitions
+
+    def schemas(self):
+        """返回全部工具的函数调用描述（原生函数调用模式下随请求发送）"""
+        self.refresh()
+        return self._schemas
+    
+    def format_arguments(self, function_name, arguments):
+        """把函数调用的 JSON 参数转换为该工具的 PowerShell 命令行参数"""
+        self.refresh()
+        return format_arguments(self._parameters.get(function_name.lower(), []), arguments)
+    
+    def catalogue(self, brief=False):
+        """生成写入系统提示词的工具列表；brief 为 True 时每个工具只列出名称和函数名"""
+        tools = self.tools()
+        if not tools:
+            return "没有可用的工具"
+        if brief:
+            return "".join(
+                f"- {tool['name']}: {self._names.get(i) or ''}\n" for i, tool in enumerate(tools)
+            )
+        return "".join(f"- {tool['name']}: {tool.get('example', '')}\n" for tool in tools)
+    
+    def relevant(self, query, top_k):
+        """按 BM25 检索与查询最相关的至多 top_k 个工具"""
+        self.refresh()
+        with self._lock:
+            if self._search_index is None or self._search_index[0] != self.version:
+                entries = [(tool, self._names.get(i)) for i, tool in enumerate(self._tools)]
+                self._search_index = (self.version, ToolIndex(entries))
+            index = self._search_index[1]
+        return index.search(query, top_k)
+
+    def save(self, tools):
+        """保存工具列表并立即重新加载"""
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(tools, f, ensure_ascii=False, indent=4)
+        self.refresh(force=True)